@@ -2,6 +2,7 @@ import ipaddress, subprocess, datetime, os, util
 from datetime import datetime, timedelta
 from flask import jsonify
 from util import *
+from dashboard import SystemCommands
 import configparser
 
 notEnoughParameter = {"status": False, "reason": "Please provide all required parameters."}
@@ -13,36 +14,35 @@ def ret(status=True, reason="", data=""):
 
 
 def togglePeerAccess(data, g):
-    checkUnlock = g.cur.execute(f"SELECT * FROM {data['config']} WHERE id='{data['peerID']}'").fetchone()
+    checkUnlock = g.cur.execute(f"SELECT * FROM {data['config']} WHERE id='{data['peerID']}' AND state = 'active'").fetchone()
     if checkUnlock:
-        moveUnlockToLock = g.cur.execute(
-            f"INSERT INTO {data['config']}_restrict_access SELECT * FROM {data['config']} WHERE id = '{data['peerID']}'")
-        if g.cur.rowcount == 1:
-            print(g.cur.rowcount)
-            print(util.deletePeers(data['config'], [data['peerID']], g.cur, g.db))
+        try:
+            SystemCommands.run(["wg", "set", data['config'], "peer", data['peerID'], "remove"])
+            SystemCommands.run(["wg-quick", "save", data['config']])
+        except subprocess.CalledProcessError as exc:
+            return {"status": False, "reason": str(exc.output.strip())}
+        g.cur.execute(
+            f"UPDATE {data['config']} SET state = 'restricted', status = 'stopped' WHERE id = '{data['peerID']}'")
+        g.db.commit()
     else:
         moveLockToUnlock = g.cur.execute(
-            f"SELECT * FROM {data['config']}_restrict_access WHERE id = '{data['peerID']}'").fetchone()
+            f"SELECT * FROM {data['config']} WHERE id = '{data['peerID']}' AND state = 'restricted'").fetchone()
         try:
-            if len(moveLockToUnlock[-1]) == 0:
-                status = subprocess.check_output(
-                    f"wg set {data['config']} peer {moveLockToUnlock[0]} allowed-ips {moveLockToUnlock[11]}",
-                    shell=True, stderr=subprocess.STDOUT)
+            if len(moveLockToUnlock[18]) == 0:
+                status = SystemCommands.run(
+                    ["wg", "set", data['config'], "peer", moveLockToUnlock[0], "allowed-ips", moveLockToUnlock[11]])
             else:
                 now = str(datetime.datetime.now().strftime("%m%d%Y%H%M%S"))
                 f_name = now + "_tmp_psk.txt"
                 f = open(f_name, "w+")
-                f.write(moveLockToUnlock[-1])
+                f.write(moveLockToUnlock[18])
                 f.close()
-                subprocess.check_output(
-                    f"wg set {data['config']} peer {moveLockToUnlock[0]} allowed-ips {moveLockToUnlock[11]} preshared-key {f_name}",
-                    shell=True, stderr=subprocess.STDOUT)
+                SystemCommands.run(
+                    ["wg", "set", data['config'], "peer", moveLockToUnlock[0], "allowed-ips", moveLockToUnlock[11],
+                     "preshared-key", f_name])
                 os.remove(f_name)
-            status = subprocess.check_output(f"wg-quick save {data['config']}", shell=True, stderr=subprocess.STDOUT)
-            g.cur.execute(
-                f"INSERT INTO {data['config']} SELECT * FROM {data['config']}_restrict_access WHERE id = '{data['peerID']}'")
-            if g.cur.rowcount == 1:
-                g.cur.execute(f"DELETE FROM {data['config']}_restrict_access WHERE id = '{data['peerID']}'")
+            status = SystemCommands.run(["wg-quick", "save", data['config']])
+            g.cur.execute(f"UPDATE {data['config']} SET state = 'active' WHERE id = '{data['peerID']}'")
 
         except subprocess.CalledProcessError as exc:
             return {"status": False, "reason": str(exc.output.strip())}
@@ -99,8 +99,11 @@ class manageConfiguration:
         for i in configs:
             if i['port'] == port:
                 return {"status": False, "reason": f"{port} used by {i['conf']}."}
-        checkSystem = subprocess.run(f'ss -tulpn | grep :{port} > /dev/null', shell=True)
-        if checkSystem.returncode != 1:
+        try:
+            checkSystem = SystemCommands.run(["ss", "-tulpn"]).decode()
+        except subprocess.CalledProcessError:
+            checkSystem = ""
+        if f":{port}" in checkSystem:
             return {"status": False, "reason": f"Port {port} used by other process in your system."}
         return good
 
@@ -157,12 +160,11 @@ class manageConfiguration:
             if i['conf'] == data['name']:
                 if i['status'] == "running":
                     try:
-                        subprocess.check_output("wg-quick down " + data['name'], shell=True, stderr=subprocess.STDOUT)
+                        SystemCommands.run(["wg-quick", "down", data['name']])
                     except subprocess.CalledProcessError as exc:
                         return {"status": False, "reason": "Can't stop peer", "data": str(exc.output.strip().decode("utf-8"))}
 
             g.cur.execute(f'DROP TABLE {data["name"]}')
-            g.cur.execute(f'DROP TABLE {data["name"]}_restrict_access')
             g.db.commit()
 
             try:
@@ -213,16 +215,14 @@ class manageConfiguration:
                 
 
                 try:
-                    check = subprocess.check_output("wg-quick down " + configName,
-                                                    shell=True, stderr=subprocess.STDOUT)
+                    check = SystemCommands.run(["wg-quick", "down", configName])
                 except subprocess.CalledProcessError as exc:
                     pass
                 with open(f'{WG_CONF_PATH}/{configName}.conf', 'w') as f:
                     for i in newData:
                         f.write(i)
                 try:
-                    check = subprocess.check_output("wg-quick up " + configName,
-                                                    shell=True, stderr=subprocess.STDOUT)
+                    check = SystemCommands.run(["wg-quick", "up", configName])
                 except subprocess.CalledProcessError as exc:
                     pass
                 return ret()
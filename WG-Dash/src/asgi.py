@@ -0,0 +1,224 @@
+"""
+ASGI entry point for WGDashboard.
+
+Every route is still served by the Flask app, through a thread pool, except the ping, traceroute and sweep
+diagnostics. Those run as coroutines on the event loop with icmplib's async sockets, so a traceroute that takes a minute never
+holds one of the threads serving peer lists. Authentication, access logging, CORS and the session are handled by
+Flask for the diagnostics as well.
+
+Select it with app_server = asgi under [Server] in wg-dashboard.ini, which makes gunicorn.conf.py run uvicorn
+workers, or run it on its own with `python3 asgi.py`.
+"""
+import asyncio
+import inspect
+import json
+import urllib.parse
+
+from a2wsgi import WSGIMiddleware
+from flask import request
+from icmplib import AsyncSocket, Hop, ICMPLibError, ICMPRequest, ICMPv4Socket, ICMPv6Socket, TimeExceeded, \
+    async_ping, async_resolve
+from icmplib.utils import is_hostname, is_ipv6_address, unique_identifier
+from werkzeug.test import EnvironBuilder
+
+import dashboard
+
+
+async def asyncTraceroute(address, count=2, interval=0.05, timeout=2, first_hop=1, max_hops=30, source=None,
+                          family=None) -> list[Hop]:
+    """
+    icmplib.traceroute on an AsyncSocket
+    """
+    if is_hostname(address):
+        address = (await async_resolve(address, family))[0]
+    socket = ICMPv6Socket if is_ipv6_address(address) else ICMPv4Socket
+    id = unique_identifier()
+    ttl = first_hop
+    hostReached = False
+    hops = []
+    with AsyncSocket(socket(source)) as sock:
+        while not hostReached and ttl <= max_hops:
+            reply = None
+            packetsSent = 0
+            rtts = []
+            for sequence in range(count):
+                icmpRequest = ICMPRequest(destination=address, id=id, sequence=sequence, ttl=ttl)
+                try:
+                    sock.send(icmpRequest)
+                    packetsSent += 1
+                    reply = await sock.receive(icmpRequest, timeout)
+                    rtts.append((reply.time - icmpRequest.time) * 1000)
+                    reply.raise_for_status()
+                    hostReached = True
+                except TimeExceeded:
+                    await asyncio.sleep(interval)
+                except ICMPLibError:
+                    break
+            if reply:
+                hops.append(Hop(address=reply.source, packets_sent=packetsSent, rtts=rtts, distance=ttl))
+            ttl += 1
+    return hops
+
+
+async def fetchJSON(url: str, body: bytes = None):
+    """
+    Plain HTTP/1.0 GET, or POST when body is given, of a JSON document. None if it fails or takes longer than
+    GEO_LOOKUP_TIMEOUT
+    """
+    async def fetch():
+        parts = urllib.parse.urlsplit(url)
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            target = parts.path + (f"?{parts.query}" if parts.query else "")
+            head = f"{'GET' if body is None else 'POST'} {target} HTTP/1.0\r\nHost: {parts.hostname}\r\n"
+            if body is not None:
+                head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            writer.write(head.encode() + b"\r\n" + (body or b""))
+            response = await reader.read()
+        finally:
+            writer.close()
+        status, _, payload = response.partition(b"\r\n\r\n")
+        if status.split(b" ")[1:2] != [b"200"]:
+            return None
+        return json.loads(payload)
+    try:
+        return await asyncio.wait_for(fetch(), dashboard.GEO_LOOKUP_TIMEOUT)
+    except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+        return None
+
+
+async def pingExecute(args: dict) -> tuple[bool, str | None, object]:
+    ip, count = args.get("ipAddress"), args.get("count")
+    if ip is None or count is None:
+        return False, "Please provide ipAddress and count", None
+    if len(ip) == 0 or not count.isnumeric():
+        return False, "Please specify an IP Address (v4/v6)", None
+    data = dashboard._pingResult(await async_ping(ip, count=int(count), source=None))
+    data['geo'] = await fetchJSON(dashboard.GEO_LOOKUP_URL % data['address'])
+    return True, None, data
+
+
+async def tracerouteExecute(args: dict) -> tuple[bool, str | None, object]:
+    ipAddress = args.get("ipAddress")
+    if ipAddress is None or len(ipAddress) == 0:
+        return False, "Please provide ipAddress", None
+    result = dashboard._tracerouteResult(await asyncTraceroute(
+        ipAddress, timeout=dashboard.TRACEROUTE_TIMEOUT, max_hops=dashboard.TRACEROUTE_MAX_HOPS))
+    d = await fetchJSON(dashboard.GEO_BATCH_URL, json.dumps([x['ip'] for x in result]).encode())
+    if d is not None:
+        for i in range(len(result)):
+            result[i]['geo'] = d[i]
+    return True, None, result
+
+
+async def sweepExecute(args: dict) -> tuple[bool, str | None, object]:
+    try:
+        targets, concurrency, timeout, count = dashboard._sweepRequest(args)
+    except ValueError as e:
+        return False, str(e), None
+    return True, None, dashboard.sweepPeers(targets, concurrency, timeout, count)
+
+
+class DashboardASGI:
+    """
+    Routes the diagnostics to their coroutines and everything else to the Flask app
+    """
+    Diagnostics = {
+        f"{dashboard.APP_PREFIX}/api/ping/execute": pingExecute,
+        f"{dashboard.APP_PREFIX}/api/traceroute/execute": tracerouteExecute,
+        f"{dashboard.APP_PREFIX}/api/ping/sweep": sweepExecute
+    }
+
+    def __init__(self):
+        # app_threads is the size of the pool the Flask routes run in, as it is for gthread workers
+        self.wsgi = WSGIMiddleware(dashboard.app, workers=dashboard.gunicornConfig()[3])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.__lifespan(receive, send)
+        handler = self.Diagnostics.get(scope["path"]) if scope["type"] == "http" else None
+        if handler is None or scope["method"] != "GET":
+            return await self.wsgi(scope, receive, send)
+
+        environ = self.__environ(scope)
+        with dashboard.app.request_context(environ):
+            # Runs auth_req, so the request is logged and checked exactly like the Flask route
+            denied = dashboard.app.preprocess_request()
+            caller = dashboard._diagnosticCaller()
+            args = request.args.to_dict()
+        if denied is not None:
+            return await self.__respond(environ, send, lambda: dashboard.app.make_response(denied))
+        if not dashboard.Diagnostics.acquire(caller):
+            return await self.__respond(environ, send, lambda: dashboard._diagnosticBusy())
+        try:
+            try:
+                status, message, data = await handler(args)
+            except Exception as exp:
+                status, message, data = False, str(exp), None
+            if inspect.isasyncgen(data):
+                return await self.__stream(environ, send, data)
+        finally:
+            dashboard.Diagnostics.release(caller)
+        await self.__respond(environ, send, lambda: dashboard.ResponseObject(status, message, data))
+
+    @staticmethod
+    def __environ(scope) -> dict:
+        client = scope.get("client") or ("", 0)
+        return EnvironBuilder(
+            path=scope["path"], method=scope["method"], query_string=scope["query_string"].decode("latin1"),
+            headers=[(k.decode("latin1"), v.decode("latin1")) for k, v in scope["headers"]],
+            environ_base={"REMOTE_ADDR": client[0]}).get_environ()
+
+    @staticmethod
+    def __headers(response) -> list[tuple[bytes, bytes]]:
+        return [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in response.headers.items()
+                if k.lower() != "content-length"]
+
+    @staticmethod
+    async def __respond(environ: dict, send, response):
+        with dashboard.app.request_context(environ):
+            r = dashboard.app.process_response(response())
+            body = r.get_data()
+            headers = DashboardASGI.__headers(r)
+        await send({"type": "http.response.start", "status": r.status_code,
+                    "headers": headers + [(b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def __stream(environ: dict, send, lines):
+        """
+        Send each line of a sweep as newline delimited JSON as soon as it is yielded
+        """
+        with dashboard.app.request_context(environ):
+            r = dashboard.app.process_response(dashboard.app.response_class(mimetype="application/x-ndjson"))
+            headers = DashboardASGI.__headers(r)
+        await send({"type": "http.response.start", "status": r.status_code, "headers": headers})
+        try:
+            async for line in lines:
+                await send({"type": "http.response.body", "body": (json.dumps(line) + "\n").encode(),
+                            "more_body": True})
+        except ICMPLibError as exp:
+            await send({"type": "http.response.body", "body": (json.dumps({"error": str(exp)}) + "\n").encode(),
+                        "more_body": True})
+        finally:
+            await lines.aclose()
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def __lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = DashboardASGI()
+
+if __name__ == "__main__":
+    import uvicorn
+    dashboard.startThreads()
+    dashboard.startCollector()
+    uvicorn.run(application, host=dashboard.app_ip, port=int(dashboard.app_port))
@@ -1,36 +1,57 @@
+import array
+import asyncio
+import atexit
+import base64
+import bisect
+import collections
 import itertools
 import random
 import shutil
 import sqlite3
 import configparser
+import gzip
+import contextlib
+import copy
+import fcntl
 import hashlib
+import heapq
 import ipaddress
 import json
+import mmap
+import math
 import traceback
+import types
 # Python Built-in Library
 import os
+import queue
 import secrets
+import signal
+import struct
 import subprocess
+import tempfile
 import time
 import re
 import urllib.error
 import uuid
-from datetime import datetime, timedelta
-from typing import Any
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
 
 import bcrypt
 # PIP installed library
 import ifcfg
 import psutil
 import pyotp
-from flask import Flask, request, render_template, session, g
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from flask import Flask, request, render_template, session, g, send_from_directory
 from json import JSONEncoder
 from flask_cors import CORS
 
-from icmplib import ping, traceroute
+from icmplib import ping, traceroute, async_multiping
 
 # Import other python files
 import threading
+import passwordcheck
 
 from flask.json.provider import DefaultJSONProvider
 
@@ -44,6 +65,12 @@ CONFIGURATION_PATH = os.getenv('CONFIGURATION_PATH', '.')
 DB_PATH = os.path.join(CONFIGURATION_PATH, 'db')
 if not os.path.isdir(DB_PATH):
     os.mkdir(DB_PATH)
+LOCK_PATH = os.path.join(DB_PATH, 'locks')
+if not os.path.isdir(LOCK_PATH):
+    os.mkdir(LOCK_PATH)
+STATE_PATH = os.path.join(DB_PATH, 'state')
+if not os.path.isdir(STATE_PATH):
+    os.mkdir(STATE_PATH)
 DASHBOARD_CONF = os.path.join(CONFIGURATION_PATH, 'dashboard_config','wg-dashboard.ini')
 
 # WireGuard's configuration path
@@ -55,7 +82,25 @@ UPDATE = None
 
 app = Flask("WGDashboard")
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 5206928
-app.secret_key = secrets.token_urlsafe(32)
+
+
+def _secretKey() -> str:
+    """
+    Session key shared by every gunicorn worker. It is created once next to the databases, so a session signed
+    by one worker is accepted by the others and survives a restart
+    """
+    path = os.path.join(DB_PATH, 'secret_key')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    key = secrets.token_urlsafe(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key
+
+app.secret_key = _secretKey()
 
 #Docker ENV ARGS Import
 load_dotenv()
@@ -71,6 +116,8 @@ if wgd_remote_endpoint == '0.0.0.0':
     wgd_remote_endpoint = default_interface['inet']
 wgd_keep_alive = os.environ.get('WGD_KEEP_ALIVE')
 wgd_mtu = os.environ.get('WGD_MTU')
+wgd_app_workers = os.environ.get('WGD_APP_WORKERS', '2')
+wgd_app_threads = os.environ.get('WGD_APP_THREADS', '4')
 
 
 
@@ -107,13 +154,143 @@ class CustomJsonEncoder(DefaultJSONProvider):
                 or isinstance(o, PeerJob) 
                 or isinstance(o, Log) 
                 or isinstance(o, DashboardAPIKey)
-                or isinstance(o, PeerShareLink)):
+                or isinstance(o, PeerShareLink)
+                or isinstance(o, DashboardOperation)):
             return o.toJson()
         return super().default(self, o)
 
 
 app.json = CustomJsonEncoder(app)
 
+class SQLiteConnectionManager:
+    """
+    Hands out one connection per thread for a database file, so the request threads, the background thread and
+    the operation workers never share a connection. Every connection runs in WAL mode, where readers keep
+    reading a consistent snapshot while a writer commits. Statements that still hit a lock after the busy
+    timeout are retried with a backoff, unless they are part of a transaction().
+    """
+    BusyTimeout = 5
+    Retries = 5
+    RetryBackoff = 0.05
+    Pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY"
+    }
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__local = threading.local()
+        # Connections must not cross a fork, the gunicorn workers and the collector each open their own
+        os.register_at_fork(after_in_child=self.__forget)
+
+    def __forget(self):
+        self.__local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.__local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.BusyTimeout)
+            conn.row_factory = sqlite3.Row
+            for pragma, value in self.Pragmas.items():
+                conn.execute(f"PRAGMA {pragma} = {value}")
+            self.__local.connection = conn
+            self.__local.depth = 0
+        return conn
+
+    def modifiedTime(self) -> int:
+        """
+        Latest modification time of the database and its write-ahead log. It changes whenever any process commits,
+        which lets a process notice writes from the others without querying
+        """
+        mtime = 0
+        for path in [self.path, self.path + "-wal"]:
+            try:
+                mtime = max(mtime, os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return mtime
+
+    def close(self):
+        conn = getattr(self.__local, "connection", None)
+        if conn is not None:
+            conn.close()
+            self.__local.connection = None
+
+    @staticmethod
+    def __isLocked(error: sqlite3.OperationalError) -> bool:
+        return "locked" in str(error) or "busy" in str(error)
+
+    def __run(self, method: str, statement: str, parameters, commit: bool) -> sqlite3.Cursor:
+        conn = self.connection()
+        inTransaction = self.__local.depth > 0
+        for attempt in range(self.Retries + 1):
+            try:
+                cursor = getattr(conn, method)(statement, parameters)
+                if commit and not inTransaction and conn.in_transaction:
+                    conn.commit()
+                return cursor
+            except sqlite3.OperationalError as error:
+                if inTransaction or not self.__isLocked(error) or attempt == self.Retries:
+                    raise
+                if conn.in_transaction:
+                    conn.rollback()
+                time.sleep(self.RetryBackoff * (2 ** attempt))
+
+    def execute(self, statement: str, parameters: tuple | dict = (), commit: bool = False) -> sqlite3.Cursor:
+        return self.__run("execute", statement, parameters, commit)
+
+    def executemany(self, statement: str, parameters: list, commit: bool = False) -> sqlite3.Cursor:
+        return self.__run("executemany", statement, parameters, commit)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run several statements atomically. Nested transactions join the outermost one.
+        """
+        conn = self.connection()
+        self.__local.depth += 1
+        try:
+            if self.__local.depth == 1 and not conn.in_transaction:
+                # Take the write lock up front, and make schema changes part of the transaction as well
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            if self.__local.depth == 1:
+                conn.commit()
+        except Exception:
+            if self.__local.depth == 1 and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.__local.depth -= 1
+
+    def migrate(self, scope: str, migrations: list) -> int:
+        """
+        Bring the schema of scope up to len(migrations). Migration n is migrations[n - 1], a callable taking the
+        connection. Each one runs in its own transaction together with the version bump, so an install that
+        fails halfway resumes from the last applied version on the next start.
+        """
+        with self.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS schema_version (Scope VARCHAR NOT NULL PRIMARY KEY, "
+                         "Version INT NOT NULL, UpdatedAt DATETIME DEFAULT (datetime('now', 'localtime')))")
+        current = self.execute("SELECT Version FROM schema_version WHERE Scope = ?", (scope,)).fetchone()
+        current = 0 if current is None else current['Version']
+        for version in range(current + 1, len(migrations) + 1):
+            with self.transaction() as conn:
+                migrations[version - 1](conn)
+                conn.execute("INSERT INTO schema_version (Scope, Version) VALUES (?, ?) ON CONFLICT (Scope) "
+                             "DO UPDATE SET Version = excluded.Version, UpdatedAt = datetime('now', 'localtime')",
+                             (scope, version,))
+            print(f"[WGDashboard] Migrated {scope} to schema version {version}")
+        return max(current, len(migrations))
+
+DashboardDatabase: SQLiteConnectionManager = SQLiteConnectionManager(os.path.join(DB_PATH, 'wgdashboard.db'))
+LogDatabase: SQLiteConnectionManager = SQLiteConnectionManager(os.path.join(DB_PATH, 'wgdashboard_log.db'))
+JobDatabase: SQLiteConnectionManager = SQLiteConnectionManager(os.path.join(DB_PATH, 'wgdashboard_job.db'))
+LoginDatabase: SQLiteConnectionManager = SQLiteConnectionManager(os.path.join(DB_PATH, 'wgdashboard_login.db'))
+
 class Log:
     def __init__(self, LogID: str, JobID: str, LogDate: str, Status: str, Message: str):
         self.LogID = LogID
@@ -135,61 +312,170 @@ class Log:
         return self.toJson()
     
 class DashboardLogger:
+    """
+    Access log. log() only filters the entry and puts it on a bounded queue; a writer thread inserts whatever is
+    queued in one transaction per batch, so requests never wait for the log database.
+    The level (Server.dashboard_log_level) decides which categories are kept: none < auth < write < all, and
+    read requests can be sampled with Server.dashboard_log_sample_rate (0 to 1).
+    """
+    Levels = {"none": 0, "auth": 1, "write": 2, "all": 3}
+    Categories = {"system": 1, "auth": 1, "write": 2, "request": 3}
+    QueueSize = 10000
+    BatchSize = 500
+    FlushInterval = 1
+
     def __init__(self):
-        self.loggerdb = sqlite3.connect(os.path.join(CONFIGURATION_PATH, 'db', 'wgdashboard_log.db'),
-                                        check_same_thread=False)
-        self.loggerdb.row_factory = sqlite3.Row
+        self.__queue: queue.Queue = queue.Queue(maxsize=self.QueueSize)
+        self.__writer: threading.Thread | None = None
+        self.__flushLock = threading.Lock()
+        self.Written = 0
+        self.Dropped = 0
+        self.Sampled = 0
         self.__createLogDatabase()
-        self.log(Message="WGDashboard started")
+        # Write what is queued before forking, a child would otherwise write the same entries again
+        os.register_at_fork(before=self.flush, after_in_child=self.__forget)
+        self.log(Message="WGDashboard started", Category="system")
+
+    def __forget(self):
+        self.__queue = queue.Queue(maxsize=self.QueueSize)
+        self.__writer = None
+        self.__flushLock = threading.Lock()
+
+    @property
+    def loggerdb(self) -> sqlite3.Connection:
+        return LogDatabase.connection()
+
     def __createLogDatabase(self):
-        with self.loggerdb:
-            loggerdbCursor = self.loggerdb.cursor()
-            existingTable = loggerdbCursor.execute("SELECT name from sqlite_master where type='table'").fetchall()
-            existingTable = [t['name'] for t in existingTable]
-            if "DashboardLog" not in existingTable:
-                loggerdbCursor.execute(
-                    "CREATE TABLE DashboardLog (LogID VARCHAR NOT NULL, LogDate DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now', 'localtime')), URL VARCHAR, IP VARCHAR, Status VARCHAR, Message VARCHAR, PRIMARY KEY (LogID))")
-            if self.loggerdb.in_transaction:
-                self.loggerdb.commit()
+        LogDatabase.migrate("DashboardLog", [
+            lambda conn: conn.execute(
+                "CREATE TABLE IF NOT EXISTS DashboardLog (LogID VARCHAR NOT NULL, LogDate DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now', 'localtime')), URL VARCHAR, IP VARCHAR, Status VARCHAR, Message VARCHAR, PRIMARY KEY (LogID))"),
+            lambda conn: conn.execute("CREATE INDEX IF NOT EXISTS DashboardLog_LogDate ON DashboardLog (LogDate)")
+        ])
     
-    def log(self, URL: str = "", IP: str = "", Status: str = "true", Message: str = "") -> bool:
+    def log(self, URL: str = "", IP: str = "", Status: str = "true", Message: str | Callable[[], str] = "",
+            Category: str = "request") -> bool:
+        _, level = DashboardConfig.GetConfig("Server", "dashboard_log_level")
+        if self.Levels.get(level, self.Levels["all"]) < self.Categories.get(Category, self.Categories["request"]):
+            return False
+        if Category == "request":
+            try:
+                sampleRate = float(DashboardConfig.GetConfig("Server", "dashboard_log_sample_rate")[1])
+            except (TypeError, ValueError):
+                sampleRate = 1
+            if sampleRate < 1 and random.random() >= sampleRate:
+                self.Sampled += 1
+                return False
+        if callable(Message):
+            Message = Message()
         try:
-            with self.loggerdb:
-                loggerdbCursor = self.loggerdb.cursor()
-                loggerdbCursor.execute(
-                    "INSERT INTO DashboardLog (LogID, URL, IP, Status, Message) VALUES (?, ?, ?, ?, ?)", (str(uuid.uuid4()), URL, IP, Status, Message,))
-                if self.loggerdb.in_transaction:
-                    self.loggerdb.commit()
-                return True
-        except Exception as e:
-            print(f"[WGDashboard] Access Log Error: {str(e)}")
+            self.__queue.put_nowait((str(uuid.uuid4()), datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                     URL, IP, Status, Message))
+            return True
+        except queue.Full:
+            self.Dropped += 1
             return False
+
+    def start(self):
+        """
+        Start the writer thread. Called from startThreads() so that a forked worker owns its own writer.
+        """
+        if self.__writer is None or not self.__writer.is_alive():
+            self.__writer = threading.Thread(target=self.__write, daemon=True)
+            self.__writer.start()
+
+    def __write(self):
+        while True:
+            batch = [self.__queue.get()]
+            deadline = time.time() + self.FlushInterval
+            while len(batch) < self.BatchSize:
+                try:
+                    batch.append(self.__queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            self.__insert(batch)
+
+    def __insert(self, batch: list[tuple]):
+        with self.__flushLock:
+            try:
+                with LogDatabase.transaction() as conn:
+                    conn.executemany(
+                        "INSERT INTO DashboardLog (LogID, LogDate, URL, IP, Status, Message) VALUES (?, ?, ?, ?, ?, ?)",
+                        batch)
+                self.Written += len(batch)
+            except Exception as e:
+                self.Dropped += len(batch)
+                print(f"[WGDashboard] Access Log Error: {str(e)}")
+
+    def flush(self):
+        """
+        Write everything still queued from the calling thread, e.g. before the process exits
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self.__queue.get_nowait())
+            except queue.Empty:
+                break
+        if len(batch) > 0:
+            self.__insert(batch)
+
+    def getLogsPage(self, cursor: str = None, limit: int = 50, status: str = None, ip: str = None,
+                    dateFrom: str = None, dateTo: str = None) -> tuple[list[dict], str | None]:
+        conditions = []
+        if status:
+            conditions.append(("Status = ?", status))
+        if ip:
+            conditions.append(("IP = ?", ip))
+        rows, nextCursor = _queryLogsPage(LogDatabase, "DashboardLog", conditions, cursor, limit, dateFrom, dateTo)
+        return [dict(r) for r in rows], nextCursor
+
+    def toJson(self):
+        return {
+            "Queued": self.__queue.qsize(),
+            "Written": self.Written,
+            "Dropped": self.Dropped,
+            "Sampled": self.Sampled
+        }
     
 class PeerJobLogger:
     def __init__(self):
-        self.loggerdb = sqlite3.connect(os.path.join(CONFIGURATION_PATH, 'db', 'wgdashboard_log.db'),
-                                     check_same_thread=False)
-        self.loggerdb.row_factory = sqlite3.Row
         self.logs:list(Log) = []
         self.__createLogDatabase()
-        
+
+    @property
+    def loggerdb(self) -> sqlite3.Connection:
+        return LogDatabase.connection()
+
     def __createLogDatabase(self):
-        with self.loggerdb:
-            loggerdbCursor = self.loggerdb.cursor()
-        
-            existingTable = loggerdbCursor.execute("SELECT name from sqlite_master where type='table'").fetchall()
-            existingTable = [t['name'] for t in existingTable]
-    
-            if "JobLog" not in existingTable:
-                loggerdbCursor.execute("CREATE TABLE JobLog (LogID VARCHAR NOT NULL, JobID NOT NULL, LogDate DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now', 'localtime')), Status VARCHAR NOT NULL, Message VARCHAR, PRIMARY KEY (LogID))")
-                if self.loggerdb.in_transaction:
-                    self.loggerdb.commit()
-    def log(self, JobID: str, Status: bool = True, Message: str = "") -> bool:
+        LogDatabase.migrate("JobLog", [
+            lambda conn: conn.execute(
+                "CREATE TABLE IF NOT EXISTS JobLog (LogID VARCHAR NOT NULL, JobID NOT NULL, LogDate DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now', 'localtime')), Status VARCHAR NOT NULL, Message VARCHAR, PRIMARY KEY (LogID))"),
+            lambda conn: conn.execute("CREATE INDEX IF NOT EXISTS JobLog_JobID_LogDate ON JobLog (JobID, LogDate)"),
+            self.__addJobColumns
+        ])
+
+    def __addJobColumns(self, conn: sqlite3.Connection):
+        """
+        Store the configuration and peer on every log so they can be filtered without looking up the jobs first
+        """
+        conn.execute("ALTER TABLE JobLog ADD COLUMN Configuration VARCHAR")
+        conn.execute("ALTER TABLE JobLog ADD COLUMN Peer VARCHAR")
+        try:
+            jobs = JobDatabase.execute("SELECT JobID, Configuration, Peer FROM PeerJobs").fetchall()
+        except sqlite3.OperationalError:
+            jobs = []
+        conn.executemany("UPDATE JobLog SET Configuration = ?, Peer = ? WHERE JobID = ?",
+                         [(j['Configuration'], j['Peer'], j['JobID']) for j in jobs])
+        conn.execute("CREATE INDEX JobLog_Configuration_LogDate ON JobLog (Configuration, LogDate)")
+        conn.execute("CREATE INDEX JobLog_Peer_LogDate ON JobLog (Peer, LogDate)")
+
+    def log(self, JobID: str, Status: bool = True, Message: str = "",
+            Configuration: str = None, Peer: str = None) -> bool:
         try:
             with self.loggerdb:
                 loggerdbCursor = self.loggerdb.cursor()
-                loggerdbCursor.execute(f"INSERT INTO JobLog (LogID, JobID, Status, Message) VALUES (?, ?, ?, ?)",
-                                            (str(uuid.uuid4()), JobID, Status, Message,))
+                loggerdbCursor.execute(f"INSERT INTO JobLog (LogID, JobID, Status, Message, Configuration, Peer) VALUES (?, ?, ?, ?, ?, ?)",
+                                            (str(uuid.uuid4()), JobID, Status, Message, Configuration, Peer,))
                 if self.loggerdb.in_transaction:
                     self.loggerdb.commit()
         except Exception as e:
@@ -200,19 +486,533 @@ class PeerJobLogger:
     def getLogs(self, all: bool = False, configName = None) -> list[Log]:
         logs: list[Log] = []
         try:
-            allJobs = AllPeerJobs.getAllJobs(configName)
-            allJobsID = ", ".join([f"'{x.JobID}'" for x in allJobs])
+            # Only logs of jobs the configuration has, the jobs live in another database so they are matched here
+            allJobsID = set(x.JobID for x in AllPeerJobs.getAllJobs(configName))
             with self.loggerdb:
                 loggerdbCursor = self.loggerdb.cursor()
-                table = loggerdbCursor.execute(f"SELECT * FROM JobLog WHERE JobID IN ({allJobsID}) ORDER BY LogDate DESC").fetchall()
+                table = loggerdbCursor.execute("SELECT * FROM JobLog WHERE Configuration = ? ORDER BY LogDate DESC",
+                                               (configName,)).fetchall()
                 self.logs.clear()
                 for l in table:
-                    logs.append(
-                        Log(l["LogID"], l["JobID"], l["LogDate"], l["Status"], l["Message"]))
+                    if l["JobID"] in allJobsID:
+                        logs.append(
+                            Log(l["LogID"], l["JobID"], l["LogDate"], l["Status"], l["Message"]))
         except Exception as e:
             return logs
         return logs
+
+    def getLogsPage(self, configName: str, cursor: str = None, limit: int = 50, job: str = None, peer: str = None,
+                    status: bool = None, dateFrom: str = None, dateTo: str = None) -> tuple[list[Log], str | None]:
+        conditions = [("Configuration = ?", configName)]
+        if job:
+            conditions.append(("JobID = ?", job))
+        if peer:
+            conditions.append(("Peer = ?", peer))
+        if status is not None:
+            conditions.append(("Status = ?", 1 if status else 0))
+        rows, nextCursor = _queryLogsPage(LogDatabase, "JobLog", conditions, cursor, limit, dateFrom, dateTo)
+        return [Log(l["LogID"], l["JobID"], l["LogDate"], l["Status"], l["Message"]) for l in rows], nextCursor
+
+class LogRetention:
+    """
+    Keeps wgdashboard_log.db bounded. Every pass moves logs older than the retention period (and the oldest logs
+    beyond the row limit) into gzip compressed JSON lines files under db/log_archive, a chunk at a time, so the
+    log writers are never locked out for long. An archive is written as a .partial file and only named once the
+    rows are deleted, with the name journaled in the same transaction, so a crash in between neither loses nor
+    duplicates rows. The freed pages are handed back with incremental vacuum after every pass.
+    Settings (Server section): dashboard_log_retention_days, dashboard_log_max_rows, job_log_retention_days.
+    0 disables the limit.
+    """
+    Tables = {
+        "DashboardLog": ("dashboard_log_retention_days", "dashboard_log_max_rows"),
+        "JobLog": ("job_log_retention_days", None)
+    }
+    ArchivePath = os.path.join(DB_PATH, 'log_archive')
+    ChunkSize = 5000
+    MaxChunks = 20
+    Interval = 3600
+
+    def __init__(self):
+        self.__thread: threading.Thread | None = None
+        self.LastRun: datetime | None = None
+        self.Archived: dict[str, int] = {t: 0 for t in self.Tables}
+        LogDatabase.migrate("LogRetention", [
+            lambda conn: conn.execute("CREATE TABLE IF NOT EXISTS LogArchiveJournal (Name VARCHAR NOT NULL PRIMARY KEY)")
+        ])
+
+    @staticmethod
+    def __setting(key: str) -> int:
+        if key is None:
+            return 0
+        try:
+            return max(int(DashboardConfig.GetConfig("Server", key)[1]), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def start(self):
+        if self.__thread is None or not self.__thread.is_alive():
+            self.__thread = threading.Thread(target=self.__loop, daemon=True)
+            self.__thread.start()
+
+    def __loop(self):
+        time.sleep(60)
+        while True:
+            try:
+                self.run()
+            except Exception as e:
+                print(f"[WGDashboard] Log Retention Error: {str(e)}", flush=True)
+            time.sleep(self.Interval)
+
+    def run(self) -> dict[str, int]:
+        self.__recover()
+        archived = {}
+        for table, (daysKey, rowsKey) in self.Tables.items():
+            archived[table] = 0
+            days, maxRows = self.__setting(daysKey), self.__setting(rowsKey)
+            if days > 0:
+                cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+                archived[table] += self.__archiveChunks(table, "WHERE LogDate < ?", (cutoff,))
+            if maxRows > 0:
+                excess = LogDatabase.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - maxRows
+                if excess > 0:
+                    archived[table] += self.__archiveChunks(table, "", (), excess)
+            self.Archived[table] += archived[table]
+        self.__reclaim()
+        self.LastRun = datetime.now()
+        return archived
+
+    def __recover(self):
+        """
+        Finish the archives of a pass that stopped halfway: a .partial file whose rows were deleted is journaled
+        and gets its name, one whose rows are still in the database is dropped and archived again
+        """
+        journal = {r['Name'] for r in LogDatabase.execute("SELECT Name FROM LogArchiveJournal").fetchall()}
+        if os.path.isdir(self.ArchivePath):
+            for name in os.listdir(self.ArchivePath):
+                if name.endswith(".partial"):
+                    partial = os.path.join(self.ArchivePath, name)
+                    if name[:-len(".partial")] in journal:
+                        os.replace(partial, partial[:-len(".partial")])
+                    else:
+                        os.remove(partial)
+        if len(journal) > 0:
+            with LogDatabase.transaction() as conn:
+                conn.executemany("DELETE FROM LogArchiveJournal WHERE Name = ?", [(n,) for n in journal])
+
+    @staticmethod
+    def __reclaim():
+        """
+        Shrink the file by the pages the archived rows freed. Incremental auto-vacuum can only be switched on for an
+        existing database by rebuilding it, so the first pass runs VACUUM once
+        """
+        if LogDatabase.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            LogDatabase.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            LogDatabase.execute("VACUUM")
+        else:
+            # execute() would step the pragma once and free a single page, executescript() runs it to the end
+            LogDatabase.connection().executescript("PRAGMA incremental_vacuum;")
+
+    def __archiveChunks(self, table: str, where: str, parameters: tuple, amount: int = None) -> int:
+        total = 0
+        for _ in range(self.MaxChunks):
+            size = self.ChunkSize if amount is None else min(self.ChunkSize, amount - total)
+            if size <= 0:
+                break
+            rows = LogDatabase.execute(f"SELECT rowid, * FROM {table} {where} ORDER BY LogDate LIMIT ?",
+                                       parameters + (size,)).fetchall()
+            if len(rows) == 0:
+                break
+            name = self.__archive(table, rows)
+            with LogDatabase.transaction() as conn:
+                conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", [(r['rowid'],) for r in rows])
+                conn.execute("INSERT INTO LogArchiveJournal (Name) VALUES (?)", (name,))
+            path = os.path.join(self.ArchivePath, name)
+            os.replace(path + ".partial", path)
+            LogDatabase.execute("DELETE FROM LogArchiveJournal WHERE Name = ?", (name,), commit=True)
+            total += len(rows)
+            if len(rows) < size:
+                break
+            # Let the log writers in between chunks
+            time.sleep(0.05)
+        return total
+
+    def __archive(self, table: str, rows: list[sqlite3.Row]) -> str:
+        if not os.path.isdir(self.ArchivePath):
+            os.mkdir(self.ArchivePath)
+        first = rows[0]['LogDate'].replace('-', '').replace(':', '').replace(' ', '')
+        last = rows[-1]['LogDate'].replace('-', '').replace(':', '').replace(' ', '')
+        name = f"{table}_{first}_{last}_{uuid.uuid4().hex[:8]}.jsonl.gz"
+        with open(os.path.join(self.ArchivePath, name + ".partial"), "wb") as raw:
+            with gzip.open(raw, "wt", encoding="utf-8") as f:
+                for r in rows:
+                    row = dict(r)
+                    del row['rowid']
+                    f.write(json.dumps(row, default=str) + "\n")
+            # On disk before the rows are deleted
+            raw.flush()
+            os.fsync(raw.fileno())
+        return name
+
+    def getArchives(self) -> list[dict]:
+        if not os.path.isdir(self.ArchivePath):
+            return []
+        archives = []
+        for name in sorted(os.listdir(self.ArchivePath), reverse=True):
+            if name.endswith(".jsonl.gz"):
+                stat = os.stat(os.path.join(self.ArchivePath, name))
+                archives.append({
+                    "Name": name,
+                    "Table": name.split("_")[0],
+                    "Size": stat.st_size,
+                    "CreatedAt": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+                })
+        return archives
+
+    def toJson(self):
+        return {
+            "LastRun": self.LastRun.strftime("%Y-%m-%d %H:%M:%S") if self.LastRun else None,
+            "Archived": self.Archived,
+            "Archives": len(self.getArchives())
+        }
             
+class PeerTransferWindow:
+    """
+    Fixed-size ring buffer of (timestamp, cumulative received GB, cumulative sent GB) samples for one peer, filled by
+    the transfer poller and read by rate and idle peer jobs. Also keeps an exponentially weighted rx/tx rate in
+    bytes per second, and the last sample of each of the last MinuteHistory minutes as (minute, received GB, sent GB),
+    which the collector publishes so web workers can rank usage over short windows
+    """
+    __slots__ = ("Samples", "Minutes", "LastActivity", "ReceiveRate", "SentRate")
+    Capacity = 512
+    RateTimeConstant = 30
+    MinuteHistory = 61
+
+    def __init__(self, LastActivity: float = 0):
+        self.Samples: collections.deque[tuple[float, float, float]] = collections.deque(
+            maxlen=PeerTransferWindow.Capacity)
+        self.Minutes: collections.deque[tuple[int, float, float]] = collections.deque(
+            maxlen=PeerTransferWindow.MinuteHistory)
+        self.LastActivity = LastActivity
+        self.ReceiveRate = 0.0
+        self.SentRate = 0.0
+
+    def append(self, timestamp: float, receive: float, sent: float) -> bool:
+        changed = len(self.Samples) == 0 or self.Samples[-1][1] != receive or self.Samples[-1][2] != sent
+        if len(self.Samples) > 0:
+            if changed:
+                self.LastActivity = max(self.LastActivity, timestamp)
+            previous, previousReceive, previousSent = self.Samples[-1]
+            elapsed = timestamp - previous
+            if elapsed > 0:
+                # The poller folds interface counter resets into cumu_*, so a drop here only comes from a manual
+                # data reset and is treated as no traffic
+                weight = 1 - math.exp(-elapsed / PeerTransferWindow.RateTimeConstant)
+                receiveRate = max(0.0, receive - previousReceive) * (1024 ** 3) / elapsed
+                sentRate = max(0.0, sent - previousSent) * (1024 ** 3) / elapsed
+                self.ReceiveRate += weight * (receiveRate - self.ReceiveRate)
+                self.SentRate += weight * (sentRate - self.SentRate)
+        self.Samples.append((timestamp, receive, sent))
+        minute = int(timestamp // 60)
+        if len(self.Minutes) > 0 and self.Minutes[-1][0] == minute:
+            self.Minutes[-1] = (minute, receive, sent)
+        else:
+            self.Minutes.append((minute, receive, sent))
+        return changed
+
+    def rates(self, field: str, seconds: float) -> list[float] | None:
+        """
+        Rate of every sample interval in the last `seconds` in Mbit/s, or None if the buffer does not cover that long
+        """
+        if len(self.Samples) < 2 or self.Samples[-1][0] - self.Samples[0][0] < seconds:
+            return None
+        since = self.Samples[-1][0] - seconds
+        rates = []
+        newer = self.Samples[-1]
+        for i in range(len(self.Samples) - 2, -1, -1):
+            older = self.Samples[i]
+            elapsed = newer[0] - older[0]
+            if elapsed > 0:
+                receive = max(0.0, newer[1] - older[1])
+                sent = max(0.0, newer[2] - older[2])
+                delta = receive if field == "rate_receive" else sent if field == "rate_sent" else receive + sent
+                rates.append(delta * (1024 ** 3) * 8 / (10 ** 6) / elapsed)
+            if older[0] <= since:
+                break
+            newer = older
+        return rates
+
+    def idleDays(self, now: float) -> float:
+        return (now - self.LastActivity) / 86400
+
+class PeerStateSegment:
+    """
+    Memory-mapped file with the live state of every peer of one configuration, written by the collector after each
+    poll and read by the web workers without touching SQLite. The header carries a seqlock: the writer makes the
+    sequence odd before it changes anything and even again once it is done, and a reader retries until it saw the
+    same even sequence before and after reading. Slots are reassigned and the generation bumped when the peers
+    change. When the peers no longer fit, a file twice the size replaces the old one, which is flagged as retired
+    so readers map the new one. Each slot is followed by a ring of the peer's minute checkpoints, entry minute %
+    MinuteHistory holding (minute, received GB, sent GB)
+    """
+    Magic = b"WGDPEER2"
+    Header = struct.Struct("<8sIIQQQQdQQdd")
+    HeaderSize = 128
+    SequenceOffset = 16
+    Slot = struct.Struct("<48s48sddddddqBB6x")
+    Minute = struct.Struct("<qdd")
+    History = struct.Struct("<" + "qdd" * PeerTransferWindow.MinuteHistory)
+    SlotSize = Slot.size + History.size
+    InitialCapacity = 256
+    Retired = 1
+    ReadRetries = 100
+    StaleAfter = 60
+
+    def __init__(self, path: str):
+        self.Path = path
+        self.__lock = threading.Lock()
+        self.__map: mmap.mmap | None = None
+        self.__file = None
+        self.__capacity = 0
+        self.__slots: dict[str, int] = {}
+        self.__writer = False
+        self.__readGeneration = -1
+        self.__readSlots: dict[str, int] = {}
+
+    def __open(self) -> bool:
+        if self.__map is not None:
+            flags = PeerStateSegment.Header.unpack_from(self.__map, 0)[2]
+            if not flags & PeerStateSegment.Retired:
+                return True
+            self.__close()
+        try:
+            with open(self.Path, 'rb') as f:
+                self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return False
+        if len(self.__map) < PeerStateSegment.HeaderSize or self.__map[:8] != PeerStateSegment.Magic:
+            self.__close()
+            return False
+        self.__readGeneration = -1
+        return True
+
+    def __close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __create(self, capacity: int):
+        """
+        Write a new empty segment next to the current one, move it into place and retire the old one
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.Path), prefix=".peers-")
+        f = os.fdopen(fd, 'r+b')
+        f.truncate(PeerStateSegment.HeaderSize + capacity * PeerStateSegment.SlotSize)
+        segment = mmap.mmap(f.fileno(), 0)
+        PeerStateSegment.Header.pack_into(segment, 0, PeerStateSegment.Magic, PeerStateSegment.SlotSize, 0,
+                                          0, 0, capacity, 0, 0, 0, 0, 0, 0)
+        os.chmod(tmp, 0o644)
+        old = self.__map if self.__writer else None
+        if old is None and os.path.exists(self.Path):
+            try:
+                with open(self.Path, 'r+b') as oldFile:
+                    old = mmap.mmap(oldFile.fileno(), 0)
+            except (OSError, ValueError):
+                old = None
+        os.replace(tmp, self.Path)
+        if old is not None and len(old) >= PeerStateSegment.HeaderSize:
+            struct.pack_into("<I", old, 12, PeerStateSegment.Retired)
+            if old is not self.__map:
+                old.close()
+        self.__close()
+        self.__map, self.__file, self.__capacity = segment, f, capacity
+        self.__slots, self.__writer = {}, True
+
+    def publish(self, peers: list[tuple]) -> float:
+        """
+        @param peers: (id, endpoint, total_receive, total_sent, cumu_receive, cumu_sent, receive_rate, sent_rate,
+        latest_handshake, running, restricted, minutes) of every peer, minutes being PeerTransferWindow.Minutes or
+        None. Restricted peers are left out of the totals
+        """
+        with self.__lock:
+            if not self.__writer or len(peers) > self.__capacity:
+                capacity = max(PeerStateSegment.InitialCapacity, self.__capacity)
+                while capacity < len(peers):
+                    capacity *= 2
+                self.__create(capacity)
+            segment = self.__map
+            _, _, _, sequence, generation = PeerStateSegment.Header.unpack_from(segment, 0)[:5]
+            keys = [p[0] for p in peers]
+            moved = len(keys) != len(self.__slots) or any(self.__slots.get(k) != i for i, k in enumerate(keys))
+            if moved:
+                self.__slots = {k: i for i, k in enumerate(keys)}
+                generation += 1
+            struct.pack_into("<Q", segment, PeerStateSegment.SequenceOffset, sequence + 1)
+            connected, receive, sent, updatedAt = 0, 0.0, 0.0, time.time()
+            active = 0
+            for i, (key, endpoint, totalReceive, totalSent, cumuReceive, cumuSent, receiveRate, sentRate,
+                    handshake, running, restricted, minutes) in enumerate(peers):
+                offset = PeerStateSegment.HeaderSize + i * PeerStateSegment.SlotSize
+                PeerStateSegment.Slot.pack_into(
+                    segment, offset, key.encode(), str(endpoint or "").encode()[:48], totalReceive or 0,
+                    totalSent or 0, cumuReceive or 0, cumuSent or 0, receiveRate, sentRate, int(handshake or 0),
+                    1 if running else 0, 1 if restricted else 0)
+                self.__writeMinutes(segment, offset + PeerStateSegment.Slot.size, minutes or (), moved)
+                if restricted:
+                    continue
+                active += 1
+                connected += 1 if running else 0
+                receive += (cumuReceive or 0) + (totalReceive or 0)
+                sent += (cumuSent or 0) + (totalSent or 0)
+            PeerStateSegment.Header.pack_into(segment, 0, PeerStateSegment.Magic, PeerStateSegment.SlotSize, 0,
+                                              sequence + 1, generation, self.__capacity, len(peers), updatedAt,
+                                              active, connected, receive, sent)
+            struct.pack_into("<Q", segment, PeerStateSegment.SequenceOffset, sequence + 2)
+            return updatedAt
+
+    @staticmethod
+    def __writeMinutes(segment: mmap.mmap, offset: int, minutes, rewrite: bool):
+        """
+        The poller appends a sample before every publish, so only the last two minutes can have changed since the
+        previous one, unless the peer moved to another slot
+        """
+        if rewrite:
+            ring = [-1, 0.0, 0.0] * PeerTransferWindow.MinuteHistory
+            for minute, receive, sent in minutes:
+                position = minute % PeerTransferWindow.MinuteHistory * 3
+                ring[position:position + 3] = minute, receive, sent
+            PeerStateSegment.History.pack_into(segment, offset, *ring)
+            return
+        for minute, receive, sent in itertools.islice(reversed(minutes), 2):
+            PeerStateSegment.Minute.pack_into(
+                segment, offset + minute % PeerTransferWindow.MinuteHistory * PeerStateSegment.Minute.size,
+                minute, receive, sent)
+
+    def __read(self, reader: Callable[[mmap.mmap, tuple], Any]) -> Any:
+        """
+        Run reader(segment, header) until it ran against one consistent version, None if the segment is missing,
+        stale or kept changing
+        """
+        with self.__lock:
+            if not self.__open():
+                return None
+            segment = self.__map
+            for _ in range(PeerStateSegment.ReadRetries):
+                header = PeerStateSegment.Header.unpack_from(segment, 0)
+                if header[3] % 2 == 1:
+                    time.sleep(0)
+                    continue
+                if time.time() - header[7] > PeerStateSegment.StaleAfter:
+                    return None
+                try:
+                    result = reader(segment, header)
+                except struct.error:
+                    result = None
+                if struct.unpack_from("<Q", segment, PeerStateSegment.SequenceOffset)[0] == header[3]:
+                    return result
+            return None
+
+    def __index(self, segment: mmap.mmap, header: tuple) -> dict[str, int]:
+        if header[4] != self.__readGeneration:
+            self.__readSlots = {
+                bytes(segment[PeerStateSegment.HeaderSize + i * PeerStateSegment.SlotSize:
+                              PeerStateSegment.HeaderSize + i * PeerStateSegment.SlotSize + 48])
+                .rstrip(b"\0").decode(): i for i in range(header[6])}
+            self.__readGeneration = header[4]
+        return self.__readSlots
+
+    @staticmethod
+    def __state(segment: mmap.mmap, slot: int) -> dict:
+        key, endpoint, totalReceive, totalSent, cumuReceive, cumuSent, receiveRate, sentRate, handshake, running, _ = \
+            PeerStateSegment.Slot.unpack_from(segment, PeerStateSegment.HeaderSize + slot * PeerStateSegment.SlotSize)
+        return {
+            "endpoint": endpoint.rstrip(b"\0").decode(),
+            "total_receive": totalReceive,
+            "total_sent": totalSent,
+            "cumu_receive": cumuReceive,
+            "cumu_sent": cumuSent,
+            "receive_rate": round(receiveRate, 2),
+            "sent_rate": round(sentRate, 2),
+            "latest_handshake": handshake,
+            "status": "running" if running else "stopped"
+        }
+
+    def get(self, key: str) -> dict | None:
+        if self.__writer:
+            return None
+        def reader(segment, header):
+            slot = self.__index(segment, header).get(key)
+            return None if slot is None else PeerStateSegment.__state(segment, slot)
+        return self.__read(reader)
+
+    def rates(self) -> list[tuple[str, float, float]] | None:
+        """
+        (id, receive rate, sent rate) of every peer in bytes per second
+        """
+        def reader(segment, header):
+            return [(key, receiveRate, sentRate) for key, slot in self.__index(segment, header).items()
+                    for receiveRate, sentRate in [PeerStateSegment.Slot.unpack_from(
+                        segment, PeerStateSegment.HeaderSize + slot * PeerStateSegment.SlotSize)[6:8]]]
+        return self.__read(reader)
+
+    def usage(self, since: float) -> list[tuple[str, float, float]] | None:
+        """
+        (id, received GB, sent GB) of every peer since the last minute checkpoint before `since`, or since its
+        oldest checkpoint when it has none that old. `since` must lie within the last MinuteHistory minutes
+        """
+        start = int(since // 60) - 1
+        def reader(segment, header):
+            usage = []
+            for key, slot in self.__index(segment, header).items():
+                ring = PeerStateSegment.History.unpack_from(
+                    segment, PeerStateSegment.HeaderSize + slot * PeerStateSegment.SlotSize + PeerStateSegment.Slot.size)
+                minutes = sorted(ring[j:j + 3] for j in range(0, len(ring), 3) if ring[j] >= 0)
+                # Entries the ring has not wrapped over yet, e.g. after a gap in polling, are older than the history
+                minutes = [m for m in minutes if m[0] > minutes[-1][0] - PeerTransferWindow.MinuteHistory]
+                if len(minutes) == 0:
+                    usage.append((key, 0.0, 0.0))
+                    continue
+                first = minutes[0]
+                for m in minutes:
+                    if m[0] > start:
+                        break
+                    first = m
+                last = minutes[-1]
+                usage.append((key, max(0.0, last[1] - first[1]), max(0.0, last[2] - first[2])))
+            return usage
+        return self.__read(reader)
+
+    def summary(self) -> dict | None:
+        return self.__read(lambda segment, header: {
+            "TotalPeers": header[8],
+            "ConnectedPeers": header[9],
+            "Receive": header[10],
+            "Sent": header[11],
+            "UpdatedAt": header[7]
+        })
+
+class PeerSnapshot:
+    """
+    One published version of a configuration's peers. A new snapshot is built whenever the peers are reloaded and
+    swapped into WireguardConfiguration.Snapshot with a single assignment, so a request reads one consistent version
+    by taking the reference once, without locks or database access. Peer records that did not change are carried
+    over from the previous snapshot
+    """
+    __slots__ = ("Version", "Peers", "RestrictedPeers", "Index", "DataUsage", "ConnectedPeers", "TotalPeers")
+
+    def __init__(self, Version: int, Peers: tuple, RestrictedPeers: tuple):
+        self.Version = Version
+        self.Peers: tuple[Peer, ...] = Peers
+        self.RestrictedPeers: tuple[Peer, ...] = RestrictedPeers
+        self.Index = types.MappingProxyType({p.id: p for p in Peers})
+        receive = sum(p.cumu_receive + p.total_receive for p in Peers)
+        sent = sum(p.cumu_sent + p.total_sent for p in Peers)
+        self.DataUsage = types.MappingProxyType({"Total": receive + sent, "Sent": sent, "Receive": receive})
+        self.ConnectedPeers = sum(1 for p in Peers if p.status == "running")
+        self.TotalPeers = len(Peers)
+
 class PeerJob:
     def __init__(self, JobID: str, Configuration: str, Peer: str,
                  Field: str, Operator: str, Value: str, CreationDate: datetime, ExpireDate: datetime, Action: str):
@@ -243,25 +1043,119 @@ class PeerJob:
         return self.toJson()
 
 class PeerJobs:
+    DataFields = ["total_receive", "total_sent", "total_data"]
+    RateFields = ["rate_receive", "rate_sent", "rate_data"]
+    WindowFields = DataFields + RateFields + ["idle"]
+    RateWindowMaxMinutes = 60
+    RetryInterval = 180
+    ReloadInterval = 5
 
     def __init__(self):
         self.Jobs: list[PeerJob] = []
-        self.jobdb = sqlite3.connect(os.path.join(CONFIGURATION_PATH, 'db', 'wgdashboard_job.db'),
-                                     check_same_thread=False)
-        self.jobdb.row_factory = sqlite3.Row
+        self.__dueJobs: list[tuple[float, int, str]] = []
+        self.__peerJobs: dict[tuple[str, str], list[PeerJob]] = {}
+        self.__values: dict[str, float | datetime | tuple[float, float]] = {}
+        self.__retryAt: dict[str, float] = {}
+        self.__triggered: dict[str, PeerJob] = {}
+        self.__recheck = True
+        self.__sequence = itertools.count()
+        self.__condition = threading.Condition()
+        self.__modifiedTime = None
+        self.__nextReload = 0
+        self.Version = 0
         self.__createPeerJobsDatabase()
         self.__getJobs()
 
+    @property
+    def jobdb(self) -> sqlite3.Connection:
+        return JobDatabase.connection()
+
     def __getJobs(self):
-        self.Jobs.clear()
+        jobs = []
+        self.__modifiedTime = JobDatabase.modifiedTime()
         with self.jobdb:
             jobdbCursor = self.jobdb.cursor()
-            jobs = jobdbCursor.execute("SELECT * FROM PeerJobs WHERE ExpireDate IS NULL").fetchall()
-            for job in jobs:
-                self.Jobs.append(PeerJob(
+            for job in jobdbCursor.execute("SELECT * FROM PeerJobs WHERE ExpireDate IS NULL").fetchall():
+                jobs.append(PeerJob(
                     job['JobID'], job['Configuration'], job['Peer'], job['Field'], job['Operator'], job['Value'],
                     job['CreationDate'], job['ExpireDate'], job['Action']))
-    
+        self.Jobs = jobs
+        self.Version += 1
+        self.__indexJobs()
+
+    def refresh(self):
+        """
+        Reload the jobs when another process changed them, checked at most every ReloadInterval seconds. Jobs are
+        saved by the web workers and run by the collector
+        """
+        now = time.monotonic()
+        if now < self.__nextReload:
+            return
+        self.__nextReload = now + PeerJobs.ReloadInterval
+        if JobDatabase.modifiedTime() != self.__modifiedTime:
+            self.__getJobs()
+
+    def __indexJobs(self):
+        """
+        Parse every job value once and index the jobs by what triggers them: date jobs go into a heap ordered by
+        the time they are due, data, rate and idle jobs are keyed by (Configuration, Peer) and evaluated by the
+        transfer poller
+        """
+        now = time.time()
+        dueJobs, peerJobs, values = [], {}, {}
+        for job in self.Jobs:
+            try:
+                if job.Field in PeerJobs.WindowFields:
+                    values[job.JobID] = self.__parseValue(job)
+                    peerJobs.setdefault((job.Configuration, job.Peer), []).append(job)
+                    due = self.__retryAt.get(job.JobID)
+                    if due is None:
+                        continue
+                else:
+                    values[job.JobID] = datetime.strptime(job.Value, "%Y-%m-%d %H:%M:%S")
+                    due = now if job.Operator in ["neq", "lst"] else values[job.JobID].timestamp()
+                    due = max(due, self.__retryAt.get(job.JobID, 0))
+            except ValueError:
+                print(f"[WGDashboard] Peer job {job.JobID} has an invalid value: {job.Value}")
+                continue
+            dueJobs.append((due, next(self.__sequence), job.JobID))
+        heapq.heapify(dueJobs)
+        with self.__condition:
+            self.__dueJobs, self.__peerJobs, self.__values = dueJobs, peerJobs, values
+            self.__retryAt = {k: v for k, v in self.__retryAt.items() if k in values}
+            self.__triggered = {k: v for k, v in self.__triggered.items() if k in values}
+            self.__recheck = True
+            self.__condition.notify_all()
+
+    def __parseValue(self, Job: PeerJob) -> float | tuple[float, float]:
+        if Job.Field in PeerJobs.RateFields:
+            rate, minutes = Job.Value.split(":")
+            return float(rate), float(minutes)
+        if Job.Field == "idle":
+            # saveJob stores CreationDate with strftime('now'), which is UTC
+            created = datetime.strptime(str(Job.CreationDate), "%Y-%m-%d %H:%M:%S").replace(
+                tzinfo=timezone.utc).timestamp() if Job.CreationDate else time.time()
+            return float(Job.Value), created
+        return float(Job.Value)
+
+    def __validateJob(self, Job: PeerJob) -> str | None:
+        try:
+            if Job.Field in PeerJobs.RateFields:
+                rate, minutes = self.__parseValue(Job)
+                if not 1 <= minutes <= PeerJobs.RateWindowMaxMinutes:
+                    return f"Rate window must be between 1 and {PeerJobs.RateWindowMaxMinutes} minutes"
+            elif Job.Field in PeerJobs.WindowFields:
+                self.__parseValue(Job)
+            elif Job.Field == "date":
+                datetime.strptime(Job.Value, "%Y-%m-%d %H:%M:%S")
+            else:
+                return f"Unknown field {Job.Field}"
+        except ValueError:
+            if Job.Field in PeerJobs.RateFields:
+                return "Rate value must be in the format of Mbit/s:minutes"
+            return f"Invalid value {Job.Value}"
+        return None
+
     def getAllJobs(self, configuration: str = None):
         if configuration is not None:
             with self.jobdb:
@@ -277,27 +1171,38 @@ class PeerJobs:
         return []
 
     def __createPeerJobsDatabase(self):
-        with self.jobdb:
-            jobdbCursor = self.jobdb.cursor()
-        
-            existingTable = jobdbCursor.execute("SELECT name from sqlite_master where type='table'").fetchall()
-            existingTable = [t['name'] for t in existingTable]
-    
-            if "PeerJobs" not in existingTable:
-                jobdbCursor.execute('''
-                CREATE TABLE PeerJobs (JobID VARCHAR NOT NULL, Configuration VARCHAR NOT NULL, Peer VARCHAR NOT NULL,
+        JobDatabase.migrate("PeerJobs", [
+            lambda conn: conn.execute('''
+                CREATE TABLE IF NOT EXISTS PeerJobs (JobID VARCHAR NOT NULL, Configuration VARCHAR NOT NULL, Peer VARCHAR NOT NULL,
                 Field VARCHAR NOT NULL, Operator VARCHAR NOT NULL, Value VARCHAR NOT NULL, CreationDate DATETIME,
                 ExpireDate DATETIME, Action VARCHAR NOT NULL, PRIMARY KEY (JobID))
-                ''')
-                self.jobdb.commit()
+                '''),
+            lambda conn: conn.execute("CREATE INDEX IF NOT EXISTS PeerJobs_Configuration_Peer ON PeerJobs (Configuration, Peer)")
+        ])
 
     def toJson(self):
+        self.refresh()
         return [x.toJson() for x in self.Jobs]
 
     def searchJob(self, Configuration: str, Peer: str):
+        self.refresh()
         return list(filter(lambda x: x.Configuration == Configuration and x.Peer == Peer, self.Jobs))
 
+    def peerJobs(self, Configuration: str) -> dict[str, list[PeerJob]]:
+        """
+        The jobs of every peer in a configuration, attached to the peers when their snapshot is built
+        """
+        self.refresh()
+        jobs = {}
+        for job in self.Jobs:
+            if job.Configuration == Configuration:
+                jobs.setdefault(job.Peer, []).append(job)
+        return jobs
+
     def saveJob(self, Job: PeerJob) -> tuple[bool, list] | tuple[bool, str]:
+        error = self.__validateJob(Job)
+        if error is not None:
+            return False, error
         try:
             with self.jobdb:
                 jobdbCursor = self.jobdb.cursor()
@@ -306,7 +1211,8 @@ class PeerJobs:
                     jobdbCursor.execute('''
                     INSERT INTO PeerJobs VALUES (?, ?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%S','now'), NULL, ?)
                     ''', (Job.JobID, Job.Configuration, Job.Peer, Job.Field, Job.Operator, Job.Value, Job.Action,))
-                    JobLogger.log(Job.JobID, Message=f"Job is created if {Job.Field} {Job.Operator} {Job.Value} then {Job.Action}")
+                    JobLogger.log(Job.JobID, Message=f"Job is created if {Job.Field} {Job.Operator} {Job.Value} then {Job.Action}",
+                                  Configuration=Job.Configuration, Peer=Job.Peer)
                     
                 else:
                     currentJob = jobdbCursor.execute('SELECT * FROM PeerJobs WHERE JobID = ?', (Job.JobID, )).fetchone()
@@ -315,9 +1221,11 @@ class PeerJobs:
                             UPDATE PeerJobs SET Field = ?, Operator = ?, Value = ?, Action = ? WHERE JobID = ?
                             ''', (Job.Field, Job.Operator, Job.Value, Job.Action, Job.JobID))
                         JobLogger.log(Job.JobID, 
-                                      Message=f"Job is updated from if {currentJob['Field']} {currentJob['Operator']} {currentJob['value']} then {currentJob['Action']}; to if {Job.Field} {Job.Operator} {Job.Value} then {Job.Action}")
+                                      Message=f"Job is updated from if {currentJob['Field']} {currentJob['Operator']} {currentJob['value']} then {currentJob['Action']}; to if {Job.Field} {Job.Operator} {Job.Value} then {Job.Action}",
+                                      Configuration=Job.Configuration, Peer=Job.Peer)
                 self.jobdb.commit()
-                self.__getJobs()
+            self.__retryAt.pop(Job.JobID, None)
+            self.__getJobs()
         
             return True, list(
                 filter(lambda x: x.Configuration == Job.Configuration and x.Peer == Job.Peer and x.JobID == Job.JobID,
@@ -335,7 +1243,8 @@ class PeerJobs:
                     UPDATE PeerJobs SET ExpireDate = strftime('%Y-%m-%d %H:%M:%S','now') WHERE JobID = ?
                 ''', (Job.JobID,))
                 self.jobdb.commit()
-            JobLogger.log(Job.JobID, Message=f"Job is removed due to being deleted or finshed.")
+            JobLogger.log(Job.JobID, Message=f"Job is removed due to being deleted or finshed.",
+                          Configuration=Job.Configuration, Peer=Job.Peer)
             self.__getJobs()
             return True, list(
                 filter(lambda x: x.Configuration == Job.Configuration and x.Peer == Job.Peer and x.JobID == Job.JobID,
@@ -343,39 +1252,153 @@ class PeerJobs:
         except Exception as e:
             return False, str(e)
 
+    def deleteJobs(self, Jobs: list[PeerJob]) -> tuple[bool, None] | tuple[bool, str]:
+        try:
+            with JobDatabase.transaction():
+                JobDatabase.executemany('''
+                    UPDATE PeerJobs SET ExpireDate = strftime('%Y-%m-%d %H:%M:%S','now') WHERE JobID = ?
+                ''', [(job.JobID,) for job in Jobs])
+            for job in Jobs:
+                JobLogger.log(job.JobID, Message=f"Job is removed due to being deleted or finshed.",
+                              Configuration=job.Configuration, Peer=job.Peer)
+            self.__getJobs()
+            return True, None
+        except Exception as e:
+            return False, str(e)
+
+    def updatePeerTransfer(self, Configuration: str, Peer: str, Window: PeerTransferWindow, Changed: bool = True):
+        """
+        Called by the transfer poller after it appends a sample to a peer's window. Data jobs only need to be
+        evaluated when the counters changed, rate and idle jobs on every sample
+        """
+        jobs = self.__peerJobs.get((Configuration, Peer))
+        if not jobs or len(Window.Samples) == 0:
+            return
+        now = time.time()
+        triggered = [job for job in jobs
+                     if (Changed or job.Field not in PeerJobs.DataFields)
+                     and self.__retryAt.get(job.JobID, 0) <= now and job.JobID in self.__values
+                     and self.__evaluateWindow(job, Window, now)]
+        if triggered:
+            with self.__condition:
+                for job in triggered:
+                    self.__triggered[job.JobID] = job
+                self.__condition.notify_all()
+
+    def __evaluateWindow(self, job: PeerJob, window: PeerTransferWindow, now: float) -> bool:
+        value = self.__values[job.JobID]
+        if job.Field in PeerJobs.DataFields:
+            _, receive, sent = window.Samples[-1]
+            x = {"total_receive": receive, "total_sent": sent, "total_data": receive + sent}[job.Field]
+            return self.__runJob_Compare(x, value, job.Operator)
+        if job.Field == "idle":
+            days, created = value
+            return self.__runJob_Compare((now - max(window.LastActivity, created)) / 86400, days, job.Operator)
+        threshold, minutes = value
+        rates = window.rates(job.Field, minutes * 60)
+        return rates is not None and len(rates) > 0 \
+            and all(self.__runJob_Compare(r, threshold, job.Operator) for r in rates)
+
+    def schedule(self):
+        """
+        Scheduler thread body: sleeps until the next date job is due or until a job is triggered or changed, and
+        wakes up every ReloadInterval seconds to pick up jobs saved by other processes
+        """
+        while True:
+            with self.__condition:
+                timeout = PeerJobs.ReloadInterval
+                if len(self.__dueJobs) > 0:
+                    timeout = min(timeout, max(0.0, self.__dueJobs[0][0] - time.time()))
+                if not self.__triggered and not self.__recheck and timeout != 0:
+                    self.__condition.wait(timeout)
+            try:
+                self.refresh()
+                self.runJob()
+            except Exception as e:
+                print(f"[WGDashboard] Peer job scheduler error: {str(e)}")
+                time.sleep(1)
+
+    def __checkPeerJobs(self):
+        for configuration, peer in list(self.__peerJobs.keys()):
+            c = WireguardConfigurations.get(configuration)
+            if c is not None and peer in c.TransferWindows:
+                self.updatePeerTransfer(configuration, peer, c.TransferWindows[peer])
+
+    def __collectDueJobs(self):
+        jobs = {job.JobID: job for job in self.Jobs}
+        now = datetime.now()
+        with self.__condition:
+            while len(self.__dueJobs) > 0 and self.__dueJobs[0][0] <= now.timestamp():
+                _, _, jobID = heapq.heappop(self.__dueJobs)
+                job = jobs.get(jobID)
+                if job is None or jobID not in self.__values:
+                    continue
+                if job.Field in PeerJobs.WindowFields:
+                    self.__recheck = True
+                    continue
+                y = self.__values[jobID]
+                # An "eq" job is due at or after its date, the scheduler can wake up late and a job that ran is
+                # deleted, so it fires once
+                if now >= y if job.Operator == "eq" else self.__runJob_Compare(now, y, job.Operator):
+                    self.__triggered[jobID] = job
+                elif job.Operator == "neq" or now < y:
+                    heapq.heappush(self.__dueJobs, (
+                        now.timestamp() + 1 if job.Operator == "neq" else y.timestamp(),
+                        next(self.__sequence), jobID))
+
     def runJob(self):
+        self.__collectDueJobs()
+        with self.__condition:
+            recheck, self.__recheck = self.__recheck, False
+        if recheck:
+            self.__checkPeerJobs()
+        with self.__condition:
+            triggered, self.__triggered = list(self.__triggered.values()), {}
+
+        groups: dict[tuple[str, str], list[PeerJob]] = {}
+        for job in triggered:
+            groups.setdefault((job.Configuration, job.Action), []).append(job)
+
         needToDelete = []
-        for job in self.Jobs:
-            c = WireguardConfigurations.get(job.Configuration)
-            if c is not None:
-                f, fp = c.searchPeer(job.Peer)
-                if f:
-                    if job.Field in ["total_receive", "total_sent", "total_data"]:
-                        s = job.Field.split("_")[1]
-                        x: float = getattr(fp, f"total_{s}") + getattr(fp, f"cumu_{s}")
-                        y: float = float(job.Value)
+        for (configuration, action), jobs in groups.items():
+            c = WireguardConfigurations.get(configuration)
+            if c is None or action not in ["restrict", "delete"]:
+                for job in jobs:
+                    self.__retry(job)
+                continue
+            with AllOperations.lock(c.Name):
+                peers = set(p.id for p in c.Peers)
+                found = [job for job in jobs if job.Peer in peers]
+                if len(found) > 0:
+                    if action == "restrict":
+                        c.restrictPeers([job.Peer for job in found])
                     else:
-                        x: datetime = datetime.now()
-                        y: datetime = datetime.strptime(job.Value, "%Y-%m-%d %H:%M:%S")
-                    runAction: bool = self.__runJob_Compare(x, y, job.Operator)
-                    if runAction:
-                        s = False
-                        if job.Action == "restrict":
-                            s = c.restrictPeers([fp.id]).get_json()
-                        elif job.Action == "delete":
-                            s = c.deletePeers([fp.id]).get_json()
-                
-                        if s['status'] is True:
-                            JobLogger.log(job.JobID, s["status"], 
-                                          f"Peer {fp.id} from {c.Name} is successfully {job.Action}ed."
-                            )
-                            needToDelete.append(job)
-                        else:
-                            JobLogger.log(job.JobID, s["status"],
-                                          f"Peer {fp.id} from {c.Name} failed {job.Action}ed."
-                            )
-        for j in needToDelete:
-            self.deleteJob(j)
+                        c.deletePeers([job.Peer for job in found])
+                    peers = set(p.id for p in c.Peers)
+            for job in jobs:
+                if job not in found:
+                    self.__retry(job)
+                elif job.Peer not in peers:
+                    JobLogger.log(job.JobID, True,
+                                  f"Peer {job.Peer} from {c.Name} is successfully {job.Action}ed.",
+                                  job.Configuration, job.Peer
+                    )
+                    needToDelete.append(job)
+                else:
+                    JobLogger.log(job.JobID, False,
+                                  f"Peer {job.Peer} from {c.Name} failed {job.Action}ed.",
+                                  job.Configuration, job.Peer
+                    )
+                    self.__retry(job)
+        if len(needToDelete) > 0:
+            self.deleteJobs(needToDelete)
+
+    def __retry(self, job: PeerJob):
+        due = time.time() + PeerJobs.RetryInterval
+        with self.__condition:
+            self.__retryAt[job.JobID] = due
+            heapq.heappush(self.__dueJobs, (due, next(self.__sequence), job.JobID))
+            self.__condition.notify_all()
 
     def __runJob_Compare(self, x: float | datetime, y: float | datetime, operator: str):
         if operator == "eq":
@@ -405,25 +1428,55 @@ class PeerShareLink:
         }
 
 class PeerShareLinks:
+    ReloadInterval = 5
+
     def __init__(self):
         self.Links: list[PeerShareLink] = []
-        existingTables = sqlSelect("SELECT name FROM sqlite_master WHERE type='table' and name = 'PeerShareLinks'").fetchall()
-        if len(existingTables) == 0:
-            sqlUpdate(
+        self.Version = 0
+        self.__rows: list[tuple] | None = None
+        self.__nextReload = 0
+        DashboardDatabase.migrate("PeerShareLinks", [
+            lambda conn: conn.execute(
                 """
-                    CREATE TABLE PeerShareLinks (
+                    CREATE TABLE IF NOT EXISTS PeerShareLinks (
                         ShareID VARCHAR NOT NULL PRIMARY KEY, Configuration VARCHAR NOT NULL, Peer VARCHAR NOT NULL,
                         ExpireDate DATETIME,
                         SharedDate DATETIME DEFAULT (datetime('now', 'localtime'))
                     )
                 """
-            )
+            ),
+            lambda conn: conn.execute(
+                "CREATE INDEX IF NOT EXISTS PeerShareLinks_Configuration_Peer ON PeerShareLinks (Configuration, Peer)")
+        ])
         self.__getSharedLinks()
     def __getSharedLinks(self):
-        self.Links.clear()
+        # Build a new list and swap it in, readers iterating the old one are never handed a half filled list
         allLinks = sqlSelect("SELECT * FROM PeerShareLinks WHERE ExpireDate IS NULL OR ExpireDate > datetime('now', 'localtime')").fetchall()
-        for link in allLinks:
-            self.Links.append(PeerShareLink(*link))
+        rows = [tuple(link) for link in allLinks]
+        self.__nextReload = time.monotonic() + PeerShareLinks.ReloadInterval
+        if rows == self.__rows:
+            return
+        self.__rows = rows
+        self.Links = [PeerShareLink(*link) for link in rows]
+        self.Version += 1
+
+    def refresh(self):
+        """
+        Reload the links at most every ReloadInterval seconds, they are shared by other workers and expire on their own
+        """
+        if time.monotonic() >= self.__nextReload:
+            self.__getSharedLinks()
+
+    def peerLinks(self, Configuration: str) -> dict[str, list[PeerShareLink]]:
+        """
+        The active links of every peer in a configuration, attached to the peers when their snapshot is built
+        """
+        self.refresh()
+        links = {}
+        for link in self.Links:
+            if link.Configuration == Configuration:
+                links.setdefault(link.Peer, []).append(link)
+        return links
     
     def getLink(self, Configuration: str, Peer: str) -> list[PeerShareLink]:
         self.__getSharedLinks()
@@ -448,8 +1501,583 @@ class PeerShareLinks:
         sqlUpdate("UPDATE PeerShareLinks SET ExpireDate = ? WHERE ShareID = ?;", (ExpireDate, ShareID, ))
         self.__getSharedLinks()
         return True, ""
-        
+
+class DashboardOperation:
+    def __init__(self, OperationID: str, Configuration: str, Type: str, Payload: str, Status: str, Stage: str,
+                 Progress: int, Total: int, Result: str, CreatedAt: datetime, StartedAt: datetime,
+                 FinishedAt: datetime):
+        self.OperationID = OperationID
+        self.Configuration = Configuration
+        self.Type = Type
+        self.Payload = Payload
+        self.Status = Status
+        self.Stage = Stage
+        self.Progress = Progress
+        self.Total = Total
+        self.Result = Result
+        self.CreatedAt = CreatedAt
+        self.StartedAt = StartedAt
+        self.FinishedAt = FinishedAt
+
+    def toJson(self):
+        return {
+            "OperationID": self.OperationID,
+            "Configuration": self.Configuration,
+            "Type": self.Type,
+            "Status": self.Status,
+            "Stage": self.Stage,
+            "Progress": self.Progress,
+            "Total": self.Total,
+            "Result": json.loads(self.Result) if self.Result else None,
+            "CreatedAt": self.CreatedAt,
+            "StartedAt": self.StartedAt,
+            "FinishedAt": self.FinishedAt
+        }
+
+class ConfigurationLock:
+    """
+    Serialises changes to one configuration across the threads of this process and across processes, with an
+    flock on LOCK_PATH/<configuration>.lock held while the outermost block runs. Another gunicorn worker or the
+    collector may have changed the configuration in the meantime, so its peers are reloaded once it is taken
+    """
+    def __init__(self, configuration: str):
+        self.Configuration = configuration
+        self.__lock = threading.RLock()
+        self.__depth = 0
+        self.__file = None
+
+    def __enter__(self):
+        self.__lock.acquire()
+        self.__depth += 1
+        if self.__depth == 1:
+            try:
+                self.__file = open(os.path.join(LOCK_PATH, f'{self.Configuration}.lock'), 'a')
+                fcntl.flock(self.__file, fcntl.LOCK_EX)
+                c = WireguardConfigurations.get(self.Configuration)
+                if c is not None and os.path.exists(
+                        os.path.join(DashboardConfig.GetConfig("Server", "wg_conf_path")[1], f'{c.Name}.conf')):
+                    c.getPeersList()
+            except Exception:
+                self.__release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.__release()
+
+    def tryLocal(self) -> bool:
+        """
+        Take the lock for the threads of this process only, without the flock, unless another thread holds it.
+        For work that rebuilds this process' view of the configuration and can skip a turn
+        """
+        return self.__lock.acquire(blocking=False)
+
+    def releaseLocal(self):
+        self.__lock.release()
+
+    def __release(self):
+        self.__depth -= 1
+        if self.__depth == 0 and self.__file is not None:
+            # Closing the file drops the flock
+            self.__file.close()
+            self.__file = None
+        self.__lock.release()
+
+class DashboardOperations:
+    """
+    Queue for long-running mutations. Each configuration gets its own worker thread so operations on the same
+    configuration run one after another, while requests only insert a row and return the operation ID.
+    """
+    Types = ["addPeers", "restrictPeers", "deletePeers", "allowAccessPeers", "toggleConfiguration",
+             "updateConfiguration"]
+
+    def __init__(self):
+        self.__queues: dict[str, queue.Queue] = {}
+        self.__locks: dict[str, ConfigurationLock] = {}
+        self.__guard = threading.Lock()
+        DashboardDatabase.migrate("DashboardOperations", [
+            lambda conn: conn.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS DashboardOperations (
+                        OperationID VARCHAR NOT NULL PRIMARY KEY, Configuration VARCHAR NOT NULL,
+                        Type VARCHAR NOT NULL, Payload VARCHAR, Status VARCHAR NOT NULL DEFAULT 'queued',
+                        Stage VARCHAR, Progress INT NOT NULL DEFAULT 0, Total INT NOT NULL DEFAULT 0, Result VARCHAR,
+                        CreatedAt DATETIME DEFAULT (datetime('now', 'localtime')), StartedAt DATETIME,
+                        FinishedAt DATETIME
+                    )
+                """
+            ),
+            lambda conn: conn.execute(
+                "CREATE INDEX IF NOT EXISTS DashboardOperations_Status_CreatedAt ON DashboardOperations (Status, CreatedAt)")
+        ])
+        sqlUpdate("UPDATE DashboardOperations SET Status = 'failed', FinishedAt = datetime('now', 'localtime'), "
+                  "Result = ? WHERE Status = 'running'",
+                  (json.dumps({"status": False, "message": "Interrupted by a restart", "data": None}),))
+
+    def lock(self, configuration: str) -> ConfigurationLock:
+        with self.__guard:
+            if configuration not in self.__locks:
+                self.__locks[configuration] = ConfigurationLock(configuration)
+            return self.__locks[configuration]
+
+    def submit(self, configuration: str, type: str, payload: dict) -> DashboardOperation:
+        operationID = str(uuid.uuid4())
+        sqlUpdate("INSERT INTO DashboardOperations (OperationID, Configuration, Type, Payload) VALUES (?, ?, ?, ?)",
+                  (operationID, configuration, type, json.dumps(payload),))
+        self.__enqueue(configuration, operationID)
+        return self.getOperation(operationID)
+
+    def resume(self):
+        for o in sqlSelect("SELECT OperationID, Configuration FROM DashboardOperations WHERE Status = 'queued' "
+                           "ORDER BY CreatedAt").fetchall():
+            self.__enqueue(o['Configuration'], o['OperationID'])
+
+    def getOperation(self, operationID: str) -> DashboardOperation | None:
+        o = sqlSelect("SELECT * FROM DashboardOperations WHERE OperationID = ?", (operationID,)).fetchone()
+        return DashboardOperation(*o) if o is not None else None
+
+    def getOperations(self, configuration: str = None, limit: int = 50) -> list[DashboardOperation]:
+        if configuration is not None:
+            operations = sqlSelect("SELECT * FROM DashboardOperations WHERE Configuration = ? "
+                                   "ORDER BY CreatedAt DESC LIMIT ?", (configuration, limit,)).fetchall()
+        else:
+            operations = sqlSelect("SELECT * FROM DashboardOperations ORDER BY CreatedAt DESC LIMIT ?",
+                                   (limit,)).fetchall()
+        return [DashboardOperation(*o) for o in operations]
+
+    def __enqueue(self, configuration: str, operationID: str):
+        with self.__guard:
+            if configuration not in self.__queues:
+                self.__queues[configuration] = queue.Queue()
+                t = threading.Thread(target=self.__worker, args=(configuration,), daemon=True)
+                t.start()
+            self.__queues[configuration].put(operationID)
+
+    def __worker(self, configuration: str):
+        q = self.__queues[configuration]
+        while True:
+            operationID = q.get()
+            try:
+                with app.app_context(), self.lock(configuration):
+                    self.__run(operationID)
+            except Exception as e:
+                print(f"[WGDashboard] Operation {operationID} Error: {str(e)}", flush=True)
+            finally:
+                q.task_done()
+
+    def __run(self, operationID: str):
+        # Claim the operation, the collector resumes queued operations that a worker may already be running
+        claimed = sqlUpdate("UPDATE DashboardOperations SET Status = 'running', "
+                            "StartedAt = datetime('now', 'localtime') WHERE OperationID = ? AND Status = 'queued'",
+                            (operationID,))
+        if claimed is None or claimed.rowcount == 0:
+            return
+        o = self.getOperation(operationID)
+
+        def progress(stage: str, done: int, total: int):
+            sqlUpdate("UPDATE DashboardOperations SET Stage = ?, Progress = ?, Total = ? WHERE OperationID = ?",
+                      (stage, done, total, operationID,))
+        try:
+            result = self.__execute(o, json.loads(o.Payload), progress).get_json()
+        except Exception as e:
+            result = {"status": False, "message": str(e), "data": None}
+        sqlUpdate("UPDATE DashboardOperations SET Status = ?, Result = ?, FinishedAt = datetime('now', 'localtime') "
+                  "WHERE OperationID = ?",
+                  ("succeeded" if result.get("status") else "failed", json.dumps(result), operationID,))
+
+    def __execute(self, o: DashboardOperation, payload: dict, progress) -> ResponseObject:
+        c = WireguardConfigurations.get(o.Configuration)
+        if c is None:
+            return ResponseObject(False, "Configuration does not exist")
+        if o.Type == "addPeers":
+            return c.provisionPeers(payload['amount'], payload['preshared_key'], payload['DNS'],
+                                    payload['endpoint_allowed_ip'], payload['mtu'], payload['keepalive'], progress)
+        if o.Type == "restrictPeers":
+            return c.restrictPeers(payload['peers'])
+        if o.Type == "deletePeers":
+            return c.deletePeers(payload['peers'])
+        if o.Type == "allowAccessPeers":
+            return c.allowAccessPeers(payload['peers'])
+        if o.Type == "toggleConfiguration":
+            status, msg = c.toggleConfiguration()
+            return ResponseObject(status, msg, c.Status)
+        if o.Type == "updateConfiguration":
+            status, msg = c.updateConfigurationSettings(payload)
+            return ResponseObject(status, msg, c)
+        return ResponseObject(False, f"Unknown operation {o.Type}")
+
+class BitmapAddressPool:
+    """
+    IPv4 pool with one bit per address. A segment tree over the free count of every 64-bit word finds the next free
+    address in O(log n) instead of walking every host.
+    """
+    def __init__(self, network: ipaddress.IPv4Network | ipaddress.IPv6Network):
+        self.network = network
+        self.size = network.num_addresses
+        if network.version == 4 and network.prefixlen < 31:
+            self.first, self.last = 1, self.size - 2
+        elif network.version == 6 and network.prefixlen < 127:
+            self.first, self.last = 1, self.size - 1
+        else:
+            self.first, self.last = 0, self.size - 1
+        wordCount = (self.size + 63) // 64
+        self.__leaves = 1
+        while self.__leaves < wordCount:
+            self.__leaves *= 2
+        self.__words = array.array('Q', [0]) * wordCount
+        self.__tree = array.array('q', [0]) * (2 * self.__leaves)
+        for w in range(wordCount):
+            self.__tree[self.__leaves + w] = 64
+        if self.size % 64 != 0:
+            self.__words[-1] = ~((1 << (self.size % 64)) - 1) & 0xFFFFFFFFFFFFFFFF
+            self.__tree[self.__leaves + wordCount - 1] = self.size % 64
+        for i in range(self.__leaves - 1, 0, -1):
+            self.__tree[i] = self.__tree[2 * i] + self.__tree[2 * i + 1]
+        for offset in itertools.chain(range(0, self.first), range(self.last + 1, self.size)):
+            self.markUsed(offset)
+
+    def __update(self, word: int, delta: int):
+        i = self.__leaves + word
+        while i >= 1:
+            self.__tree[i] += delta
+            i //= 2
+
+    def freeCount(self) -> int:
+        return self.__tree[1]
+
+    def isUsed(self, offset: int) -> bool:
+        return (self.__words[offset // 64] >> (offset % 64)) & 1 == 1
+
+    def markUsed(self, offset: int) -> bool:
+        if self.isUsed(offset):
+            return False
+        self.__words[offset // 64] |= 1 << (offset % 64)
+        self.__update(offset // 64, -1)
+        return True
+
+    def release(self, offset: int) -> bool:
+        if offset < self.first or offset > self.last or not self.isUsed(offset):
+            return False
+        self.__words[offset // 64] &= ~(1 << (offset % 64)) & 0xFFFFFFFFFFFFFFFF
+        self.__update(offset // 64, 1)
+        return True
+
+    def __firstFreeWord(self, word: int) -> int | None:
+        i = self.__leaves + word
+        if self.__tree[i] > 0:
+            return word
+        while i > 1:
+            if i % 2 == 0 and self.__tree[i + 1] > 0:
+                i += 1
+                while i < self.__leaves:
+                    i = 2 * i if self.__tree[2 * i] > 0 else 2 * i + 1
+                return i - self.__leaves
+            i //= 2
+        return None
+
+    def nextFree(self, start: int = 0) -> int | None:
+        start = max(start, self.first)
+        if start > self.last:
+            return None
+        word = start // 64
+        free = ~self.__words[word] & 0xFFFFFFFFFFFFFFFF & ~((1 << (start % 64)) - 1)
+        if free == 0:
+            word = self.__firstFreeWord(word + 1) if word + 1 < len(self.__words) else None
+            if word is None:
+                return None
+            free = ~self.__words[word] & 0xFFFFFFFFFFFFFFFF
+        offset = word * 64 + (free & -free).bit_length() - 1
+        return offset if offset <= self.last else None
+
+class IntervalAddressPool:
+    """
+    Sparse pool for networks too large for a bitmap (IPv6). Used addresses are kept as sorted, merged intervals,
+    so lookups are a bisect over the number of allocated ranges rather than the size of the network.
+    """
+    def __init__(self, network: ipaddress.IPv4Network | ipaddress.IPv6Network):
+        self.network = network
+        self.size = network.num_addresses
+        if network.version == 4 and network.prefixlen < 31:
+            self.first, self.last = 1, self.size - 2
+        elif network.version == 6 and network.prefixlen < 127:
+            self.first, self.last = 1, self.size - 1
+        else:
+            self.first, self.last = 0, self.size - 1
+        self.__starts: list[int] = []
+        self.__ends: list[int] = []
+        self.__used = 0
+
+    def freeCount(self) -> int:
+        return (self.last - self.first + 1) - self.__used
+
+    def isUsed(self, offset: int) -> bool:
+        if offset < self.first or offset > self.last:
+            return True
+        i = bisect.bisect_right(self.__starts, offset) - 1
+        return i >= 0 and self.__ends[i] >= offset
+
+    def markUsed(self, offset: int) -> bool:
+        if self.isUsed(offset):
+            return False
+        i = bisect.bisect_right(self.__starts, offset)
+        joinLeft = i > 0 and self.__ends[i - 1] == offset - 1
+        joinRight = i < len(self.__starts) and self.__starts[i] == offset + 1
+        if joinLeft and joinRight:
+            self.__ends[i - 1] = self.__ends[i]
+            del self.__starts[i], self.__ends[i]
+        elif joinLeft:
+            self.__ends[i - 1] = offset
+        elif joinRight:
+            self.__starts[i] = offset
+        else:
+            self.__starts.insert(i, offset)
+            self.__ends.insert(i, offset)
+        self.__used += 1
+        return True
+
+    def release(self, offset: int) -> bool:
+        if offset < self.first or offset > self.last or not self.isUsed(offset):
+            return False
+        i = bisect.bisect_right(self.__starts, offset) - 1
+        start, end = self.__starts[i], self.__ends[i]
+        if start == end:
+            del self.__starts[i], self.__ends[i]
+        elif offset == start:
+            self.__starts[i] = offset + 1
+        elif offset == end:
+            self.__ends[i] = offset - 1
+        else:
+            self.__ends[i] = offset - 1
+            self.__starts.insert(i + 1, offset + 1)
+            self.__ends.insert(i + 1, end)
+        self.__used -= 1
+        return True
+
+    def nextFree(self, start: int = 0) -> int | None:
+        offset = max(start, self.first)
+        i = bisect.bisect_right(self.__starts, offset) - 1
+        if i >= 0 and self.__ends[i] >= offset:
+            offset = self.__ends[i] + 1
+        return offset if offset <= self.last else None
+
+class AddressAllocator:
+    """
+    Tracks which host addresses of a configuration's Address networks are taken by peers (active or restricted)
+    or by the interface itself. Kept in sync incrementally when peers are added, updated or deleted.
+    """
+    BitmapLimit = 2 ** 24
+
+    def __init__(self, addresses: str):
+        self.pools: list[BitmapAddressPool | IntervalAddressPool] = []
+        self.__shared: dict[tuple[int, int], int] = {}
+        self.__lock = threading.RLock()
+        for a in addresses.replace(" ", "").split(","):
+            if len(a) == 0:
+                continue
+            try:
+                network = ipaddress.ip_network(a, False)
+            except ValueError:
+                continue
+            if network.version == 4 and network.num_addresses <= self.BitmapLimit:
+                self.pools.append(BitmapAddressPool(network))
+            else:
+                self.pools.append(IntervalAddressPool(network))
+            self.markUsed(a)
+
+    def __locate(self, ip: str) -> tuple[int, int] | None:
+        try:
+            address = ipaddress.ip_address(ip.strip().split("/")[0])
+        except ValueError:
+            return None
+        for i, pool in enumerate(self.pools):
+            if address.version == pool.network.version and address in pool.network:
+                return i, int(address) - int(pool.network.network_address)
+        return None
+
+    def markUsed(self, allowedIp: str):
+        with self.__lock:
+            for ip in allowedIp.split(","):
+                location = self.__locate(ip)
+                if location is not None and not self.pools[location[0]].markUsed(location[1]):
+                    self.__shared[location] = self.__shared.get(location, 1) + 1
+
+    def release(self, allowedIp: str):
+        with self.__lock:
+            for ip in allowedIp.split(","):
+                location = self.__locate(ip)
+                if location is None:
+                    continue
+                if location in self.__shared:
+                    self.__shared[location] -= 1
+                    if self.__shared[location] == 1:
+                        del self.__shared[location]
+                else:
+                    self.pools[location[0]].release(location[1])
+
+    def isAvailable(self, ip: str) -> bool:
+        location = self.__locate(ip)
+        return location is not None and not self.pools[location[0]].isUsed(location[1])
+
+    def freeCount(self) -> int:
+        return sum(p.freeCount() for p in self.pools)
+
+    def address(self, pool: int, offset: int) -> str:
+        network = self.pools[pool].network
+        return ipaddress.ip_network(network.network_address + offset).compressed
+
+    def position(self, ip: str) -> tuple[int, int] | None:
+        """
+        (pool, offset) of an address, or None if it is not inside any of the configuration's networks
+        """
+        return self.__locate(ip)
+
+    def iterFree(self, pool: int = 0, offset: int = 0):
+        """
+        Lazily yield (pool, offset) of free addresses from the given position onward
+        """
+        while pool < len(self.pools):
+            offset = self.pools[pool].nextFree(offset)
+            if offset is None:
+                pool, offset = pool + 1, 0
+                continue
+            yield pool, offset
+            offset += 1
+
+    def sample(self, pool: int, amount: int, attempts: int = 64) -> list[int]:
+        """
+        Pick up to amount free offsets at random from a pool. Meant for sparse networks (IPv6) where the free
+        space is far bigger than the used space, so a random probe almost always hits a free address.
+        """
+        p = self.pools[pool]
+        if p.last < p.first:
+            return []
+        picked = set()
+        for _ in range(amount * attempts):
+            if len(picked) == amount:
+                break
+            offset = random.randint(p.first, p.last)
+            if not p.isUsed(offset):
+                picked.add(offset)
+        return sorted(picked)
+
+    def allocate(self, amount: int) -> list[str]:
+        with self.__lock:
+            allocated = []
+            for pool, offset in self.iterFree():
+                if len(allocated) == amount:
+                    break
+                allocated.append((pool, offset))
+            if len(allocated) < amount:
+                return []
+            for pool, offset in allocated:
+                self.pools[pool].markUsed(offset)
+            return [self.address(pool, offset) for pool, offset in allocated]
+
+class AllowedIPTrieNode:
+    __slots__ = ("children", "owners", "count")
+
+    def __init__(self):
+        self.children: list[AllowedIPTrieNode | None] = [None, None]
+        self.owners: dict[str, int] = {}
+        self.count = 0
+
+class AllowedIPTrie:
+    """
+    Binary prefix trie over the allowed IPs of every peer (active or restricted) of a configuration.
+    Each CIDR is stored at the node of its prefix, and every node counts the entries below it, so finding
+    whether a CIDR overlaps anything walks at most prefix length nodes before it knows where to look.
+    """
+    def __init__(self):
+        self.__roots = {4: AllowedIPTrieNode(), 6: AllowedIPTrieNode()}
+        self.__lock = threading.RLock()
+
+    @staticmethod
+    def __parse(allowedIp: str) -> list[ipaddress.IPv4Network | ipaddress.IPv6Network]:
+        networks = []
+        for ip in allowedIp.split(","):
+            try:
+                networks.append(ipaddress.ip_network(ip.strip(), False))
+            except ValueError:
+                continue
+        return networks
+
+    @staticmethod
+    def __bits(network: ipaddress.IPv4Network | ipaddress.IPv6Network):
+        value = int(network.network_address)
+        for i in range(network.prefixlen):
+            yield (value >> (network.max_prefixlen - 1 - i)) & 1
+
+    def insert(self, allowedIp: str, owner: str):
+        with self.__lock:
+            for network in self.__parse(allowedIp):
+                node = self.__roots[network.version]
+                node.count += 1
+                for bit in self.__bits(network):
+                    if node.children[bit] is None:
+                        node.children[bit] = AllowedIPTrieNode()
+                    node = node.children[bit]
+                    node.count += 1
+                node.owners[owner] = node.owners.get(owner, 0) + 1
+
+    def remove(self, allowedIp: str, owner: str):
+        with self.__lock:
+            for network in self.__parse(allowedIp):
+                path = [self.__roots[network.version]]
+                for bit in self.__bits(network):
+                    path.append(path[-1].children[bit])
+                    if path[-1] is None:
+                        break
+                if path[-1] is None or owner not in path[-1].owners:
+                    continue
+                path[-1].owners[owner] -= 1
+                if path[-1].owners[owner] == 0:
+                    del path[-1].owners[owner]
+                for node in path:
+                    node.count -= 1
+                for depth, bit in enumerate(self.__bits(network)):
+                    if path[depth + 1].count == 0:
+                        path[depth].children[bit] = None
+                        break
+
+    def overlaps(self, allowedIp: str, exclude: str = None, limit: int = None) -> list[tuple[str, str]]:
+        """
+        (network, owner) of every stored CIDR that overlaps allowedIp, skipping the exclude owner
+        """
+        found = []
+        with self.__lock:
+            for network in self.__parse(allowedIp):
+                node = self.__roots[network.version]
+                value = 0
+                stack = []
+                for depth, bit in enumerate(itertools.chain(self.__bits(network), [None])):
+                    found += [(ipaddress.ip_network((value << (network.max_prefixlen - depth), depth)).compressed, o)
+                              for o in node.owners if o != exclude]
+                    if bit is None:
+                        # Everything below the query's own prefix is a subnet of it
+                        stack = [(c, (value << 1) | b, depth + 1) for b, c in enumerate(node.children) if c is not None]
+                        break
+                    node = node.children[bit]
+                    if node is None:
+                        break
+                    value = (value << 1) | bit
+                while len(stack) > 0 and (limit is None or len(found) < limit):
+                    n, v, depth = stack.pop()
+                    found += [(ipaddress.ip_network((v << (network.max_prefixlen - depth), depth)).compressed, o)
+                              for o in n.owners if o != exclude]
+                    stack += [(c, (v << 1) | b, depth + 1) for b, c in enumerate(n.children) if c is not None]
+                if limit is not None and len(found) >= limit:
+                    return found[:limit]
+        return found
+
+    def hasOverlap(self, allowedIp: str, exclude: str = None) -> bool:
+        return len(self.overlaps(allowedIp, exclude, 1)) > 0
+
 class WireguardConfiguration:
+    RemoveBatchSize = 256
+    SnapshotMaxAge = 10
+    TransferRollupDays = 90
+    TransferRollupInterval = 3600
+
     class InvalidConfigurationFileException(Exception):
         def __init__(self, m):
             self.message = m
@@ -463,6 +2091,7 @@ class WireguardConfiguration:
         self.__parser: configparser.ConfigParser = configparser.ConfigParser(strict=False)
         self.__parser.optionxform = str
         self.__configFileModifiedTime = None
+        self.__lastTransferRollup: str | None = None
 
         self.Status: bool = False
         self.Name: str = ""
@@ -523,17 +2152,37 @@ class WireguardConfiguration:
                 self.__parser.write(configFile)
 
         self.Peers: list[Peer] = []
+        self.RestrictedPeers: list[Peer] = []
+        self.AddressAllocator: AddressAllocator | None = None
+        self.AllowedIPTrie: AllowedIPTrie | None = None
+        self.TransferWindows: dict[str, PeerTransferWindow] = {}
+        self.PeerState = PeerStateSegment(os.path.join(STATE_PATH, f'{self.Name}.peers'))
+        self.Snapshot = PeerSnapshot(0, (), ())
+        self.__peerStateSeen = None
+        self.__snapshotBuiltAt = 0
+        self.__attachmentsSeen = None
         self.__createDatabase()
         self.getPeersList()
         self.getRestrictedPeersList()
+        self.__buildAddressAllocator()
+        self.__buildAllowedIPTrie()
 
     def __createDatabase(self):
-        existingTables = sqlSelect("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
-        existingTables = [t['name'] for t in existingTables]
-        if self.Name not in existingTables:
-            sqlUpdate(
+        DashboardDatabase.migrate(f"Configuration:{self.Name}", [
+            self.__createPeerTables,
+            lambda conn: conn.execute(
+                "CREATE INDEX IF NOT EXISTS '%s_transfer_id_time' ON '%s_transfer' (id, time)" % (self.Name, self.Name)),
+            self.__typePeerColumns,
+            self.__mergeRestrictedPeers,
+            lambda conn: conn.execute(
+                "CREATE INDEX IF NOT EXISTS '%s_transfer_time' ON '%s_transfer' (time)" % (self.Name, self.Name))
+        ])
+
+    def __createPeerTables(self, conn: sqlite3.Connection):
+        for table in [self.Name, f"{self.Name}_restrict_access", f"{self.Name}_deleted"]:
+            conn.execute(
                 """
-                CREATE TABLE '%s'(
+                CREATE TABLE IF NOT EXISTS '%s'(
                     id VARCHAR NOT NULL, private_key VARCHAR NULL, DNS VARCHAR NULL, 
                     endpoint_allowed_ip VARCHAR NULL, name VARCHAR NULL, total_receive FLOAT NULL, 
                     total_sent FLOAT NULL, total_data FLOAT NULL, endpoint VARCHAR NULL, 
@@ -542,48 +2191,75 @@ class WireguardConfiguration:
                     keepalive INT NULL, remote_endpoint VARCHAR NULL, preshared_key VARCHAR NULL,
                     PRIMARY KEY (id)
                 )
-                """ % self.Name
+                """ % table
             )
-
-        if f'{self.Name}_restrict_access' not in existingTables:
-            sqlUpdate(
-                """
-                CREATE TABLE '%s_restrict_access' (
-                    id VARCHAR NOT NULL, private_key VARCHAR NULL, DNS VARCHAR NULL, 
-                    endpoint_allowed_ip VARCHAR NULL, name VARCHAR NULL, total_receive FLOAT NULL, 
-                    total_sent FLOAT NULL, total_data FLOAT NULL, endpoint VARCHAR NULL, 
-                    status VARCHAR NULL, latest_handshake VARCHAR NULL, allowed_ip VARCHAR NULL, 
-                    cumu_receive FLOAT NULL, cumu_sent FLOAT NULL, cumu_data FLOAT NULL, mtu INT NULL, 
-                    keepalive INT NULL, remote_endpoint VARCHAR NULL, preshared_key VARCHAR NULL,
-                    PRIMARY KEY (id)
-                )
-                """ % self.Name
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS '%s_transfer' (
+                id VARCHAR NOT NULL, total_receive FLOAT NULL,
+                total_sent FLOAT NULL, total_data FLOAT NULL,
+                cumu_receive FLOAT NULL, cumu_sent FLOAT NULL, cumu_data FLOAT NULL, time DATETIME
             )
-        if f'{self.Name}_transfer' not in existingTables:
-            sqlUpdate(
+            """ % self.Name
+        )
+
+    def __typePeerColumns(self, conn: sqlite3.Connection):
+        """
+        Rebuild the peer tables with real numeric columns and latest_handshake as a Unix timestamp.
+        The old handshake values were durations relative to the last poll, so they start over at 0.
+        """
+        for table in [self.Name, f"{self.Name}_restrict_access", f"{self.Name}_deleted"]:
+            conn.execute(
                 """
-                CREATE TABLE '%s_transfer' (
-                    id VARCHAR NOT NULL, total_receive FLOAT NULL,
-                    total_sent FLOAT NULL, total_data FLOAT NULL,
-                    cumu_receive FLOAT NULL, cumu_sent FLOAT NULL, cumu_data FLOAT NULL, time DATETIME
+                CREATE TABLE '%s_typed'(
+                    id VARCHAR NOT NULL, private_key VARCHAR NULL, DNS VARCHAR NULL,
+                    endpoint_allowed_ip VARCHAR NULL, name VARCHAR NULL, total_receive REAL DEFAULT 0,
+                    total_sent REAL DEFAULT 0, total_data REAL DEFAULT 0, endpoint VARCHAR NULL,
+                    status VARCHAR DEFAULT 'stopped', latest_handshake INTEGER DEFAULT 0, allowed_ip VARCHAR NULL,
+                    cumu_receive REAL DEFAULT 0, cumu_sent REAL DEFAULT 0, cumu_data REAL DEFAULT 0, mtu INTEGER NULL,
+                    keepalive INTEGER NULL, remote_endpoint VARCHAR NULL, preshared_key VARCHAR NULL,
+                    PRIMARY KEY (id)
                 )
-                """ % self.Name
+                """ % table
             )
-        if f'{self.Name}_deleted' not in existingTables:
-            sqlUpdate(
+            conn.execute(
                 """
-                CREATE TABLE '%s_deleted' (
-                    id VARCHAR NOT NULL, private_key VARCHAR NULL, DNS VARCHAR NULL, 
-                    endpoint_allowed_ip VARCHAR NULL, name VARCHAR NULL, total_receive FLOAT NULL, 
-                    total_sent FLOAT NULL, total_data FLOAT NULL, endpoint VARCHAR NULL, 
-                    status VARCHAR NULL, latest_handshake VARCHAR NULL, allowed_ip VARCHAR NULL, 
-                    cumu_receive FLOAT NULL, cumu_sent FLOAT NULL, cumu_data FLOAT NULL, mtu INT NULL, 
-                    keepalive INT NULL, remote_endpoint VARCHAR NULL, preshared_key VARCHAR NULL,
-                    PRIMARY KEY (id)
-                )
-                """ % self.Name
+                INSERT INTO '%s_typed'
+                    SELECT id, private_key, DNS, endpoint_allowed_ip, name, IFNULL(total_receive, 0),
+                    IFNULL(total_sent, 0), IFNULL(total_data, 0), endpoint, IFNULL(status, 'stopped'), 0, allowed_ip,
+                    IFNULL(cumu_receive, 0), IFNULL(cumu_sent, 0), IFNULL(cumu_data, 0), CAST(mtu AS INTEGER),
+                    CAST(keepalive AS INTEGER), remote_endpoint, preshared_key FROM '%s'
+                """ % (table, table)
             )
+            conn.execute("DROP TABLE '%s'" % table)
+            conn.execute("ALTER TABLE '%s_typed' RENAME TO '%s'" % (table, table))
+
+    def __mergeRestrictedPeers(self, conn: sqlite3.Connection):
+        """
+        Keep restricted peers in the peer table with state = 'restricted' instead of moving rows between tables.
+        The _deleted table was never written to, so it is dropped as well.
+        """
+        conn.execute("ALTER TABLE '%s' ADD COLUMN state VARCHAR NOT NULL DEFAULT 'active'" % self.Name)
+        conn.execute("INSERT OR IGNORE INTO '%s' SELECT *, 'restricted' FROM '%s_restrict_access'"
+                     % (self.Name, self.Name))
+        conn.execute("DROP TABLE '%s_restrict_access'" % self.Name)
+        conn.execute("DROP TABLE IF EXISTS '%s_deleted'" % self.Name)
+        conn.execute("CREATE INDEX '%s_restricted' ON '%s' (id) WHERE state = 'restricted'" % (self.Name, self.Name))
     
+    def __buildAddressAllocator(self):
+        allocator = AddressAllocator(self.Address)
+        for p in itertools.chain(self.Peers, self.RestrictedPeers):
+            if p.allowed_ip is not None and len(p.allowed_ip) > 0 and p.allowed_ip != "N/A":
+                allocator.markUsed(p.allowed_ip)
+        self.AddressAllocator = allocator
+
+    def __buildAllowedIPTrie(self):
+        trie = AllowedIPTrie()
+        for p in itertools.chain(self.Peers, self.RestrictedPeers):
+            if p.allowed_ip is not None:
+                trie.insert(p.allowed_ip, p.id)
+        self.AllowedIPTrie = trie
+
     def __getPublicKey(self) -> str:
         return _generatePublicKey(self.PrivateKey)[1]
 
@@ -592,10 +2268,66 @@ class WireguardConfiguration:
         return self.Status
 
     def __getRestrictedPeers(self):
-        self.RestrictedPeers = []
-        restricted = sqlSelect("SELECT * FROM '%s_restrict_access'" % self.Name).fetchall()
-        for i in restricted:
-            self.RestrictedPeers.append(Peer(i, self))
+        previous = {p.id: p for p in self.Snapshot.RestrictedPeers}
+        restricted = sqlSelect("SELECT * FROM '%s' WHERE state = 'restricted'" % self.Name).fetchall()
+        self.RestrictedPeers = [self.__peer(i, previous) for i in restricted]
+        self.__publishSnapshot()
+
+    def __peer(self, row: sqlite3.Row, previous: dict) -> "Peer":
+        """
+        The record of the previous snapshot when neither the row nor the live state of the peer changed
+        """
+        p = previous.get(row['id'])
+        if p is not None and p.Row == tuple(row) and p.Live == Peer.liveState(self, row['id']):
+            return p
+        return Peer(row, self)
+
+    @staticmethod
+    def __attach(p: "Peer", jobs: dict, links: dict) -> "Peer":
+        """
+        The peer with its jobs and share links, a copy when they changed since the record was published
+        """
+        peerJobs, peerLinks = jobs.get(p.id, []), links.get(p.id, [])
+        if p.jobs == peerJobs and p.ShareLink == peerLinks:
+            return p
+        p = copy.copy(p)
+        p.jobs, p.ShareLink = peerJobs, peerLinks
+        return p
+
+    def __publishSnapshot(self):
+        jobs, links = AllPeerJobs.peerJobs(self.Name), AllPeerShareLinks.peerLinks(self.Name)
+        self.__attachmentsSeen = (AllPeerJobs.Version, AllPeerShareLinks.Version)
+        self.Peers = [self.__attach(p, jobs, links) for p in self.Peers]
+        self.RestrictedPeers = [self.__attach(p, jobs, links) for p in self.RestrictedPeers]
+        self.Snapshot = PeerSnapshot(self.Snapshot.Version + 1, tuple(self.Peers), tuple(self.RestrictedPeers))
+        self.__snapshotBuiltAt = time.monotonic()
+
+    def refreshSnapshot(self):
+        """
+        Reload the peers when the configuration file changed or the collector published new peer state since the
+        last reload, and republish them when their jobs or share links changed. Run by the snapshot thread of each
+        web worker, so requests never have to
+        """
+        # A reload rebuilds AddressAllocator and AllowedIPTrie, which must not happen under a request thread of
+        # this worker that is adding peers. Such a thread holds the configuration lock, so wait for the next tick
+        lock = AllOperations.lock(self.Name)
+        if not lock.tryLocal():
+            return
+        try:
+            AllPeerJobs.refresh()
+            AllPeerShareLinks.refresh()
+            summary = self.PeerState.summary()
+            updatedAt = summary["UpdatedAt"] if summary is not None else None
+            path = os.path.join(DashboardConfig.GetConfig("Server", "wg_conf_path")[1], f'{self.Name}.conf')
+            if (os.path.getmtime(path) != self.__configFileModifiedTime or updatedAt != self.__peerStateSeen
+                    or (updatedAt is None and time.monotonic() - self.__snapshotBuiltAt >= WireguardConfiguration.SnapshotMaxAge)):
+                self.__peerStateSeen = updatedAt
+                self.getPeersList()
+                self.getRestrictedPeersList()
+            elif (AllPeerJobs.Version, AllPeerShareLinks.Version) != self.__attachmentsSeen:
+                self.__publishSnapshot()
+        finally:
+            lock.releaseLocal()
             
     def configurationFileChanged(self) :
         mt = os.path.getmtime(os.path.join(DashboardConfig.GetConfig("Server", "wg_conf_path")[1], f'{self.Name}.conf'))
@@ -606,7 +2338,7 @@ class WireguardConfiguration:
     def __getPeers(self):
         
         if self.configurationFileChanged():
-            self.Peers = []
+            peers = []
             with open(os.path.join(DashboardConfig.GetConfig("Server", "wg_conf_path")[1], f'{self.Name}.conf'), 'r') as configFile:
                 p = []
                 pCounter = -1
@@ -648,7 +2380,7 @@ class WireguardConfiguration:
                                     "total_data": 0,
                                     "endpoint": "N/A",
                                     "status": "stopped",
-                                    "latest_handshake": "N/A",
+                                    "latest_handshake": 0,
                                     "allowed_ip": i.get("AllowedIPs", "N/A"),
                                     "cumu_receive": 0,
                                     "cumu_sent": 0,
@@ -657,131 +2389,257 @@ class WireguardConfiguration:
                                     "mtu": DashboardConfig.GetConfig("Peers", "peer_mtu")[1],
                                     "keepalive": DashboardConfig.GetConfig("Peers", "peer_keep_alive")[1],
                                     "remote_endpoint": DashboardConfig.GetConfig("Peers", "remote_endpoint")[1],
-                                    "preshared_key": i["PresharedKey"] if "PresharedKey" in i.keys() else ""
+                                    "preshared_key": i["PresharedKey"] if "PresharedKey" in i.keys() else "",
+                                    "state": "active"
                                 }
                                 sqlUpdate(
                                     """
-                                    INSERT INTO '%s'
+                                    INSERT OR IGNORE INTO '%s'
                                         VALUES (:id, :private_key, :DNS, :endpoint_allowed_ip, :name, :total_receive, :total_sent, 
                                         :total_data, :endpoint, :status, :latest_handshake, :allowed_ip, :cumu_receive, :cumu_sent, 
-                                        :cumu_data, :mtu, :keepalive, :remote_endpoint, :preshared_key);
+                                        :cumu_data, :mtu, :keepalive, :remote_endpoint, :preshared_key, :state);
                                     """ % self.Name
                                     , newPeer)
-                                self.Peers.append(Peer(newPeer, self))
+                                peers.append(Peer(newPeer, self))
                             else:
-                                sqlUpdate("UPDATE '%s' SET allowed_ip = ? WHERE id = ?" % self.Name,
+                                sqlUpdate("UPDATE '%s' SET allowed_ip = ?, state = 'active' WHERE id = ?" % self.Name,
                                                (i.get("AllowedIPs", "N/A"), i['PublicKey'],))
-                                self.Peers.append(Peer(checkIfExist, self))
+                                peers.append(Peer(checkIfExist, self))
                 except Exception as e:
                     if __name__ == '__main__':
                         print(f"[WGDashboard] {self.Name} Error: {str(e)}")
+                self.Peers = peers
+                if self.AddressAllocator is not None:
+                    self.__getRestrictedPeers()
+                    self.__buildAddressAllocator()
+                    self.__buildAllowedIPTrie()
         else:
-            self.Peers.clear()
-            checkIfExist = sqlSelect("SELECT * FROM '%s'" % self.Name).fetchall()
-            for i in checkIfExist:
-                self.Peers.append(Peer(i, self))
-        
+            previous = dict(self.Snapshot.Index)
+            previous.update((p.id, p) for p in self.Snapshot.RestrictedPeers)
+            peers, restricted = [], []
+            for i in sqlSelect("SELECT * FROM '%s'" % self.Name).fetchall():
+                (restricted if i['state'] == 'restricted' else peers).append(self.__peer(i, previous))
+            self.Peers, self.RestrictedPeers = peers, restricted
+        self.__publishSnapshot()
+
             
     def addPeers(self, peers: list):
         for p in peers:
-            subprocess.check_output(f"wg set {self.Name} peer {p['id']} allowed-ips {p['allowed_ip']}", 
-                                    shell=True, stderr=subprocess.STDOUT)
-        subprocess.check_output(
-            f"wg-quick save {self.Name}", shell=True, stderr=subprocess.STDOUT)    
+            SystemCommands.run(["wg", "set", self.Name, "peer", p['id'], "allowed-ips", p['allowed_ip'].replace(" ", "")])
+        SystemCommands.run(["wg-quick", "save", self.Name])
         self.getPeersList()
-        
+
+    def provisionPeers(self, amount: int, presharedKey: bool, DNS: str, endpointAllowedIp: str,
+                       mtu: int, keepalive: int, progress=None) -> ResponseObject:
+        """
+        Bulk add peers with one allocation pass, one SQL transaction, one `wg addconf` and one `wg-quick save`
+        @param progress: Optional callable(stage, done, total) used to report how far the provisioning is
+        """
+        def report(stage: str, done: int):
+            if progress is not None:
+                progress(stage, done, amount)
+
+        report("allocating", 0)
+        if len(self.AddressAllocator.pools) == 0 or self.AddressAllocator.freeCount() == 0:
+            return ResponseObject(False, "No more available IP can assign")
+        availableIps = self.AddressAllocator.allocate(amount)
+        if len(availableIps) < amount:
+            return ResponseObject(False, f"The maximum number of peers can add is {self.AddressAllocator.freeCount()}")
+
+        conflicts = [c for ip in availableIps for c in self.AllowedIPTrie.overlaps(ip, limit=1)]
+        if len(conflicts) > 0:
+            self.AddressAllocator.release(",".join(availableIps))
+            return ResponseObject(False, f"Allowed IP {conflicts[0][0]} of peer {conflicts[0][1]} overlaps with "
+                                         f"the addresses to assign")
+
+        report("generating", 0)
+        keyPairs = _generateKeyPairs(amount, presharedKey)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        newPeers = []
+        for i, kp in enumerate(keyPairs):
+            newPeers.append({
+                "id": kp['id'],
+                "private_key": kp['private_key'],
+                "DNS": DNS,
+                "endpoint_allowed_ip": endpointAllowedIp,
+                "name": f"BulkPeer #{(i + 1)}_{timestamp}",
+                "total_receive": 0,
+                "total_sent": 0,
+                "total_data": 0,
+                "endpoint": "N/A",
+                "status": "stopped",
+                "latest_handshake": 0,
+                "allowed_ip": availableIps[i],
+                "cumu_receive": 0,
+                "cumu_sent": 0,
+                "cumu_data": 0,
+                "mtu": mtu,
+                "keepalive": keepalive,
+                "remote_endpoint": DashboardConfig.GetConfig("Peers", "remote_endpoint")[1],
+                "preshared_key": kp['preshared_key'],
+                "state": "active"
+            })
+        report("generating", amount)
+
+        report("saving", 0)
+        if not sqlUpdateMany(
+                """
+                INSERT INTO '%s'
+                    VALUES (:id, :private_key, :DNS, :endpoint_allowed_ip, :name, :total_receive, :total_sent,
+                    :total_data, :endpoint, :status, :latest_handshake, :allowed_ip, :cumu_receive, :cumu_sent,
+                    :cumu_data, :mtu, :keepalive, :remote_endpoint, :preshared_key, :state);
+                """ % self.Name, newPeers):
+            self.AddressAllocator.release(",".join(availableIps))
+            return ResponseObject(False, "Failed to save peers to database")
+        report("saving", amount)
+
+        report("applying", 0)
+        with tempfile.NamedTemporaryFile("w+", suffix=".conf") as peerConfig:
+            for p in newPeers:
+                peerConfig.write(f"[Peer]\nPublicKey = {p['id']}\nAllowedIPs = {p['allowed_ip']}\n")
+                if len(p['preshared_key']) > 0:
+                    peerConfig.write(f"PresharedKey = {p['preshared_key']}\n")
+            peerConfig.flush()
+            try:
+                SystemCommands.run(["wg", "addconf", self.Name, peerConfig.name])
+            except subprocess.CalledProcessError as exc:
+                sqlUpdateMany("DELETE FROM '%s' WHERE id = ?" % self.Name, [(p['id'],) for p in newPeers])
+                self.AddressAllocator.release(",".join(availableIps))
+                return ResponseObject(False, exc.output.decode("UTF-8").strip())
+        report("applying", amount)
+
+        report("writing", 0)
+        status, msg = self.__wgSave()
+        if not status:
+            # Undo everything so the interface, the database and the allocator agree that none of the peers exist
+            for start in range(0, len(newPeers), WireguardConfiguration.RemoveBatchSize):
+                batch = newPeers[start:start + WireguardConfiguration.RemoveBatchSize]
+                try:
+                    SystemCommands.run(["wg", "set", self.Name] + [a for p in batch for a in ["peer", p['id'], "remove"]])
+                except subprocess.CalledProcessError as exc:
+                    print(f"[WGDashboard] {self.Name} Error: could not remove provisioned peers after "
+                          f"`wg-quick save` failed: {exc.output.decode('UTF-8').strip()}", flush=True)
+            sqlUpdateMany("DELETE FROM '%s' WHERE id = ?" % self.Name, [(p['id'],) for p in newPeers])
+            self.AddressAllocator.release(",".join(availableIps))
+            return ResponseObject(False, "Failed to save configuration through WireGuard")
+        # The rows are already in the database, so skip re-parsing the file we just wrote
+        self.configurationFileChanged()
+        self.Peers = self.Peers + [Peer(p, self) for p in newPeers]
+        self.__publishSnapshot()
+        for p in newPeers:
+            self.AllowedIPTrie.insert(p['allowed_ip'], p['id'])
+        report("writing", amount)
+        return ResponseObject(True, f"Added {amount} peer(s)", [p['id'] for p in newPeers])
+
     def searchPeer(self, publicKey):
-        for i in self.Peers:
-            if i.id == publicKey:
-                return True, i
-        return False, None
+        p = self.Snapshot.Index.get(publicKey)
+        return p is not None, p
 
     def allowAccessPeers(self, listOfPublicKeys):
         if not self.getStatus():
             self.toggleConfiguration()
         
         for i in listOfPublicKeys:
-            p = sqlSelect("SELECT * FROM '%s_restrict_access' WHERE id = ?" % self.Name, (i,)).fetchone()
+            p = sqlSelect("SELECT * FROM '%s' WHERE id = ? AND state = 'restricted'" % self.Name, (i,)).fetchone()
             if p is not None:
-                sqlUpdate("INSERT INTO '%s' SELECT * FROM %s_restrict_access WHERE id = ?"
-                               % (self.Name, self.Name,), (p['id'],))
-                sqlUpdate("DELETE FROM '%s_restrict_access' WHERE id = ?"
-                               % self.Name, (p['id'],))
-                
-                presharedKeyExist = len(p['preshared_key']) > 0
-                rd = random.Random()
-                uid = uuid.UUID(int=rd.getrandbits(128), version=4)
-                if presharedKeyExist:
-                    with open(f"{uid}", "w+") as f:
-                        f.write(p['preshared_key'])
-                        
-                subprocess.check_output(f"wg set {self.Name} peer {p['id']} allowed-ips {p['allowed_ip'].replace(' ', '')}{f' preshared-key {uid}' if presharedKeyExist else ''}",
-                                        shell=True, stderr=subprocess.STDOUT)
-                if presharedKeyExist: os.remove(str(uid))
+                sqlUpdate("UPDATE '%s' SET state = 'active' WHERE id = ?" % self.Name, (p['id'],))
+                _wgSetPeer(self.Name, p['id'], p['allowed_ip'], p['preshared_key'])
             else:
                 return ResponseObject(False, "Failed to allow access of peer " + i)
-        if not self.__wgSave():
+        status, msg = self.__wgSave()
+        if not status:
             return ResponseObject(False, "Failed to save configuration through WireGuard")
 
         self.__getPeers()
         return ResponseObject(True, "Allow access successfully!")
 
     def restrictPeers(self, listOfPublicKeys):
-        numOfRestrictedPeers = 0
-        numOfFailedToRestrictPeers = 0
         if not self.getStatus():
             self.toggleConfiguration()
-        for p in listOfPublicKeys:
-            found, pf = self.searchPeer(p)
-            if found:
-                try:
-                    subprocess.check_output(f"wg set {self.Name} peer {pf.id} remove",
-                                            shell=True, stderr=subprocess.STDOUT)
-                    sqlUpdate("INSERT INTO '%s_restrict_access' SELECT * FROM %s WHERE id = ?" %
-                                   (self.Name, self.Name,), (pf.id,))
-                    sqlUpdate("UPDATE '%s_restrict_access' SET status = 'stopped' WHERE id = ?" %
-                                   (self.Name,), (pf.id,))
-                    sqlUpdate("DELETE FROM '%s' WHERE id = ?" % self.Name, (pf.id,))
-                    numOfRestrictedPeers += 1
-                except Exception as e:
-                    numOfFailedToRestrictPeers += 1
+        restricted = self.__removePeers(listOfPublicKeys, True)
 
-        if not self.__wgSave():
+        status, msg = self.__wgSave()
+        if not status:
             return ResponseObject(False, "Failed to save configuration through WireGuard")
+        self.configurationFileChanged()
 
-        self.__getPeers()
-
-        if numOfRestrictedPeers == len(listOfPublicKeys):
-            return ResponseObject(True, f"Restricted {numOfRestrictedPeers} peer(s)")
+        if len(restricted) == len(listOfPublicKeys):
+            return ResponseObject(True, f"Restricted {len(restricted)} peer(s)")
         return ResponseObject(False,
-                              f"Restricted {numOfRestrictedPeers} peer(s) successfully. Failed to restrict {numOfFailedToRestrictPeers} peer(s)")
-        pass
+                              f"Restricted {len(restricted)} peer(s) successfully. Failed to restrict {len(listOfPublicKeys) - len(restricted)} peer(s)")
 
     def deletePeers(self, listOfPublicKeys):
-        numOfDeletedPeers = 0
-        numOfFailedToDeletePeers = 0
         if not self.getStatus():
             self.toggleConfiguration()
-        for p in listOfPublicKeys:
-            found, pf = self.searchPeer(p)
-            if found:
-                try:
-                    subprocess.check_output(f"wg set {self.Name} peer {pf.id} remove",
-                                            shell=True, stderr=subprocess.STDOUT)
-                    sqlUpdate("DELETE FROM '%s' WHERE id = ?" % self.Name, (pf.id,))
-                    numOfDeletedPeers += 1
-                except Exception as e:
-                    numOfFailedToDeletePeers += 1
+        deleted = self.__removePeers(listOfPublicKeys, False)
 
-        if not self.__wgSave():
+        status, msg = self.__wgSave()
+        if not status:
             return ResponseObject(False, "Failed to save configuration through WireGuard")
+        self.configurationFileChanged()
 
-        self.__getPeers()
-
-        if numOfDeletedPeers == len(listOfPublicKeys):
-            return ResponseObject(True, f"Deleted {numOfDeletedPeers} peer(s)")
+        if len(deleted) == len(listOfPublicKeys):
+            return ResponseObject(True, f"Deleted {len(deleted)} peer(s)")
         return ResponseObject(False,
-                              f"Deleted {numOfDeletedPeers} peer(s) successfully. Failed to delete {numOfFailedToDeletePeers} peer(s)")
+                              f"Deleted {len(deleted)} peer(s) successfully. Failed to delete {len(listOfPublicKeys) - len(deleted)} peer(s)")
+
+    def __removePeers(self, listOfPublicKeys, restrict: bool) -> list:
+        """
+        Remove peers from the interface with one `wg set` per batch, update their rows in one transaction and
+        update the in-memory peer lists, allocator and trie instead of reloading the whole configuration
+        """
+        peers = {p.id: p for p in self.Peers}
+        found = [peers[k] for k in dict.fromkeys(listOfPublicKeys) if k in peers]
+        removed = []
+        for start in range(0, len(found), WireguardConfiguration.RemoveBatchSize):
+            batch = found[start:start + WireguardConfiguration.RemoveBatchSize]
+            try:
+                SystemCommands.run(["wg", "set", self.Name] + [a for p in batch for a in ["peer", p.id, "remove"]])
+                removed += batch
+            except subprocess.CalledProcessError:
+                # Fall back to one peer at a time so one bad key does not fail the whole batch
+                for p in batch:
+                    try:
+                        SystemCommands.run(["wg", "set", self.Name, "peer", p.id, "remove"])
+                        removed.append(p)
+                    except subprocess.CalledProcessError:
+                        pass
+        if len(removed) == 0:
+            return removed
+
+        if restrict:
+            statement = "UPDATE '%s' SET state = 'restricted', status = 'stopped' WHERE id = ?"
+        else:
+            statement = "DELETE FROM '%s' WHERE id = ?"
+        if not sqlUpdateMany(statement % self.Name, [(p.id,) for p in removed]):
+            # Put the peers back on the interface, otherwise the next `wg-quick save` would write them out of the
+            # configuration file while their rows still say they are active
+            for p in removed:
+                try:
+                    _wgSetPeer(self.Name, p.id, p.allowed_ip, p.preshared_key)
+                except subprocess.CalledProcessError as exc:
+                    print(f"[WGDashboard] {self.Name} Error: could not restore peer {p.id} after the database "
+                          f"update failed: {exc.output.decode('UTF-8').strip()}", flush=True)
+            self.__getPeers()
+            return []
+
+        removedIds = set(p.id for p in removed)
+        self.Peers = [p for p in self.Peers if p.id not in removedIds]
+        restricted = []
+        for p in removed:
+            self.TransferWindows.pop(p.id, None)
+            if restrict:
+                # A new record, the current snapshot still holds the old one
+                p = copy.copy(p)
+                p.state = "restricted"
+                p.status = "stopped"
+                restricted.append(p)
+            elif p.allowed_ip is not None:
+                self.AddressAllocator.release(p.allowed_ip)
+                self.AllowedIPTrie.remove(p.allowed_ip, p.id)
+        self.RestrictedPeers = self.RestrictedPeers + restricted
+        self.__publishSnapshot()
+        return removed
 
     def __savePeers(self):
         for i in self.Peers:
@@ -791,7 +2649,7 @@ class WireguardConfiguration:
                 UPDATE '%s' SET private_key = :private_key, 
                     DNS = :DNS, endpoint_allowed_ip = :endpoint_allowed_ip, name = :name, 
                     total_receive = :total_receive, total_sent = :total_sent, total_data = :total_data, 
-                    endpoint = :endpoint, status = :status, latest_handshake = :latest_handshake, 
+                    endpoint = :endpoint, status = :status, latest_handshake = :latest_handshake_at, 
                     allowed_ip = :allowed_ip, cumu_receive = :cumu_receive, cumu_sent = :cumu_sent, 
                     cumu_data = :cumu_data, mtu = :mtu, keepalive = :keepalive, 
                     remote_endpoint = :remote_endpoint, preshared_key = :preshared_key WHERE id = :id
@@ -800,7 +2658,7 @@ class WireguardConfiguration:
 
     def __wgSave(self) -> tuple[bool, str] | tuple[bool, None]:
         try:
-            subprocess.check_output(f"wg-quick save {self.Name}", shell=True, stderr=subprocess.STDOUT)
+            SystemCommands.run(["wg-quick", "save", self.Name])
             return True, None
         except subprocess.CalledProcessError as e:
             return False, str(e)
@@ -809,8 +2667,7 @@ class WireguardConfiguration:
         if not self.getStatus():
             self.toggleConfiguration()
         try:
-            latestHandshake = subprocess.check_output(f"wg show {self.Name} latest-handshakes",
-                                                      shell=True, stderr=subprocess.STDOUT)
+            latestHandshake = SystemCommands.run(["wg", "show", self.Name, "latest-handshakes"])
         except subprocess.CalledProcessError:
             return "stopped"
         latestHandshake = latestHandshake.decode("UTF-8").split()
@@ -823,20 +2680,19 @@ class WireguardConfiguration:
                 status = "running"
             else:
                 status = "stopped"
-            if int(latestHandshake[count + 1]) > 0:
-                sqlUpdate("UPDATE '%s' SET latest_handshake = ?, status = ? WHERE id= ?" % self.Name
-                              , (str(minus).split(".", maxsplit=1)[0], status, latestHandshake[count],))
-            else:
-                sqlUpdate("UPDATE '%s' SET latest_handshake = 'No Handshake', status = ? WHERE id= ?" % self.Name
-                              , (status, latestHandshake[count],))
+            sqlUpdate("UPDATE '%s' SET latest_handshake = ?, status = ? WHERE id= ?" % self.Name
+                          , (int(latestHandshake[count + 1]), status, latestHandshake[count],))
+            window = self.TransferWindows.get(latestHandshake[count])
+            if window is not None:
+                window.LastActivity = max(window.LastActivity, int(latestHandshake[count + 1]))
             count += 2
     
     def getPeersTransfer(self):
         if not self.getStatus():
             self.toggleConfiguration()
         try:
-            data_usage = subprocess.check_output(f"wg show {self.Name} transfer",
-                                                 shell=True, stderr=subprocess.STDOUT)
+            data_usage = SystemCommands.run(["wg", "show", self.Name, "transfer"])
+            now = time.time()
             data_usage = data_usage.decode("UTF-8").split("\n")
             data_usage = [p.split("\t") for p in data_usage]
             for i in range(len(data_usage)):
@@ -852,6 +2708,7 @@ class WireguardConfiguration:
                         cur_total_receive = float(data_usage[i][1]) / (1024 ** 3)
                         cumulative_receive = cur_i['cumu_receive'] + total_receive
                         cumulative_sent = cur_i['cumu_sent'] + total_sent
+                        cumu_receive, cumu_sent = cur_i['cumu_receive'], cur_i['cumu_sent']
                         if total_sent <= cur_total_sent and total_receive <= cur_total_receive:
                             total_sent = cur_total_sent
                             total_receive = cur_total_receive
@@ -863,12 +2720,21 @@ class WireguardConfiguration:
                                             data_usage[i][0],))
                             total_sent = 0
                             total_receive = 0
+                            cumu_receive, cumu_sent = cumulative_receive, cumulative_sent
+                        # A peer a web worker just added has a row but may not be in this snapshot yet
                         _, p = self.searchPeer(data_usage[i][0])
-                        if p.total_receive != total_receive or p.total_sent != total_sent:
+                        if p is None or p.total_receive != total_receive or p.total_sent != total_sent:
                             sqlUpdate(
                                 "UPDATE '%s' SET total_receive = ?, total_sent = ?, total_data = ? WHERE id = ?"
                                 % self.Name, (total_receive, total_sent,
                                               total_receive + total_sent, data_usage[i][0],))
+                        window = self.TransferWindows.get(data_usage[i][0])
+                        if window is None:
+                            window = PeerTransferWindow(p.latest_handshake_at if p is not None else 0)
+                            self.TransferWindows[data_usage[i][0]] = window
+                        changed = window.append(now, cumu_receive + total_receive, cumu_sent + total_sent)
+                        AllPeerJobs.updatePeerTransfer(self.Name, data_usage[i][0], window, changed)
+            self.__rollupTransfer()
         except Exception as e:
             print(f"[WGDashboard] {self.Name} Error: {str(e)} {str(e.__traceback__)}")
 
@@ -876,8 +2742,7 @@ class WireguardConfiguration:
         if not self.getStatus():
             self.toggleConfiguration()
         try:
-            data_usage = subprocess.check_output(f"wg show {self.Name} endpoints",
-                                                 shell=True, stderr=subprocess.STDOUT)
+            data_usage = SystemCommands.run(["wg", "show", self.Name, "endpoints"])
         except subprocess.CalledProcessError:
             return "stopped"
         data_usage = data_usage.decode("UTF-8").split()
@@ -891,29 +2756,124 @@ class WireguardConfiguration:
         self.getStatus()
         if self.Status:
             try:
-                check = subprocess.check_output(f"wg-quick down {self.Name}",
-                                                shell=True, stderr=subprocess.STDOUT)
+                check = SystemCommands.run(["wg-quick", "down", self.Name])
             except subprocess.CalledProcessError as exc:
                 return False, str(exc.output.strip().decode("utf-8"))
         else:
             try:
-                check = subprocess.check_output(f"wg-quick up {self.Name}",
-                                                shell=True, stderr=subprocess.STDOUT)
+                check = SystemCommands.run(["wg-quick", "up", self.Name])
             except subprocess.CalledProcessError as exc:
                 return False, str(exc.output.strip().decode("utf-8"))
         self.getStatus()
         return True, None
 
+    def getTopPeers(self, field: str, limit: int, window: int | None = None) -> list[tuple[float, str]]:
+        """
+        Top `limit` peers as (value, id): by current rate in bytes/s when window is None, otherwise by usage in GB
+        over the last `window` seconds. Usage is read from the transfer windows when they cover the window or the
+        window is shorter than the rollup interval, and from the hourly rollups otherwise, which can add up to one
+        interval of usage before the window. A web worker has no transfer windows, only the collector keeps them, and
+        reads windows shorter than the rollup interval from the minute checkpoints the collector publishes, which can
+        add up to a minute of usage before the window
+        """
+        def pick(receive, sent):
+            return receive if field == "receive" else sent if field == "sent" else receive + sent
+
+        if window is None:
+            if len(self.TransferWindows) == 0:
+                # A web worker, the rates live in the collector
+                return heapq.nlargest(limit, ((pick(receive, sent), i) for i, receive, sent in
+                                              self.PeerState.rates() or []))
+            return heapq.nlargest(limit, ((pick(w.ReceiveRate, w.SentRate), i)
+                                          for i, w in list(self.TransferWindows.items())))
+        now = time.time()
+        windows = list(self.TransferWindows.items())
+        if len(windows) == 0 and window < WireguardConfiguration.TransferRollupInterval:
+            return heapq.nlargest(limit, ((pick(receive, sent), i) for i, receive, sent in
+                                          self.PeerState.usage(now - window) or []))
+        if len(windows) > 0 and (window < WireguardConfiguration.TransferRollupInterval or all(
+                len(w.Samples) > 0 and w.Samples[0][0] <= now - window for _, w in windows)):
+            return heapq.nlargest(limit, ((self.__windowUsage(w, now - window, pick), i) for i, w in windows))
+
+        since = datetime.fromtimestamp(now - window).strftime("%Y-%m-%d %H:%M:%S")
+        cumu, total = {"receive": ("cumu_receive", "total_receive"),
+                       "sent": ("cumu_sent", "total_sent")}.get(field, ("cumu_data", "total_data"))
+        # SQLite takes the bare columns of a MAX() aggregate from the row holding the maximum, i.e. the last
+        # snapshot taken before the window started. A peer without one is newer than the window
+        rows = sqlSelect(
+            f"""
+            SELECT p.id AS id, p.{cumu} + p.{total} - COALESCE(b.usage, 0) AS usage FROM '{self.Name}' p
+            LEFT JOIN (SELECT id, MAX(time), {cumu} + {total} AS usage FROM '{self.Name}_transfer' WHERE time <= ? GROUP BY id) b
+            ON b.id = p.id ORDER BY usage DESC LIMIT ?
+            """, (since, limit)).fetchall()
+        return [(row['usage'] or 0, row['id']) for row in rows]
+
+    def __windowUsage(self, window: PeerTransferWindow, since: float, pick) -> float:
+        if len(window.Samples) == 0:
+            return 0.0
+        start = window.Samples[0]
+        for sample in window.Samples:
+            if sample[0] > since:
+                break
+            start = sample
+        end = window.Samples[-1]
+        return pick(max(0.0, end[1] - start[1]), max(0.0, end[2] - start[2]))
+
+    def __rollupTransfer(self):
+        """
+        Snapshot every peer's counters into the _transfer table once an hour, used for usage over long windows
+        """
+        hour = datetime.now().strftime("%Y-%m-%d %H:00:00")
+        if self.__lastTransferRollup is None:
+            row = sqlSelect("SELECT MAX(time) AS time FROM '%s_transfer'" % self.Name).fetchone()
+            self.__lastTransferRollup = row['time'] or ""
+        if self.__lastTransferRollup >= hour:
+            return
+        cutoff = (datetime.now() - timedelta(days=WireguardConfiguration.TransferRollupDays)).strftime(
+            "%Y-%m-%d %H:%M:%S")
+        with DashboardDatabase.transaction():
+            DashboardDatabase.execute(
+                """
+                INSERT INTO '%s_transfer' SELECT id, total_receive, total_sent, total_data, cumu_receive, cumu_sent, 
+                cumu_data, ? FROM '%s'
+                """ % (self.Name, self.Name), (hour,))
+            DashboardDatabase.execute("DELETE FROM '%s_transfer' WHERE time < ?" % self.Name, (cutoff,))
+        self.__lastTransferRollup = hour
+
     def getPeersList(self):
         self.__getPeers()
         return self.Peers
 
+    def publishPeerState(self):
+        """
+        Write the live counters of every peer to the shared segment, called by the collector after each poll
+        """
+        snapshot = self.Snapshot
+        peers = []
+        restricted = set(snapshot.RestrictedPeers)
+        for p in snapshot.Peers + snapshot.RestrictedPeers:
+            window = self.TransferWindows.get(p.id)
+            peers.append((p.id, p.endpoint, p.total_receive, p.total_sent, p.cumu_receive, p.cumu_sent,
+                          window.ReceiveRate if window is not None else 0, window.SentRate if window is not None else 0,
+                          p.latest_handshake_at, p.status == "running", p in restricted,
+                          window.Minutes if window is not None else None))
+        self.__peerStateSeen = self.PeerState.publish(peers)
+
     def getRestrictedPeersList(self) -> list:
         self.__getRestrictedPeers()
         return self.RestrictedPeers
 
     def toJson(self):
         self.Status = self.getStatus()
+        summary = self.PeerState.summary()
+        if summary is None:
+            snapshot = self.Snapshot
+            summary = {
+                "Receive": snapshot.DataUsage["Receive"],
+                "Sent": snapshot.DataUsage["Sent"],
+                "ConnectedPeers": snapshot.ConnectedPeers,
+                "TotalPeers": snapshot.TotalPeers
+            }
         return {
             "Status": self.Status,
             "Name": self.Name,
@@ -927,12 +2887,12 @@ class WireguardConfiguration:
             "PostDown": self.PostDown,
             "SaveConfig": self.SaveConfig,
             "DataUsage": {
-                "Total": sum(list(map(lambda x: x.cumu_data + x.total_data, self.Peers))),
-                "Sent": sum(list(map(lambda x: x.cumu_sent + x.total_sent, self.Peers))),
-                "Receive": sum(list(map(lambda x: x.cumu_receive + x.total_receive, self.Peers)))
+                "Total": summary["Receive"] + summary["Sent"],
+                "Sent": summary["Sent"],
+                "Receive": summary["Receive"]
             },
-            "ConnectedPeers": len(list(filter(lambda x: x.status == "running", self.Peers))),
-            "TotalPeers": len(self.Peers)
+            "ConnectedPeers": summary["ConnectedPeers"],
+            "TotalPeers": summary["TotalPeers"]
         }
     
     def updateConfigurationSettings(self, newData: dict) -> tuple[bool, str]:
@@ -962,7 +2922,6 @@ class WireguardConfiguration:
                         else:
                             setattr(self, key, str(newData[key]))
                         dataChanged = True
-                    print(original[line])
         if dataChanged:
             
             if not os.path.exists(os.path.join(DashboardConfig.GetConfig("Server", "wg_conf_path")[1], 'WGDashboard_Backup')):
@@ -973,6 +2932,7 @@ class WireguardConfiguration:
             )
             with open(os.path.join(DashboardConfig.GetConfig("Server", "wg_conf_path")[1], f'{self.Name}.conf'), 'w') as f:
                 f.write("\n".join(original))
+            self.__buildAddressAllocator()
         
         
         status, msg = self.toggleConfiguration()        
@@ -993,7 +2953,8 @@ class Peer:
         self.total_data = tableData["total_data"]
         self.endpoint = tableData["endpoint"]
         self.status = tableData["status"]
-        self.latest_handshake = tableData["latest_handshake"]
+        self.latest_handshake_at: int = tableData["latest_handshake"] or 0
+        self.latest_handshake = _handshakeToString(self.latest_handshake_at)
         self.allowed_ip = tableData["allowed_ip"]
         self.cumu_receive = tableData["cumu_receive"]
         self.cumu_sent = tableData["cumu_sent"]
@@ -1002,15 +2963,40 @@ class Peer:
         self.keepalive = tableData["keepalive"]
         self.remote_endpoint = tableData["remote_endpoint"]
         self.preshared_key = tableData["preshared_key"]
+        self.state = tableData["state"]
+        self.Row = tuple(tableData[k] for k in tableData.keys())
+        self.Live = Peer.liveState(configuration, self.id)
+        live = self.Live
+        if live is not None and "status" in live:
+            # Live values from the collector's last poll
+            self.endpoint = live["endpoint"] or self.endpoint
+            self.status = live["status"]
+            self.latest_handshake_at = live["latest_handshake"]
+            self.latest_handshake = _handshakeToString(self.latest_handshake_at)
+            self.total_receive, self.total_sent = live["total_receive"], live["total_sent"]
+            self.total_data = self.total_receive + self.total_sent
+            self.cumu_receive, self.cumu_sent = live["cumu_receive"], live["cumu_sent"]
+            self.cumu_data = self.cumu_receive + self.cumu_sent
+        self.receive_rate: float = round(live["receive_rate"], 2) if live is not None else 0
+        self.sent_rate: float = round(live["sent_rate"], 2) if live is not None else 0
+        self.data_rate: float = round(self.receive_rate + self.sent_rate, 2)
+        # Attached by WireguardConfiguration when the snapshot holding this record is built
         self.jobs: list[PeerJob] = []
         self.ShareLink: list[PeerShareLink] = []
-        self.getJobs()
-        self.getShareLink()
+
+    @staticmethod
+    def liveState(configuration: WireguardConfiguration, peerID: str) -> dict | None:
+        """
+        Rates from the transfer window when this process polls the peer, otherwise the peer's slot in the
+        configuration's PeerStateSegment
+        """
+        window = configuration.TransferWindows.get(peerID)
+        if window is not None:
+            return {"receive_rate": round(window.ReceiveRate, 2), "sent_rate": round(window.SentRate, 2)}
+        return configuration.PeerState.get(peerID)
 
     def toJson(self):
-        self.getJobs()
-        self.getShareLink()
-        return self.__dict__
+        return {k: v for k, v in self.__dict__.items() if k not in ["Row", "Live"]}
 
     def __repr__(self):
         return str(self.toJson())
@@ -1022,13 +3008,9 @@ class Peer:
         if not self.configuration.getStatus():
             self.configuration.toggleConfiguration()
 
-        existingAllowedIps = [item for row in list(
-            map(lambda x: [q.strip() for q in x.split(',')],
-                map(lambda y: y.allowed_ip,
-                    list(filter(lambda k: k.id != self.id, self.configuration.getPeersList()))))) for item in row]
-
-        if allowed_ip in existingAllowedIps:
-            return ResponseObject(False, "Allowed IP already taken by another peer")
+        conflicts = self.configuration.AllowedIPTrie.overlaps(allowed_ip, self.id, 1)
+        if len(conflicts) > 0:
+            return ResponseObject(False, f"Allowed IP overlaps with {conflicts[0][0]} of peer {conflicts[0][1]}")
         if not _checkIPWithRange(endpoint_allowed_ip):
             return ResponseObject(False, f"Endpoint Allowed IPs format is incorrect")
         if len(dns_addresses) > 0 and not _checkDNS(dns_addresses):
@@ -1042,25 +3024,12 @@ class Peer:
             if not pubKey[0] or pubKey[1] != self.id:
                 return ResponseObject(False, "Private key does not match with the public key")
         try:
-            rd = random.Random()
-            uid = uuid.UUID(int=rd.getrandbits(128), version=4)
-            pskExist = len(preshared_key) > 0
-            
-            if pskExist:
-                with open(f"{uid}", "w+") as f:
-                    f.write(preshared_key)
-            newAllowedIPs = allowed_ip.replace(" ", "")
-            updateAllowedIp = subprocess.check_output(
-                f"wg set {self.configuration.Name} peer {self.id} allowed-ips {newAllowedIPs}{f' preshared-key {uid}' if pskExist else ''}",
-                shell=True, stderr=subprocess.STDOUT)
-            
-            if pskExist: os.remove(str(uid))
+            updateAllowedIp = _wgSetPeer(self.configuration.Name, self.id, allowed_ip, preshared_key)
             
             if len(updateAllowedIp.decode().strip("\n")) != 0:
                 return ResponseObject(False,
                                       "Update peer failed when updating Allowed IPs")
-            saveConfig = subprocess.check_output(f"wg-quick save {self.configuration.Name}",
-                                                 shell=True, stderr=subprocess.STDOUT)
+            saveConfig = SystemCommands.run(["wg-quick", "save", self.configuration.Name])
             if f"wg showconf {self.configuration.Name}" not in saveConfig.decode().strip('\n'):
                 return ResponseObject(False,
                                       "Update peer failed when saving the configuration")
@@ -1070,6 +3039,12 @@ class Peer:
                 (name, private_key, dns_addresses, endpoint_allowed_ip, mtu,
                  keepalive, preshared_key, self.id,)
             )
+            if self.allowed_ip != allowed_ip:
+                self.configuration.AddressAllocator.release(self.allowed_ip)
+                self.configuration.AddressAllocator.markUsed(allowed_ip)
+                self.configuration.AllowedIPTrie.remove(self.allowed_ip, self.id)
+                self.configuration.AllowedIPTrie.insert(allowed_ip, self.id)
+                self.allowed_ip = allowed_ip
             return ResponseObject()
         except subprocess.CalledProcessError as exc:
             return ResponseObject(False, exc.output.decode("UTF-8").strip())
@@ -1107,12 +3082,6 @@ PersistentKeepalive = {str(self.keepalive)}
             "file": peerConfiguration
         }
 
-    def getJobs(self):
-        self.jobs = AllPeerJobs.searchJob(self.configuration.Name, self.id)
-
-    def getShareLink(self):
-        self.ShareLink = AllPeerShareLinks.getLink(self.configuration.Name, self.id)
-        
     def resetDataUsage(self, type):
         try:
             if type == "total":
@@ -1137,22 +3106,46 @@ def iPv46RegexCheck(ip):
         r'((^\s*((([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))\s*$)|(^\s*((([0-9a-f]{1,4}:){7}([0-9a-f]{1,4}|:))|(([0-9a-f]{1,4}:){6}(:[0-9a-f]{1,4}|((25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3})|:))|(([0-9a-f]{1,4}:){5}(((:[0-9a-f]{1,4}){1,2})|:((25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3})|:))|(([0-9a-f]{1,4}:){4}(((:[0-9a-f]{1,4}){1,3})|((:[0-9a-f]{1,4})?:((25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3}))|:))|(([0-9a-f]{1,4}:){3}(((:[0-9a-f]{1,4}){1,4})|((:[0-9a-f]{1,4}){0,2}:((25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3}))|:))|(([0-9a-f]{1,4}:){2}(((:[0-9a-f]{1,4}){1,5})|((:[0-9a-f]{1,4}){0,3}:((25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3}))|:))|(([0-9a-f]{1,4}:){1}(((:[0-9a-f]{1,4}){1,6})|((:[0-9a-f]{1,4}){0,4}:((25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3}))|:))|(:(((:[0-9a-f]{1,4}){1,7})|((:[0-9a-f]{1,4}){0,5}:((25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3}))|:)))(%.+)?\s*$))',
         ip)
 
+def _hashAPIKey(key: str) -> str:
+    # API keys are 256-bit random tokens, so an unsalted SHA-256 is enough to keep them out of the database
+    return hashlib.sha256(key.encode()).hexdigest()
+
 class DashboardAPIKey:
-    def __init__(self, Key: str, CreatedAt: str, ExpiredAt: str):
-        self.Key = Key
+    def __init__(self, KeyID: str, KeyHash: str, KeyHint: str, CreatedAt: str, ExpiredAt: str):
+        self.KeyID = KeyID
+        self.KeyHash = KeyHash
+        self.KeyHint = KeyHint
         self.CreatedAt = CreatedAt
         self.ExpiredAt = ExpiredAt
+
+    def expiresAt(self) -> float | None:
+        if self.ExpiredAt is None:
+            return None
+        return datetime.fromisoformat(str(self.ExpiredAt)).timestamp()
     
     def toJson(self):
-        return self.__dict__
+        return {
+            "KeyID": self.KeyID,
+            "KeyHint": self.KeyHint,
+            "CreatedAt": self.CreatedAt,
+            "ExpiredAt": self.ExpiredAt
+        }
 
 class DashboardConfig:
+    WatchInterval = 1
+    APIKeyReloadInterval = 5
 
     def __init__(self):
         if not os.path.exists(DASHBOARD_CONF):
             open(DASHBOARD_CONF, "x")
-        self.__config = configparser.ConfigParser(strict=False)
-        self.__config.read_file(open(DASHBOARD_CONF, "r+"))
+        self.__lock = threading.RLock()
+        self.__batchDepth = 0
+        self.__dirty = False
+        self.__modifiedTime = None
+        self.__nextWatch = 0
+        self.__snapshot: dict[str, dict[str, Any]] = {}
+        self.__config = self.__readConfig()
+        self.__buildSnapshot()
         self.hiddenAttribute = ["totp_key"]
         self.__default = {
             "Account": {
@@ -1167,12 +3160,20 @@ class DashboardConfig:
                 "app_prefix": "",
                 "app_ip": "0.0.0.0",
                 "app_port": wgd_app_port,
+                "app_workers": wgd_app_workers,
+                "app_threads": wgd_app_threads,
+                "app_server": "wsgi",
                 "auth_req": "true",
                 "version": DASHBOARD_VERSION,
                 "dashboard_refresh_interval": "60000",
                 "dashboard_sort": "status",
                 "dashboard_theme": "dark",
-                "dashboard_api_key": "false"
+                "dashboard_api_key": "false",
+                "dashboard_log_level": "all",
+                "dashboard_log_sample_rate": "1.0",
+                "dashboard_log_retention_days": "90",
+                "dashboard_log_max_rows": "500000",
+                "job_log_retention_days": "365"
             },
             "Peers": {
                 "peer_global_DNS": wgd_global_dns,
@@ -1190,38 +3191,109 @@ class DashboardConfig:
             }
         }
 
-        for section, keys in self.__default.items():
-            for key, value in keys.items():
-                exist, currentData = self.GetConfig(section, key)
-                if not exist:
-                    self.SetConfig(section, key, value, True)
+        with self.batch():
+            for section, keys in self.__default.items():
+                for key, value in keys.items():
+                    exist, currentData = self.GetConfig(section, key)
+                    if not exist:
+                        self.SetConfig(section, key, value, True)
+        self.__apiKeyLock = threading.Lock()
+        self.__apiKeys: dict[str, DashboardAPIKey] = {}
+        self.__apiKeyExpiry: list[tuple[float, str]] = []
+        self.__nextAPIKeyReload = 0
         self.__createAPIKeyTable()
-        self.DashboardAPIKeys = self.__getAPIKeys()
-        self.APIAccessed = False
+        self.__getAPIKeys()
         self.SetConfig("Server", "version", DASHBOARD_VERSION)
     
     def __createAPIKeyTable(self):
-        existingTable = sqlSelect("SELECT name FROM sqlite_master WHERE type='table' AND name = 'DashboardAPIKeys'").fetchall()
-        if len(existingTable) == 0:
-            sqlUpdate("CREATE TABLE DashboardAPIKeys (Key VARCHAR NOT NULL PRIMARY KEY, CreatedAt DATETIME NOT NULL DEFAULT (datetime('now', 'localtime')), ExpiredAt VARCHAR)")
+        DashboardDatabase.migrate("DashboardAPIKeys", [
+            lambda conn: conn.execute("CREATE TABLE IF NOT EXISTS DashboardAPIKeys (Key VARCHAR NOT NULL PRIMARY KEY, CreatedAt DATETIME NOT NULL DEFAULT (datetime('now', 'localtime')), ExpiredAt VARCHAR)"),
+            self.__hashAPIKeys
+        ])
+
+    def __hashAPIKeys(self, conn: sqlite3.Connection):
+        """
+        Replace the plaintext keys with their SHA-256 hash, a random ID used to delete them and a short hint
+        """
+        conn.execute("CREATE TABLE DashboardAPIKeys_hashed (KeyID VARCHAR NOT NULL PRIMARY KEY, KeyHash VARCHAR NOT NULL UNIQUE, KeyHint VARCHAR NOT NULL, CreatedAt DATETIME NOT NULL DEFAULT (datetime('now', 'localtime')), ExpiredAt VARCHAR)")
+        for key, createdAt, expiredAt in conn.execute("SELECT Key, CreatedAt, ExpiredAt FROM DashboardAPIKeys").fetchall():
+            conn.execute("INSERT INTO DashboardAPIKeys_hashed VALUES (?, ?, ?, ?, ?)",
+                         (secrets.token_hex(8), _hashAPIKey(key), key[:6], createdAt, expiredAt))
+        conn.execute("DROP TABLE DashboardAPIKeys")
+        conn.execute("ALTER TABLE DashboardAPIKeys_hashed RENAME TO DashboardAPIKeys")
     
-    def __getAPIKeys(self) -> list[DashboardAPIKey]:
-        keys = sqlSelect("SELECT * FROM DashboardAPIKeys WHERE ExpiredAt IS NULL OR ExpiredAt > datetime('now', 'localtime') ORDER BY CreatedAt DESC").fetchall()
-        fKeys = []
-        for k in keys:
-            
-            fKeys.append(DashboardAPIKey(*k))
-        return fKeys
+    def __getAPIKeys(self):
+        self.__nextAPIKeyReload = time.monotonic() + DashboardConfig.APIKeyReloadInterval
+        keys = sqlSelect("SELECT KeyID, KeyHash, KeyHint, CreatedAt, ExpiredAt FROM DashboardAPIKeys WHERE ExpiredAt IS NULL OR ExpiredAt > datetime('now', 'localtime')").fetchall()
+        with self.__apiKeyLock:
+            self.__apiKeys = {}
+            self.__apiKeyExpiry = []
+            for k in keys:
+                self.__indexAPIKey(DashboardAPIKey(*k))
+
+    def __indexAPIKey(self, key: DashboardAPIKey):
+        self.__apiKeys[key.KeyHash] = key
+        if key.ExpiredAt is not None:
+            heapq.heappush(self.__apiKeyExpiry, (key.expiresAt(), key.KeyHash))
+
+    def __expireAPIKeys(self):
+        now = time.time()
+        while len(self.__apiKeyExpiry) > 0 and self.__apiKeyExpiry[0][0] <= now:
+            expiresAt, keyHash = heapq.heappop(self.__apiKeyExpiry)
+            key = self.__apiKeys.get(keyHash)
+            if key is not None and key.expiresAt() == expiresAt:
+                del self.__apiKeys[keyHash]
+
+    def __refreshAPIKeys(self):
+        """
+        Keys are created and deleted by whichever worker handles the request, so every worker reloads its index
+        every APIKeyReloadInterval seconds
+        """
+        if time.monotonic() >= self.__nextAPIKeyReload:
+            self.__getAPIKeys()
+
+    @property
+    def DashboardAPIKeys(self) -> list[DashboardAPIKey]:
+        self.__refreshAPIKeys()
+        with self.__apiKeyLock:
+            self.__expireAPIKeys()
+            return sorted(self.__apiKeys.values(), key=lambda x: str(x.CreatedAt), reverse=True)
+
+    def validateAPIKey(self, key: str) -> bool:
+        keyHash = _hashAPIKey(key)
+        self.__refreshAPIKeys()
+        with self.__apiKeyLock:
+            self.__expireAPIKeys()
+            if keyHash in self.__apiKeys:
+                return True
+        # A key created by another worker since the last reload
+        k = sqlSelect("SELECT KeyID, KeyHash, KeyHint, CreatedAt, ExpiredAt FROM DashboardAPIKeys WHERE KeyHash = ? AND (ExpiredAt IS NULL OR ExpiredAt > datetime('now', 'localtime'))",
+                      (keyHash,)).fetchone()
+        if k is None:
+            return False
+        with self.__apiKeyLock:
+            self.__indexAPIKey(DashboardAPIKey(*k))
+        return True
     
-    def createAPIKeys(self, ExpiredAt = None):
+    def createAPIKeys(self, ExpiredAt = None) -> str:
         newKey = secrets.token_urlsafe(32)
-        sqlUpdate('INSERT INTO DashboardAPIKeys (Key, ExpiredAt) VALUES (?, ?)', (newKey, ExpiredAt,))
-        
-        self.DashboardAPIKeys = self.__getAPIKeys()
+        keyID = secrets.token_hex(8)
+        sqlUpdate('INSERT INTO DashboardAPIKeys (KeyID, KeyHash, KeyHint, ExpiredAt) VALUES (?, ?, ?, ?)',
+                  (keyID, _hashAPIKey(newKey), newKey[:6], ExpiredAt,))
+        key = sqlSelect("SELECT KeyID, KeyHash, KeyHint, CreatedAt, ExpiredAt FROM DashboardAPIKeys WHERE KeyID = ?",
+                        (keyID,)).fetchone()
+        with self.__apiKeyLock:
+            self.__indexAPIKey(DashboardAPIKey(*key))
+        return newKey
         
-    def deleteAPIKey(self, key):
-        sqlUpdate("UPDATE DashboardAPIKeys SET ExpiredAt = datetime('now', 'localtime') WHERE Key = ?", (key, ))
-        self.DashboardAPIKeys = self.__getAPIKeys()
+    def deleteAPIKey(self, keyID) -> bool:
+        deleted = sqlUpdate("UPDATE DashboardAPIKeys SET ExpiredAt = datetime('now', 'localtime') WHERE KeyID = ? AND (ExpiredAt IS NULL OR ExpiredAt > datetime('now', 'localtime'))",
+                            (keyID, ))
+        with self.__apiKeyLock:
+            for keyHash, key in list(self.__apiKeys.items()):
+                if key.KeyID == keyID:
+                    del self.__apiKeys[keyHash]
+        return deleted is not None and deleted.rowcount > 0
     
     
     
@@ -1274,59 +3346,119 @@ class DashboardConfig:
             if not os.path.exists(value):
                 return False, "Path does not exist"
 
-        if section not in self.__config:
-            self.__config[section] = {}
+        if type(value) is bool:
+            value = "true" if value else "false"
+        elif type(value) in [int, float]:
+            value = str(value)
 
-        if key not in self.__config[section].keys() or value != self.__config[section][key]:
-            if type(value) is bool:
-                if value:
-                    self.__config[section][key] = "true"
-                else:
-                    self.__config[section][key] = "false"
-            if type(value) in [int, float]:
-                self.__config[section][key] = str(value)
-            else:
+        with self.__lock:
+            if section not in self.__config:
+                self.__config[section] = {}
+
+            if key not in self.__config[section].keys() or value != self.__config[section][key]:
                 self.__config[section][key] = value
-            return self.SaveConfig(), ""
+                self.__buildSnapshot()
+                self.__dirty = True
+                if self.__batchDepth == 0:
+                    return self.SaveConfig(), ""
         return True, ""
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Defer saving until the outermost batch exits, so several SetConfig calls write the file once
+        """
+        with self.__lock:
+            self.__batchDepth += 1
+        try:
+            yield self
+        finally:
+            with self.__lock:
+                self.__batchDepth -= 1
+                if self.__batchDepth == 0 and self.__dirty:
+                    self.SaveConfig()
+
     def SaveConfig(self) -> bool:
+        with self.__lock:
+            try:
+                fd, path = tempfile.mkstemp(dir=os.path.dirname(DASHBOARD_CONF), prefix=".wg-dashboard.ini.")
+                try:
+                    with os.fdopen(fd, "w", encoding='utf-8') as configFile:
+                        self.__config.write(configFile)
+                        configFile.flush()
+                        os.fsync(configFile.fileno())
+                    if os.path.exists(DASHBOARD_CONF):
+                        shutil.copymode(DASHBOARD_CONF, path)
+                    os.replace(path, DASHBOARD_CONF)
+                except Exception:
+                    os.unlink(path)
+                    raise
+                self.__dirty = False
+                self.__modifiedTime = os.stat(DASHBOARD_CONF).st_mtime_ns
+                return True
+            except Exception as e:
+                print(f"[WGDashboard] Failed to save {DASHBOARD_CONF}: {str(e)}")
+                return False
+
+    def __readConfig(self) -> configparser.ConfigParser:
+        config = configparser.ConfigParser(strict=False)
+        self.__modifiedTime = os.stat(DASHBOARD_CONF).st_mtime_ns
+        with open(DASHBOARD_CONF, "r", encoding='utf-8') as configFile:
+            config.read_file(configFile)
+        return config
+
+    def __buildSnapshot(self):
+        """
+        Rebuild the typed, read-only view GetConfig reads from. Readers only dereference the current snapshot,
+        so they never take the lock
+        """
+        snapshot = {}
+        for section in self.__config.sections():
+            values = {}
+            for key, val in self.__config.items(section):
+                if val in ["1", "yes", "true", "on"]:
+                    values[key] = True
+                elif val in ["0", "no", "false", "off"]:
+                    values[key] = False
+                else:
+                    values[key] = val
+            snapshot[section] = types.MappingProxyType(values)
+        self.__snapshot = types.MappingProxyType(snapshot)
+
+    def __watch(self):
+        now = time.monotonic()
+        if now < self.__nextWatch:
+            return
+        self.__nextWatch = now + DashboardConfig.WatchInterval
         try:
-            with open(DASHBOARD_CONF, "w+", encoding='utf-8') as configFile:
-                self.__config.write(configFile)
-            return True
-        except Exception as e:
-            return False
+            if os.stat(DASHBOARD_CONF).st_mtime_ns == self.__modifiedTime:
+                return
+        except OSError:
+            return
+        with self.__lock:
+            if self.__dirty:
+                return
+            try:
+                self.__config = self.__readConfig()
+                self.__buildSnapshot()
+                print(f"[WGDashboard] Reloaded {DASHBOARD_CONF}")
+            except (OSError, configparser.Error) as e:
+                print(f"[WGDashboard] Failed to reload {DASHBOARD_CONF}: {str(e)}")
 
     def GetConfig(self, section, key) -> [bool, any]:
-        if section not in self.__config:
+        self.__watch()
+        values = self.__snapshot.get(section)
+        if values is None:
             return False, None
-
-        if key not in self.__config[section]:
+        key = key.lower()
+        if key not in values:
             return False, None
-
-        if self.__config[section][key] in ["1", "yes", "true", "on"]:
-            return True, True
-
-        if self.__config[section][key] in ["0", "no", "false", "off"]:
-            return True, False
-
-        return True, self.__config[section][key]
+        return True, values[key]
 
     def toJson(self) -> dict[str, dict[Any, Any]]:
-        the_dict = {}
-
-        for section in self.__config.sections():
-            the_dict[section] = {}
-            for key, val in self.__config.items(section):
-                if key not in self.hiddenAttribute:
-                    if val in ["1", "yes", "true", "on"]:
-                        the_dict[section][key] = True
-                    elif val in ["0", "no", "false", "off"]:
-                        the_dict[section][key] = False
-                    else:
-                        the_dict[section][key] = val
-        return the_dict
+        self.__watch()
+        return {section: {key: val for key, val in values.items() if key not in self.hiddenAttribute}
+                for section, values in self.__snapshot.items()}
 
 
 '''
@@ -1357,6 +3489,23 @@ def _getConfigurationList():
                 print(f"{i} have an invalid configuration file.")
     
 
+def _syncConfigurationList():
+    """
+    Pick up configurations created and forget configurations deleted by other processes, e.g. the collector after
+    a web worker added one. Configurations already known reload their own peers, rebuilding them would drop the
+    transfer windows of the collector
+    """
+    names = set(i.replace('.conf', '') for i in os.listdir(DashboardConfig.GetConfig("Server", "wg_conf_path")[1])
+                if _regexMatch("^(.{1,}).(conf)$", i))
+    for name in list(WireguardConfigurations.keys()):
+        if name not in names:
+            del WireguardConfigurations[name]
+    for name in names - WireguardConfigurations.keys():
+        try:
+            WireguardConfigurations[name] = WireguardConfiguration(name)
+        except WireguardConfiguration.InvalidConfigurationFileException:
+            print(f"{name} have an invalid configuration file.")
+
 
 def _checkIPWithRange(ip):
     ip_patterns = (
@@ -1401,8 +3550,7 @@ def _checkDNS(dns):
 
 def _generatePublicKey(privateKey) -> tuple[bool, str] | tuple[bool, None]:
     try:
-        publicKey = subprocess.check_output(f"wg pubkey", input=privateKey.encode(), shell=True,
-                                            stderr=subprocess.STDOUT)
+        publicKey = SystemCommands.run(["wg", "pubkey"], input=privateKey.encode())
         return True, publicKey.decode().strip('\n')
     except subprocess.CalledProcessError:
         return False, None
@@ -1410,78 +3558,439 @@ def _generatePublicKey(privateKey) -> tuple[bool, str] | tuple[bool, None]:
 
 def _generatePrivateKey() -> [bool, str]:
     try:
-        publicKey = subprocess.check_output(f"wg genkey", shell=True,
-                                            stderr=subprocess.STDOUT)
+        publicKey = SystemCommands.run(["wg", "genkey"])
         return True, publicKey.decode().strip('\n')
     except subprocess.CalledProcessError:
         return False, None
 
+
+def _wgSetPeer(configName: str, publicKey: str, allowedIp: str, presharedKey: str = "") -> bytes:
+    argv = ["wg", "set", configName, "peer", publicKey, "allowed-ips", allowedIp.replace(" ", "")]
+    if len(presharedKey) == 0:
+        return SystemCommands.run(argv)
+    with tempfile.NamedTemporaryFile("w+") as f:
+        f.write(presharedKey)
+        f.flush()
+        return SystemCommands.run(argv + ["preshared-key", f.name])
+
+
+def _generateKeyPairs(amount: int, presharedKey: bool = False) -> list[dict[str, str]]:
+    keyPairs = []
+    for _ in range(amount):
+        privateKey = bytearray(secrets.token_bytes(32))
+        privateKey[0] &= 248
+        privateKey[31] = (privateKey[31] & 127) | 64
+        # Same result as `wg pubkey`, without spawning a process per key
+        publicKey = X25519PrivateKey.from_private_bytes(bytes(privateKey)).public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        keyPairs.append({
+            "private_key": base64.b64encode(privateKey).decode(),
+            "id": base64.b64encode(publicKey).decode(),
+            "preshared_key": base64.b64encode(secrets.token_bytes(32)).decode() if presharedKey else ""
+        })
+    return keyPairs
+
+def _parseLogDate(value: str) -> str | None:
+    for f in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d"]:
+        try:
+            return datetime.strptime(value, f).strftime("%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def _queryLogsPage(database: SQLiteConnectionManager, table: str, conditions: list[tuple[str, Any]],
+                   cursor: str = None, limit: int = 50, dateFrom: str = None,
+                   dateTo: str = None) -> tuple[list[sqlite3.Row], str | None]:
+    """
+    Newest first, keyset paginated on (LogDate, LogID). The cursor is "LogDate|LogID" of the last log returned.
+    """
+    conditions = list(conditions)
+    if dateFrom:
+        conditions.append(("LogDate >= ?", dateFrom))
+    if dateTo:
+        conditions.append(("LogDate <= ?", dateTo))
+    parameters = [v for _, v in conditions]
+    where = [c for c, _ in conditions]
+    if cursor:
+        logDate, _, logID = cursor.partition("|")
+        where.append("(LogDate < ? OR (LogDate = ? AND LogID < ?))")
+        parameters += [logDate, logDate, logID]
+    rows = database.execute(
+        f"SELECT * FROM {table} {('WHERE ' + ' AND '.join(where)) if len(where) > 0 else ''} "
+        f"ORDER BY LogDate DESC, LogID DESC LIMIT ?", tuple(parameters) + (limit + 1,)).fetchall()
+    nextCursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        nextCursor = f"{rows[-1]['LogDate']}|{rows[-1]['LogID']}"
+    return rows, nextCursor
+
+def _handshakeToString(handshake: int) -> str:
+    """
+    Show a handshake timestamp the way `wg` did before it was stored as an integer, e.g. "0:01:23" ago
+    """
+    if handshake is None or handshake <= 0:
+        return "No Handshake"
+    return str(datetime.now() - datetime.fromtimestamp(handshake)).split(".", maxsplit=1)[0]
+
 def _getWireguardConfigurationAvailableIP(configName: str, all: bool = False) -> tuple[bool, list[str]] | tuple[bool, None]:
     if configName not in WireguardConfigurations.keys():
         return False, None
     configuration = WireguardConfigurations[configName]
     if len(configuration.Address) > 0:
-        address = configuration.Address.split(',')
-        existedAddress = []
+        allocator = configuration.AddressAllocator
         availableAddress = []
-        for p in configuration.Peers:
-            if len(p.allowed_ip) > 0:
-                add = p.allowed_ip.split(',')
-                for i in add:
-                    a, c = i.split('/')
-                    try:
-                        existedAddress.append(ipaddress.ip_address(a.replace(" ", "")))
-                    except ValueError as error:
-                        print(f"[WGDashboard] Error: {configName} peer {p.id} have invalid ip")
-
-        for p in configuration.getRestrictedPeersList():
-            if len(p.allowed_ip) > 0:
-                add = p.allowed_ip.split(',')
-                for i in add:
-                    a, c = i.split('/')
-                    existedAddress.append(ipaddress.ip_address(a.replace(" ", "")))
-        
-        for i in address:
-            addressSplit, cidr = i.split('/')
-            existedAddress.append(ipaddress.ip_address(addressSplit.replace(" ", "")))
-        for i in address:
-            network = ipaddress.ip_network(i.replace(" ", ""), False)
+        for i, pool in enumerate(allocator.pools):
             count = 0
-            for h in network.hosts():
-                if h not in existedAddress:
-                    availableAddress.append(ipaddress.ip_network(h).compressed)
-                    count += 1
-                    if not all:
-                        if network.version == 6 and count > 255:
-                            break
+            offset = pool.nextFree(0)
+            while offset is not None:
+                availableAddress.append(allocator.address(i, offset))
+                count += 1
+                if not all and pool.network.version == 6 and count > 255:
+                    break
+                offset = pool.nextFree(offset + 1)
         return True, availableAddress
 
     return False, None
 
+def _getWireguardConfigurationAvailableIPPage(configName: str, cursor: str = None, limit: int = 20,
+                                              mode: str = "sequential", start: str = None) -> tuple[bool, str, dict | None]:
+    """
+    Return at most limit free addresses without materializing the whole network.
+    The cursor is "pool:offset" of the next address to look at, as returned in NextCursor. In random mode every
+    IPv6 pool is sampled instead of walked, and there is no cursor to continue from.
+    """
+    if configName not in WireguardConfigurations.keys():
+        return False, "Configuration does not exist", None
+    allocator = WireguardConfigurations[configName].AddressAllocator
+    if allocator is None or len(allocator.pools) == 0:
+        return False, "Configuration does not have any address", None
+    if mode not in ["sequential", "random"]:
+        return False, "Mode must be sequential or random", None
+
+    pool, offset = 0, 0
+    if start is not None and len(start) > 0:
+        location = allocator.position(start)
+        if location is None:
+            return False, f"{start} is not inside any address of this configuration", None
+        pool, offset = location
+    elif cursor is not None and len(cursor) > 0:
+        try:
+            pool, offset = [int(x) for x in cursor.split(":")]
+            assert 0 <= pool and 0 <= offset
+        except (ValueError, AssertionError):
+            return False, "Invalid cursor", None
+
+    ips = []
+    nextCursor = None
+    if mode == "random":
+        for i in range(pool, len(allocator.pools)):
+            if len(ips) == limit:
+                break
+            if allocator.pools[i].network.version == 6:
+                ips += [allocator.address(i, o) for o in allocator.sample(i, limit - len(ips))]
+            else:
+                for p, o in allocator.iterFree(i, 0):
+                    if p != i or len(ips) == limit:
+                        break
+                    ips.append(allocator.address(p, o))
+    else:
+        for p, o in allocator.iterFree(pool, offset):
+            if len(ips) == limit:
+                nextCursor = f"{p}:{o}"
+                break
+            ips.append(allocator.address(p, o))
+    return True, "", {
+        "IPs": ips,
+        "NextCursor": nextCursor,
+        "Available": str(allocator.freeCount())
+    }
+
+
+class CommandExecutor:
+    """
+    Runs wg / wg-quick / ip as argv lists without a shell. Every call has a timeout, the number of concurrent
+    processes per program is capped, and call counts and latency histograms are kept per command type.
+    A command that runs out of time is killed with its whole process group and raised as CalledProcessError,
+    so callers only need to handle one exception type.
+    """
+    Timeouts = {"wg": 10, "wg-quick": 60, "ip": 10}
+    Concurrency = {"wg": 4, "wg-quick": 1, "ip": 4}
+    DefaultTimeout = 30
+    DefaultConcurrency = 2
+    HistogramBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
 
-sqldb = sqlite3.connect(os.path.join(CONFIGURATION_PATH, 'db', 'wgdashboard.db'), check_same_thread=False)
-sqldb.row_factory = sqlite3.Row
-cursor = sqldb.cursor()
+    def __init__(self):
+        self.__semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self.__metrics: dict[str, dict] = {}
+        self.__lock = threading.Lock()
+
+    def __semaphore(self, program: str) -> threading.BoundedSemaphore:
+        with self.__lock:
+            if program not in self.__semaphores:
+                self.__semaphores[program] = threading.BoundedSemaphore(
+                    self.Concurrency.get(program, self.DefaultConcurrency))
+            return self.__semaphores[program]
+
+    @staticmethod
+    def __commandType(argv: list[str]) -> str:
+        if len(argv) > 1 and not argv[1].startswith("-"):
+            return f"{argv[0]} {argv[1]}"
+        return argv[0]
+
+    def __record(self, commandType: str, seconds: float, failed: bool, timedOut: bool):
+        with self.__lock:
+            m = self.__metrics.get(commandType)
+            if m is None:
+                m = self.__metrics[commandType] = {
+                    "count": 0, "errors": 0, "timeouts": 0, "totalSeconds": 0.0, "maxSeconds": 0.0,
+                    "buckets": [0] * (len(self.HistogramBuckets) + 1)
+                }
+            m["count"] += 1
+            m["errors"] += 1 if failed else 0
+            m["timeouts"] += 1 if timedOut else 0
+            m["totalSeconds"] += seconds
+            m["maxSeconds"] = max(m["maxSeconds"], seconds)
+            for i, b in enumerate(self.HistogramBuckets):
+                if seconds <= b:
+                    m["buckets"][i] += 1
+                    break
+            else:
+                m["buckets"][-1] += 1
+
+    def run(self, argv: list[str], input: bytes = None, timeout: float = None) -> bytes:
+        program = os.path.basename(argv[0])
+        commandType = self.__commandType([program] + argv[1:])
+        if timeout is None:
+            timeout = self.Timeouts.get(program, self.DefaultTimeout)
+        semaphore = self.__semaphore(program)
+        if not semaphore.acquire(timeout=timeout):
+            self.__record(commandType, 0, True, True)
+            raise subprocess.CalledProcessError(
+                -1, argv, output=f"{commandType} is busy, gave up after {timeout}s".encode())
+        start = time.monotonic()
+        failed, timedOut = True, False
+        try:
+            process = subprocess.Popen(argv, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+            try:
+                output, _ = process.communicate(input=input, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                timedOut = True
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                process.communicate()
+                raise subprocess.CalledProcessError(
+                    -signal.SIGKILL, argv, output=f"{commandType} timed out after {timeout}s".encode())
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, argv, output=output)
+            failed = False
+            return output
+        except OSError as e:
+            raise subprocess.CalledProcessError(-1, argv, output=str(e).encode())
+        finally:
+            semaphore.release()
+            self.__record(commandType, time.monotonic() - start, failed, timedOut)
 
-def sqlSelect(statement: str, paramters: tuple = ()) -> sqlite3.Cursor:
-    with sqldb:
+    def toJson(self):
+        with self.__lock:
+            metrics = {}
+            for commandType, m in self.__metrics.items():
+                metrics[commandType] = {
+                    "count": m["count"],
+                    "errors": m["errors"],
+                    "timeouts": m["timeouts"],
+                    "avgSeconds": m["totalSeconds"] / m["count"] if m["count"] > 0 else 0,
+                    "maxSeconds": m["maxSeconds"],
+                    "histogram": {
+                        **{f"le_{b}": c for b, c in zip(self.HistogramBuckets, m["buckets"])},
+                        "le_inf": m["buckets"][-1]
+                    }
+                }
+            return metrics
+
+SystemCommands: CommandExecutor = CommandExecutor()
+
+class TokenBucket:
+    __slots__ = ("Tokens", "Updated")
+
+    def __init__(self, capacity: float, now: float):
+        self.Tokens = capacity
+        self.Updated = now
+
+    def refill(self, capacity: float, rate: float, now: float) -> float:
+        self.Tokens = min(capacity, self.Tokens + (now - self.Updated) * rate)
+        self.Updated = now
+        return self.Tokens
+
+
+class LoginGuard:
+    """
+    Throttles login attempts per IP and per username with token buckets, checked before any bcrypt work, and runs
+    bcrypt verification in passwordcheck worker processes so a burst of logins cannot occupy the request thread. At
+    most MaxPending verifications are queued, anything beyond that is rejected straight away.
+    """
+    Workers = 2
+    MaxPending = 8
+    Timeout = 15
+    # (burst, tokens per second)
+    IPBucket = (10, 10 / 60)
+    UsernameBucket = (5, 5 / 60)
+    PruneInterval = 60
+
+    def __init__(self):
+        self.__pending = threading.BoundedSemaphore(LoginGuard.MaxPending)
+        self.__checker = passwordcheck.PasswordCheckPool(LoginGuard.Workers)
+        self.__nextPrune = 0
+        # The buckets are shared by every gunicorn worker, so the limits hold no matter which worker a login hits.
+        # They live in their own database, a burst of logins never waits on or holds the write lock peers, jobs
+        # and logs need
+        LoginDatabase.migrate("LoginBuckets", [
+            lambda conn: conn.execute(
+                "CREATE TABLE IF NOT EXISTS LoginBuckets (Key VARCHAR NOT NULL PRIMARY KEY, Tokens REAL NOT NULL, "
+                "UpdatedAt REAL NOT NULL)")
+        ])
+        # Earlier versions kept the buckets in wgdashboard.db
+        DashboardDatabase.migrate("LoginBuckets", [
+            lambda conn: None,
+            lambda conn: conn.execute("DROP TABLE IF EXISTS LoginBuckets")
+        ])
+
+    @staticmethod
+    def __buckets(conn: sqlite3.Connection | SQLiteConnectionManager, keys: list[tuple[str, tuple[float, float]]],
+                  now: float) -> list[tuple[str, TokenBucket]] | None:
+        buckets = []
+        for key, (capacity, rate) in keys:
+            row = conn.execute("SELECT Tokens, UpdatedAt FROM LoginBuckets WHERE Key = ?", (key,)).fetchone()
+            bucket = TokenBucket(capacity, now) if row is None else TokenBucket(row['Tokens'], row['UpdatedAt'])
+            if bucket.refill(capacity, rate, now) < 1:
+                return None
+            buckets.append((key, bucket))
+        return buckets
+
+    def allow(self, ip: str, username: str) -> bool:
+        """
+        Take one token from both the IP and the username bucket, or none if either is empty
+        """
+        now = time.time()
+        keys = [(f"ip:{ip}", LoginGuard.IPBucket), (f"username:{username}", LoginGuard.UsernameBucket)]
+        # Reject an empty bucket from a plain read, a flood of throttled attempts never takes the write lock
+        if LoginGuard.__buckets(LoginDatabase, keys, now) is None:
+            return False
+        with LoginDatabase.transaction() as conn:
+            if now >= self.__nextPrune:
+                self.__prune(conn, now)
+            buckets = LoginGuard.__buckets(conn, keys, now)
+            if buckets is None:
+                return False
+            conn.executemany(
+                "INSERT INTO LoginBuckets (Key, Tokens, UpdatedAt) VALUES (?, ?, ?) ON CONFLICT (Key) "
+                "DO UPDATE SET Tokens = excluded.Tokens, UpdatedAt = excluded.UpdatedAt",
+                [(key, bucket.Tokens - 1, bucket.Updated) for key, bucket in buckets])
+            return True
+
+    def __prune(self, conn: sqlite3.Connection, now: float):
+        # Buckets that would be full again carry no state worth keeping
+        self.__nextPrune = now + LoginGuard.PruneInterval
+        full = max(capacity / rate for capacity, rate in [LoginGuard.IPBucket, LoginGuard.UsernameBucket])
+        conn.execute("DELETE FROM LoginBuckets WHERE UpdatedAt < ?", (now - full,))
+
+    def verify(self, password: str, hashedPassword: str) -> bool | None:
+        """
+        Check a password against its bcrypt hash in a worker process. Returns None if too many checks are queued or
+        no worker can answer in time, bcrypt never runs on the request thread
+        """
+        if not self.__pending.acquire(blocking=False):
+            return None
         try:
-            cursor = sqldb.cursor()
-            return cursor.execute(statement, paramters)
-        except sqlite3.OperationalError as error:
-            print("[WGDashboard] SQLite Error:" + str(error) + " | Statement: " + statement)
+            return self.__checker.check(password, hashedPassword, LoginGuard.Timeout)
+        finally:
+            self.__pending.release()
+
+    def shutdown(self):
+        self.__checker.close()
+
+LoginAttempts: LoginGuard = LoginGuard()
+
+class DiagnosticLimiter:
+    """
+    Caps how many ping, traceroute and sweep requests one caller can have running at once, and how many run in
+    total, across every worker. A running request holds an flock on one slot file under LOCK_PATH/diagnostics:
+    PerCaller slots per caller bucket and Total shared slots, so the slots of a worker that dies are freed with it.
+    Callers are hashed into Buckets, two callers sharing a bucket share its cap. A request over the cap is refused
+    instead of queued
+    """
+    PerCaller = 2
+    Total = 16
+    Buckets = 256
+    Path = os.path.join(LOCK_PATH, 'diagnostics')
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__held: dict[str, list[tuple]] = {}
+
+    @staticmethod
+    def __take(prefix: str, slots: int):
+        if not os.path.isdir(DiagnosticLimiter.Path):
+            os.makedirs(DiagnosticLimiter.Path, exist_ok=True)
+        for i in range(slots):
+            f = open(os.path.join(DiagnosticLimiter.Path, f'{prefix}.{i}.lock'), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        return None
+
+    def acquire(self, caller: str) -> bool:
+        bucket = int(hashlib.sha256(caller.encode()).hexdigest(), 16) % DiagnosticLimiter.Buckets
+        callerSlot = self.__take(f'caller-{bucket}', DiagnosticLimiter.PerCaller)
+        if callerSlot is None:
+            return False
+        totalSlot = self.__take('total', DiagnosticLimiter.Total)
+        if totalSlot is None:
+            callerSlot.close()
+            return False
+        with self.__lock:
+            self.__held.setdefault(caller, []).append((callerSlot, totalSlot))
+        return True
+
+    def release(self, caller: str):
+        with self.__lock:
+            slots = self.__held[caller].pop()
+            if len(self.__held[caller]) == 0:
+                del self.__held[caller]
+        # Closing the files drops the flocks
+        for f in slots:
+            f.close()
+
+Diagnostics: DiagnosticLimiter = DiagnosticLimiter()
+
+def sqlSelect(statement: str, paramters: tuple = ()) -> sqlite3.Cursor:
+    try:
+        return DashboardDatabase.execute(statement, paramters)
+    except sqlite3.OperationalError as error:
+        print("[WGDashboard] SQLite Error:" + str(error) + " | Statement: " + statement)
 
 def sqlUpdate(statement: str, paramters: tuple = ()) -> sqlite3.Cursor:
-    with sqldb:
-        cursor = sqldb.cursor()
-        try:
-            cursor.execute(statement, paramters)
-            sqldb.commit()
-        except sqlite3.OperationalError as error:
-            print("[WGDashboard] SQLite Error:" + str(error))
+    try:
+        return DashboardDatabase.execute(statement, paramters, commit=True)
+    except sqlite3.OperationalError as error:
+        print("[WGDashboard] SQLite Error:" + str(error))
+
+def sqlUpdateMany(statement: str, paramters: list = ()) -> bool:
+    try:
+        with DashboardDatabase.transaction():
+            DashboardDatabase.executemany(statement, paramters)
+        return True
+    except sqlite3.Error as error:
+        print("[WGDashboard] SQLite Error:" + str(error))
+        return False
 
 DashboardConfig = DashboardConfig()
 _, APP_PREFIX = DashboardConfig.GetConfig("Server", "app_prefix")
+API_PREFIX = f"{APP_PREFIX}/api/"
 cors = CORS(app, resources={rf"{APP_PREFIX}/api/*": {
     "origins": "*",
     "methods": "DELETE, POST, GET, OPTIONS",
@@ -1495,58 +4004,58 @@ API Routes
 
 
 
+def _operationRequested(data: dict = None) -> bool:
+    if data is not None and data.get("async") is True:
+        return True
+    return request.args.get("async", "false").lower() == "true"
+
+def OperationResponse(operation: DashboardOperation) -> Flask.response_class:
+    response = ResponseObject(True, "Operation queued", operation)
+    response.status_code = 202
+    return response
+
+PublicEndpoints: set[str] = {"static"}
+
+def publicRoute(route):
+    """
+    Mark a route as reachable without signing in. auth_req() looks the endpoint up in PublicEndpoints
+    """
+    PublicEndpoints.add(route.__name__)
+    return route
+
 @app.before_request
 def auth_req():
-    if request.method.lower() == 'options':
+    if request.method == 'OPTIONS':
         return ResponseObject(True)
 
-    DashboardConfig.APIAccessed = False
-    if "api" in request.path:
-        if str(request.method) == "GET":
-            DashboardLogger.log(str(request.url), str(request.remote_addr), Message=str(request.args))
-        elif str(request.method) == "POST":
-            DashboardLogger.log(str(request.url), str(request.remote_addr), Message=f"Request Args: {str(request.args)} Body:{str(request.get_json())}")
-        
-    
-    authenticationRequired = DashboardConfig.GetConfig("Server", "auth_req")[1]
-    d = request.headers
-    if authenticationRequired:
-        apiKey = d.get('wg-dashboard-apikey')
-        apiKeyEnabled = DashboardConfig.GetConfig("Server", "dashboard_api_key")[1]
-        if apiKey is not None and len(apiKey) > 0 and apiKeyEnabled:
-            apiKeyExist = len(list(filter(lambda x : x.Key == apiKey, DashboardConfig.DashboardAPIKeys))) == 1
-            DashboardLogger.log(str(request.url), str(request.remote_addr), Message=f"API Key Access: {('true' if apiKeyExist else 'false')} - Key: {apiKey}")
-            if not apiKeyExist:
-                DashboardConfig.APIAccessed = False
-                response = Flask.make_response(app, {
-                    "status": False,
-                    "message": "API Key does not exist",
-                    "data": None
-                })
-                response.content_type = "application/json"
-                response.status_code = 401
-                return response
-            DashboardConfig.APIAccessed = True
-        else:
-            DashboardConfig.APIAccessed = False
-            if ('/static/' not in request.path and "username" not in session 
-                    and (f"{(APP_PREFIX if len(APP_PREFIX) > 0 else '')}/" != request.path 
-                         and f"{(APP_PREFIX if len(APP_PREFIX) > 0 else '')}" != request.path)
-                    and "validateAuthentication" not in request.path and "authenticate" not in request.path
-                    and "getDashboardConfiguration" not in request.path and "getDashboardTheme" not in request.path
-                    and "getDashboardVersion" not in request.path
-                    and "sharePeer/get" not in request.path
-                    and "isTotpEnabled" not in request.path
-                    and "locale" not in request.path
-            ):
-                response = Flask.make_response(app, {
-                    "status": False,
-                    "message": "Unauthorized access.",
-                    "data": None
-                })
-                response.content_type = "application/json"
-                response.status_code = 401
-                return response
+    # Per request, in g: a worker serves several requests at once, so a flag on DashboardConfig would let one
+    # request's API key sign in another
+    g.apiAccessed = False
+    if request.path.startswith(API_PREFIX):
+        if request.method == "GET":
+            DashboardLogger.log(request.url, str(request.remote_addr), Message=lambda: str(request.args))
+        elif request.method == "POST":
+            DashboardLogger.log(request.url, str(request.remote_addr), Message=lambda: f"Request Args: {str(request.args)} Body:{str(request.get_json())}", Category="write")
+
+    # Unknown paths, redirects and wrong methods are answered by Flask itself
+    if request.routing_exception is not None:
+        return None
+
+    if not DashboardConfig.GetConfig("Server", "auth_req")[1]:
+        return None
+    apiKey = request.headers.get('wg-dashboard-apikey')
+    if apiKey is not None and len(apiKey) > 0 and DashboardConfig.GetConfig("Server", "dashboard_api_key")[1]:
+        apiKeyExist = DashboardConfig.validateAPIKey(apiKey)
+        DashboardLogger.log(request.url, str(request.remote_addr), Message=f"API Key Access: {('true' if apiKeyExist else 'false')} - Key: {apiKey[:6]}", Category="auth")
+        if not apiKeyExist:
+            response = ResponseObject(False, "API Key does not exist")
+            response.status_code = 401
+            return response
+        g.apiAccessed = True
+    elif request.endpoint not in PublicEndpoints and "username" not in session:
+        response = ResponseObject(False, "Unauthorized access.")
+        response.status_code = 401
+        return response
 
 @app.route(f'{APP_PREFIX}/api/handshake', methods=["GET", "OPTIONS"])
 def API_ValidateAPIKey():
@@ -1554,6 +4063,7 @@ def API_ValidateAPIKey():
 
 
 @app.get(f'{APP_PREFIX}/api/validateAuthentication')
+@publicRoute
 def API_ValidateAuthentication():
     token = request.cookies.get("authToken") + ""
     if token == "" or "username" not in session or session["username"] != token:
@@ -1562,18 +4072,27 @@ def API_ValidateAuthentication():
 
 
 @app.post(f'{APP_PREFIX}/api/authenticate')
+@publicRoute
 def API_AuthenticateLogin():
     data = request.get_json()
-    if DashboardConfig.APIAccessed:
-        
+    if g.get("apiAccessed", False):
+
         authToken = hashlib.sha256(f"{request.headers.get('wg-dashboard-apikey')}{datetime.now()}".encode()).hexdigest()
         session['username'] = authToken
         resp = ResponseObject(True, DashboardConfig.GetConfig("Other", "welcome_session")[1])
         resp.set_cookie("authToken", authToken)
         session.permanent = True
         return resp
-    valid = bcrypt.checkpw(data['password'].encode("utf-8"),
-                           DashboardConfig.GetConfig("Account", "password")[1].encode("utf-8"))
+    if not LoginAttempts.allow(str(request.remote_addr), str(data.get('username'))):
+        DashboardLogger.log(str(request.url), str(request.remote_addr), Message=f"Login throttled: {data.get('username')}", Category="auth")
+        resp = ResponseObject(False, "Too many login attempts, please try again later.")
+        resp.status_code = 429
+        return resp
+    valid = LoginAttempts.verify(data['password'], DashboardConfig.GetConfig("Account", "password")[1])
+    if valid is None:
+        resp = ResponseObject(False, "Too many login attempts in progress, please try again later.")
+        resp.status_code = 503
+        return resp
     totpEnabled = DashboardConfig.GetConfig("Account", "enable_totp")[1]
     totpValid = False
     if totpEnabled:
@@ -1588,9 +4107,9 @@ def API_AuthenticateLogin():
         resp = ResponseObject(True, DashboardConfig.GetConfig("Other", "welcome_session")[1])
         resp.set_cookie("authToken", authToken)
         session.permanent = True
-        DashboardLogger.log(str(request.url), str(request.remote_addr), Message=f"Login success: {data['username']}")
+        DashboardLogger.log(str(request.url), str(request.remote_addr), Message=f"Login success: {data['username']}", Category="auth")
         return resp
-    DashboardLogger.log(str(request.url), str(request.remote_addr), Message=f"Login failed: {data['username']}")
+    DashboardLogger.log(str(request.url), str(request.remote_addr), Message=f"Login failed: {data['username']}", Category="auth")
     if totpEnabled:
         return ResponseObject(False, "Sorry, your username, password or OTP is incorrect.")
     else:
@@ -1659,7 +4178,10 @@ def API_toggleWireguardConfiguration():
     if configurationName is None or len(
             configurationName) == 0 or configurationName not in WireguardConfigurations.keys():
         return ResponseObject(False, "Please provide a valid configuration name")
-    toggleStatus, msg = WireguardConfigurations[configurationName].toggleConfiguration()
+    if _operationRequested():
+        return OperationResponse(AllOperations.submit(configurationName, "toggleConfiguration", {}))
+    with AllOperations.lock(configurationName):
+        toggleStatus, msg = WireguardConfigurations[configurationName].toggleConfiguration()
     return ResponseObject(toggleStatus, msg, WireguardConfigurations[configurationName].Status)
 
 @app.post(f'{APP_PREFIX}/api/updateWireguardConfiguration')
@@ -1674,11 +4196,15 @@ def API_updateWireguardConfiguration():
     if name not in WireguardConfigurations.keys():
         return ResponseObject(False, "Configuration does not exist")
     
-    status, msg = WireguardConfigurations[name].updateConfigurationSettings(data)
+    if _operationRequested(data):
+        return OperationResponse(AllOperations.submit(name, "updateConfiguration", data))
+    with AllOperations.lock(name):
+        status, msg = WireguardConfigurations[name].updateConfigurationSettings(data)
     
     return ResponseObject(status, message=msg, data=WireguardConfigurations[name])
 
 @app.get(f'{APP_PREFIX}/api/getDashboardConfiguration')
+@publicRoute
 def API_getDashboardConfiguration():
     return ResponseObject(data=DashboardConfig.toJson())
 
@@ -1715,8 +4241,11 @@ def API_newDashboardAPIKey():
                 expiredAt = None
             else:
                 expiredAt = datetime.strptime(data['ExpiredAt'], '%Y-%m-%d %H:%M:%S')
-            DashboardConfig.createAPIKeys(expiredAt)
-            return ResponseObject(True, data=DashboardConfig.DashboardAPIKeys)
+            newKey = DashboardConfig.createAPIKeys(expiredAt)
+            # The plaintext key is only ever returned here, the dashboard keeps its hash
+            return ResponseObject(True, data=[
+                k.toJson() | {"Key": newKey} if k.KeyHash == _hashAPIKey(newKey) else k
+                for k in DashboardConfig.DashboardAPIKeys])
         except Exception as e:
             return ResponseObject(False, str(e))
     return ResponseObject(False, "Dashboard API Keys function is disbaled")
@@ -1725,8 +4254,7 @@ def API_newDashboardAPIKey():
 def API_deleteDashboardAPIKey():
     data = request.get_json()
     if DashboardConfig.GetConfig('Server', 'dashboard_api_key'):
-        if len(data['Key']) > 0 and len(list(filter(lambda x : x.Key == data['Key'], DashboardConfig.DashboardAPIKeys))) > 0:
-            DashboardConfig.deleteAPIKey(data['Key'])
+        if len(data.get('KeyID', '')) > 0 and DashboardConfig.deleteAPIKey(data['KeyID']):
             return ResponseObject(True, data=DashboardConfig.DashboardAPIKeys)
     return ResponseObject(False, "Dashboard API Keys function is disbaled")
     
@@ -1771,8 +4299,11 @@ def API_deletePeers(configName: str) -> ResponseObject:
     if configName in WireguardConfigurations.keys():
         if len(peers) == 0:
             return ResponseObject(False, "Please specify one or more peers")
+        if _operationRequested(data):
+            return OperationResponse(AllOperations.submit(configName, "deletePeers", {"peers": peers}))
         configuration = WireguardConfigurations.get(configName)
-        return configuration.deletePeers(peers)
+        with AllOperations.lock(configName):
+            return configuration.deletePeers(peers)
 
     return ResponseObject(False, "Configuration does not exist")
 
@@ -1784,8 +4315,11 @@ def API_restrictPeers(configName: str) -> ResponseObject:
     if configName in WireguardConfigurations.keys():
         if len(peers) == 0:
             return ResponseObject(False, "Please specify one or more peers")
+        if _operationRequested(data):
+            return OperationResponse(AllOperations.submit(configName, "restrictPeers", {"peers": peers}))
         configuration = WireguardConfigurations.get(configName)
-        return configuration.restrictPeers(peers)
+        with AllOperations.lock(configName):
+            return configuration.restrictPeers(peers)
     return ResponseObject(False, "Configuration does not exist")
 
 @app.post(f'{APP_PREFIX}/api/sharePeer/create')
@@ -1822,6 +4356,7 @@ def API_sharePeer_update():
     return ResponseObject(data=AllPeerShareLinks.getLinkByID(ShareID))
 
 @app.get(f'{APP_PREFIX}/api/sharePeer/get')
+@publicRoute
 def API_sharePeer_get():
     data = request.args
     ShareID = data.get("ShareID")
@@ -1847,8 +4382,11 @@ def API_allowAccessPeers(configName: str) -> ResponseObject:
     if configName in WireguardConfigurations.keys():
         if len(peers) == 0:
             return ResponseObject(False, "Please specify one or more peers")
+        if _operationRequested(data):
+            return OperationResponse(AllOperations.submit(configName, "allowAccessPeers", {"peers": peers}))
         configuration = WireguardConfigurations.get(configName)
-        return configuration.allowAccessPeers(peers)
+        with AllOperations.lock(configName):
+            return configuration.allowAccessPeers(peers)
     return ResponseObject(False, "Configuration does not exist")
 
 @app.post(f'{APP_PREFIX}/api/addPeers/<configName>')
@@ -1888,41 +4426,20 @@ def API_addPeers(configName):
             if not config.getStatus():
                 config.toggleConfiguration()
     
-            availableIps = _getWireguardConfigurationAvailableIP(configName)
-    
             if bulkAdd:
                 if type(preshared_key_bulkAdd) is not bool:
                     preshared_key_bulkAdd = False
                 
                 if type(bulkAddAmount) is not int or bulkAddAmount < 1:
                     return ResponseObject(False, "Please specify amount of peers you want to add")
-                if not availableIps[0]:
-                    return ResponseObject(False, "No more available IP can assign")
-                if bulkAddAmount > len(availableIps[1]):
-                    return ResponseObject(False,
-                                          f"The maximum number of peers can add is {len(availableIps[1])}")
-    
-                keyPairs = []
-                for i in range(bulkAddAmount):
-                    newPrivateKey = _generatePrivateKey()[1]
-                    keyPairs.append({
-                        "private_key": newPrivateKey,
-                        "id": _generatePublicKey(newPrivateKey)[1],
-                        "preshared_key": (_generatePrivateKey()[1] if preshared_key_bulkAdd else ""),
-                        "allowed_ip": availableIps[1][i],
-                        "name": f"BulkPeer #{(i + 1)}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                    })
-                if len(keyPairs) == 0:
-                    return ResponseObject(False, "Generating key pairs by bulk failed")
-                config.addPeers(keyPairs)
-    
-                for kp in keyPairs:
-                    found, peer = config.searchPeer(kp['id'])
-                    if found:
-                        if not peer.updatePeer(kp['name'], kp['private_key'], kp['preshared_key'], dns_addresses,
-                                               kp['allowed_ip'], endpoint_allowed_ip, mtu, keep_alive):
-                            return ResponseObject(False, "Failed to add peers in bulk")
-                return ResponseObject()
+                if _operationRequested(data):
+                    return OperationResponse(AllOperations.submit(configName, "addPeers", {
+                        "amount": bulkAddAmount, "preshared_key": preshared_key_bulkAdd, "DNS": dns_addresses,
+                        "endpoint_allowed_ip": endpoint_allowed_ip, "mtu": mtu, "keepalive": keep_alive
+                    }))
+                with AllOperations.lock(configName):
+                    return config.provisionPeers(bulkAddAmount, preshared_key_bulkAdd, dns_addresses,
+                                                 endpoint_allowed_ip, mtu, keep_alive)
     
             else:
                 if config.searchPeer(public_key)[0] is True:
@@ -1931,14 +4448,20 @@ def API_addPeers(configName):
                 private_key = data.get("private_key", "")
     
                 for i in allowed_ips:
-                    if i not in availableIps[1]:
+                    conflicts = config.AllowedIPTrie.overlaps(i, public_key, 1)
+                    if len(conflicts) > 0:
+                        return ResponseObject(False, f"{i} overlaps with {conflicts[0][0]} of peer {conflicts[0][1]}")
+                    if (ipaddress.ip_network(i, False).num_addresses == 1
+                            and config.AddressAllocator.position(i) is not None
+                            and not config.AddressAllocator.isAvailable(i)):
                         return ResponseObject(False, f"This IP is not available: {i}")
     
-                config.addPeers([{"id": public_key, "allowed_ip": ','.join(allowed_ips)}])
-                found, peer = config.searchPeer(public_key)
-                if found:
-                    return peer.updatePeer(name, private_key, preshared_key, dns_addresses, ",".join(allowed_ips),
-                                           endpoint_allowed_ip, mtu, keep_alive)
+                with AllOperations.lock(configName):
+                    config.addPeers([{"id": public_key, "allowed_ip": ','.join(allowed_ips)}])
+                    found, peer = config.searchPeer(public_key)
+                    if found:
+                        return peer.updatePeer(name, private_key, preshared_key, dns_addresses, ",".join(allowed_ips),
+                                               endpoint_allowed_ip, mtu, keep_alive)
         except Exception as e:
             print(e)
             return ResponseObject(False, "Add peers failed. Please see data for specific issue")
@@ -1965,7 +4488,7 @@ def API_downloadAllPeers(configName):
     configuration = WireguardConfigurations[configName]
     peerData = []
     untitledPeer = 0
-    for i in configuration.Peers:
+    for i in configuration.Snapshot.Peers:
         file = i.downloadPeer()
         if file["fileName"] == "UntitledPeer_" + configName:
             file["fileName"] = str(untitledPeer) + "_" + file["fileName"]
@@ -1980,23 +4503,137 @@ def API_getAvailableIPs(configName):
     return ResponseObject(status=status, data=ips)
 
 
+@app.get(f"{APP_PREFIX}/api/getAvailableIPsPage/<configName>")
+def API_getAvailableIPsPage(configName):
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 256)
+    except ValueError:
+        return ResponseObject(False, "Limit must be a number")
+    status, message, page = _getWireguardConfigurationAvailableIPPage(
+        configName, request.args.get("cursor"), limit,
+        request.args.get("mode", "sequential"), request.args.get("start"))
+    return ResponseObject(status, message, page)
+
+
+@app.get(f'{APP_PREFIX}/api/topPeers')
+def API_topPeers():
+    by = request.args.get("by", "rate")
+    field = request.args.get("field", "data")
+    if by not in ["rate", "usage"] or field not in ["receive", "sent", "data"]:
+        return ResponseObject(False, "by must be rate or usage, field must be receive, sent or data")
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+        window = max(int(request.args.get("window", 1440)), 1) * 60 if by == "usage" else None
+    except ValueError:
+        return ResponseObject(False, "Limit and window must be numbers")
+    configurations = [WireguardConfigurations[name] for name in
+                      request.args.get("configurations", ",".join(WireguardConfigurations.keys())).split(",")
+                      if name in WireguardConfigurations.keys()]
+
+    top = heapq.nlargest(limit, ((value, c.Name, peerId) for c in configurations
+                                 for value, peerId in c.getTopPeers(field, limit, window)))
+    details = {}
+    for c in configurations:
+        ids = [peerId for _, name, peerId in top if name == c.Name]
+        if len(ids) > 0:
+            rows = sqlSelect("SELECT id, name, allowed_ip, status FROM '%s' WHERE id IN (%s)"
+                             % (c.Name, ",".join("?" * len(ids))), ids).fetchall()
+            details.update({(c.Name, row['id']): dict(row) for row in rows})
+    return ResponseObject(data=[{
+        "Configuration": name,
+        "id": peerId,
+        "name": details.get((name, peerId), {}).get("name"),
+        "allowed_ip": details.get((name, peerId), {}).get("allowed_ip"),
+        "status": details.get((name, peerId), {}).get("status"),
+        "value": value
+    } for value, name, peerId in top])
+
+
 @app.get(f'{APP_PREFIX}/api/getWireguardConfigurationInfo')
 def API_getConfigurationInfo():
     configurationName = request.args.get("configurationName")
     if not configurationName or configurationName not in WireguardConfigurations.keys():
         return ResponseObject(False, "Please provide configuration name")
+    snapshot = WireguardConfigurations[configurationName].Snapshot
     return ResponseObject(data={
         "configurationInfo": WireguardConfigurations[configurationName],
-        "configurationPeers": WireguardConfigurations[configurationName].getPeersList(),
-        "configurationRestrictedPeers": WireguardConfigurations[configurationName].getRestrictedPeersList()
+        "configurationPeers": snapshot.Peers,
+        "configurationRestrictedPeers": snapshot.RestrictedPeers
     })
 
 
+@app.get(f'{APP_PREFIX}/api/operations')
+def API_getOperations():
+    configurationName = request.args.get("configurationName")
+    if configurationName is not None and configurationName not in WireguardConfigurations.keys():
+        return ResponseObject(False, "Configuration does not exist")
+    return ResponseObject(data=AllOperations.getOperations(configurationName))
+
+
+@app.get(f'{APP_PREFIX}/api/operations/<operationID>')
+def API_getOperation(operationID):
+    operation = AllOperations.getOperation(operationID)
+    if operation is None:
+        return ResponseObject(False, "Operation does not exist")
+    return ResponseObject(data=operation)
+
+
+@app.get(f'{APP_PREFIX}/api/getDashboardCommandMetrics')
+def API_getDashboardCommandMetrics():
+    return ResponseObject(data=SystemCommands.toJson())
+
+
+@app.get(f'{APP_PREFIX}/api/getDashboardLoggerStatus')
+def API_getDashboardLoggerStatus():
+    return ResponseObject(data={**DashboardLogger.toJson(), "Retention": AllLogRetention.toJson()})
+
+
+def _logPageArguments() -> tuple[dict | None, str]:
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+    except ValueError:
+        return None, "Limit must be a number"
+    arguments = {"cursor": request.args.get("cursor"), "limit": limit, "dateFrom": None, "dateTo": None}
+    for key, arg in [("dateFrom", "from"), ("dateTo", "to")]:
+        if request.args.get(arg):
+            arguments[key] = _parseLogDate(request.args.get(arg))
+            if arguments[key] is None:
+                return None, f"{arg} must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS"
+    return arguments, ""
+
+
+@app.get(f'{APP_PREFIX}/api/getDashboardLogs')
+def API_getDashboardLogs():
+    arguments, message = _logPageArguments()
+    if arguments is None:
+        return ResponseObject(False, message)
+    logs, nextCursor = DashboardLogger.getLogsPage(status=request.args.get("status"), ip=request.args.get("ip"),
+                                                   **arguments)
+    return ResponseObject(data={"Logs": logs, "NextCursor": nextCursor})
+
+
+@app.get(f'{APP_PREFIX}/api/getLogArchives')
+def API_getLogArchives():
+    return ResponseObject(data=AllLogRetention.getArchives())
+
+
+@app.get(f'{APP_PREFIX}/api/downloadLogArchive/<archiveName>')
+def API_downloadLogArchive(archiveName):
+    if archiveName not in [a['Name'] for a in AllLogRetention.getArchives()]:
+        response = ResponseObject(False, "Archive does not exist")
+        response.status_code = 404
+        return response
+    return send_from_directory(LogRetention.ArchivePath, archiveName, as_attachment=True,
+                               mimetype="application/gzip")
+
+
 @app.get(f'{APP_PREFIX}/api/getDashboardTheme')
+@publicRoute
 def API_getDashboardTheme():
     return ResponseObject(data=DashboardConfig.GetConfig("Server", "dashboard_theme")[1])
 
 @app.get(f'{APP_PREFIX}/api/getDashboardVersion')
+@publicRoute
 def API_getDashboardVersion():
     return ResponseObject(data=DashboardConfig.GetConfig("Server", "version")[1])
 
@@ -2051,36 +4688,56 @@ def API_getPeerScheduleJobLogs(configName):
     return ResponseObject(data=JobLogger.getLogs(requestAll, configName))
 
 
+@app.get(f'{APP_PREFIX}/api/getPeerScheduleJobLogsPage/<configName>')
+def API_getPeerScheduleJobLogsPage(configName):
+    if configName not in WireguardConfigurations.keys():
+        return ResponseObject(False, "Configuration does not exist")
+    arguments, message = _logPageArguments()
+    if arguments is None:
+        return ResponseObject(False, message)
+    status = request.args.get("status")
+    logs, nextCursor = JobLogger.getLogsPage(configName, job=request.args.get("job"), peer=request.args.get("peer"),
+                                             status=None if status is None else _strToBool(status), **arguments)
+    return ResponseObject(data={"Logs": logs, "NextCursor": nextCursor})
+
+
 
 '''
 Tools
 '''
 
 
+def _peerHosts(peer: Peer) -> list[str]:
+    """
+    The addresses of the single-host networks (/32 and /128) in a peer's allowed IPs, which are the ones that can be
+    pinged
+    """
+    hosts = []
+    for x in peer.allowed_ip.replace(" ", "").split(","):
+        try:
+            ip = ipaddress.ip_network(x, strict=False)
+        except ValueError:
+            print(f"[WGDashboard] {peer.id} - {peer.configuration.Name} has an invalid allowed IP: {x}")
+            continue
+        if ip.num_addresses == 1:
+            hosts.append(str(ip.network_address))
+    return hosts
+
 @app.get(f'{APP_PREFIX}/api/ping/getAllPeersIpAddress')
 def API_ping_getAllPeersIpAddress():
     ips = {}
     for c in WireguardConfigurations.values():
         cips = {}
-        for p in c.Peers:
-            allowed_ip = p.allowed_ip.replace(" ", "").split(",")
-            parsed = []
-            for x in allowed_ip:
-                try:
-                    ip = ipaddress.ip_network(x, strict=False)
-                except ValueError as e:
-                    print(f"{p.id} - {c.Name}")
-                if len(list(ip.hosts())) == 1:
-                    parsed.append(str(ip.hosts()[0]))
+        for p in c.Snapshot.Peers:
             endpoint = p.endpoint.replace(" ", "").replace("(none)", "")
             if len(p.name) > 0:
                 cips[f"{p.name} - {p.id}"] = {
-                    "allowed_ips": parsed,
+                    "allowed_ips": _peerHosts(p),
                     "endpoint": endpoint
                 }
             else:
                 cips[f"{p.id}"] = {
-                    "allowed_ips": parsed,
+                    "allowed_ips": _peerHosts(p),
                     "endpoint": endpoint
                 }
         ips[c.Name] = cips
@@ -2088,37 +4745,88 @@ def API_ping_getAllPeersIpAddress():
 
 import requests
 
+GEO_LOOKUP_URL = "http://ip-api.com/json/%s?field=city"
+GEO_BATCH_URL = "http://ip-api.com/batch?fields=city,country,lat,lon,query"
+GEO_LOOKUP_TIMEOUT = 5
+TRACEROUTE_TIMEOUT = 1
+TRACEROUTE_MAX_HOPS = 64
+
+def _diagnosticCaller() -> str:
+    """
+    Who a diagnostic counts against in Diagnostics: the API key, the signed in session or the client address
+    """
+    apiKey = request.headers.get('wg-dashboard-apikey')
+    if apiKey is not None and len(apiKey) > 0:
+        return f"key:{_hashAPIKey(apiKey)}"
+    if "username" in session:
+        return f"session:{session['username']}"
+    return f"ip:{request.remote_addr}"
+
+def _pingResult(result) -> dict:
+    return {
+        "address": result.address,
+        "is_alive": result.is_alive,
+        "min_rtt": result.min_rtt,
+        "avg_rtt": result.avg_rtt,
+        "max_rtt": result.max_rtt,
+        "package_sent": result.packets_sent,
+        "package_received": result.packets_received,
+        "package_loss": result.packet_loss,
+        "geo": None
+    }
+
+def _tracerouteResult(hops) -> list[dict]:
+    result = []
+    for hop in hops:
+        if len(result) > 1:
+            for i in range(result[-1]["hop"] + 1, hop.distance):
+                result.append(
+                    {
+                        "hop": i,
+                        "ip": "*",
+                        "avg_rtt": "*",
+                        "min_rtt": "*",
+                        "max_rtt": "*"
+                    }
+                )
+        result.append(
+            {
+                "hop": hop.distance,
+                "ip": hop.address,
+                "avg_rtt": hop.avg_rtt,
+                "min_rtt": hop.min_rtt,
+                "max_rtt": hop.max_rtt
+            })
+    return result
+
+def _diagnosticBusy() -> ResponseObject:
+    response = ResponseObject(False, f"Only {DiagnosticLimiter.PerCaller} diagnostics can run at once, "
+                                     f"please wait for one to finish")
+    response.status_code = 429
+    return response
+
 @app.get(f'{APP_PREFIX}/api/ping/execute')
 def API_ping_execute():
     if "ipAddress" in request.args.keys() and "count" in request.args.keys():
         ip = request.args['ipAddress']
         count = request.args['count']
-        try:
-            if ip is not None and len(ip) > 0 and count is not None and count.isnumeric():
-                result = ping(ip, count=int(count), source=None)
-                
-                data = {
-                    "address": result.address,
-                    "is_alive": result.is_alive,
-                    "min_rtt": result.min_rtt,
-                    "avg_rtt": result.avg_rtt,
-                    "max_rtt": result.max_rtt,
-                    "package_sent": result.packets_sent,
-                    "package_received": result.packets_received,
-                    "package_loss": result.packet_loss,
-                    "geo": None
-                }
-                
-                
-                try:
-                    r = requests.get(f"http://ip-api.com/json/{result.address}?field=city")
-                    data['geo'] = r.json()
-                except Exception as e:
-                    pass
-                return ResponseObject(data=data)
+        if ip is None or len(ip) == 0 or count is None or not count.isnumeric():
             return ResponseObject(False, "Please specify an IP Address (v4/v6)")
+        caller = _diagnosticCaller()
+        if not Diagnostics.acquire(caller):
+            return _diagnosticBusy()
+        try:
+            data = _pingResult(ping(ip, count=int(count), source=None))
+            try:
+                r = requests.get(GEO_LOOKUP_URL % data['address'], timeout=GEO_LOOKUP_TIMEOUT)
+                data['geo'] = r.json()
+            except Exception as e:
+                pass
+            return ResponseObject(data=data)
         except Exception as exp:
             return ResponseObject(False, exp)
+        finally:
+            Diagnostics.release(caller)
     return ResponseObject(False, "Please provide ipAddress and count")
 
 
@@ -2126,35 +4834,15 @@ def API_ping_execute():
 def API_traceroute_execute():
     if "ipAddress" in request.args.keys() and len(request.args.get("ipAddress")) > 0:
         ipAddress = request.args.get('ipAddress')
+        caller = _diagnosticCaller()
+        if not Diagnostics.acquire(caller):
+            return _diagnosticBusy()
         try:
-            tracerouteResult = traceroute(ipAddress, timeout=1, max_hops=64)
-            result = []
-            for hop in tracerouteResult:
-                if len(result) > 1:
-                    skipped = False
-                    for i in range(result[-1]["hop"] + 1, hop.distance):
-                        result.append(
-                            {
-                                "hop": i,
-                                "ip": "*",
-                                "avg_rtt": "*",
-                                "min_rtt": "*",
-                                "max_rtt": "*"
-                            }
-                        )
-                        skip = True
-                    if skipped: continue
-                result.append(
-                    {
-                        "hop": hop.distance,
-                        "ip": hop.address,
-                        "avg_rtt": hop.avg_rtt,
-                        "min_rtt": hop.min_rtt,
-                        "max_rtt": hop.max_rtt
-                    })
+            result = _tracerouteResult(
+                traceroute(ipAddress, timeout=TRACEROUTE_TIMEOUT, max_hops=TRACEROUTE_MAX_HOPS))
             try:
-                r = requests.post(f"http://ip-api.com/batch?fields=city,country,lat,lon,query",
-                                  data=json.dumps([x['ip'] for x in result]))
+                r = requests.post(GEO_BATCH_URL, data=json.dumps([x['ip'] for x in result]),
+                                  timeout=GEO_LOOKUP_TIMEOUT)
                 d = r.json()
                 for i in range(len(result)):
                     result[i]['geo'] = d[i]
@@ -2164,9 +4852,99 @@ def API_traceroute_execute():
             return ResponseObject(data=result)
         except Exception as exp:
             return ResponseObject(False, exp)
+        finally:
+            Diagnostics.release(caller)
     else:
         return ResponseObject(False, "Please provide ipAddress")
 
+SWEEP_CONCURRENCY = 64
+SWEEP_MAX_CONCURRENCY = 512
+SWEEP_TIMEOUT = 1
+SWEEP_MAX_TIMEOUT = 10
+SWEEP_MAX_COUNT = 5
+SWEEP_INTERVAL = 0.2
+
+def _sweepRequest(args: dict) -> tuple[dict[str, list[tuple[Peer, str]]], int, float, int]:
+    """
+    The hosts to sweep, grouped by configuration, and the concurrency, per host timeout and count from the query.
+    Raises ValueError with a message for the client
+    """
+    configurationName = args.get("configurationName")
+    if configurationName:
+        if configurationName not in WireguardConfigurations.keys():
+            raise ValueError("Configuration does not exist")
+        configurations = [WireguardConfigurations[configurationName]]
+    else:
+        configurations = list(WireguardConfigurations.values())
+    try:
+        concurrency = int(args.get("concurrency", SWEEP_CONCURRENCY))
+        timeout = float(args.get("timeout", SWEEP_TIMEOUT))
+        count = int(args.get("count", 1))
+    except ValueError:
+        raise ValueError("concurrency, timeout and count must be numbers")
+    if not 1 <= concurrency <= SWEEP_MAX_CONCURRENCY:
+        raise ValueError(f"concurrency must be between 1 and {SWEEP_MAX_CONCURRENCY}")
+    if not 0 < timeout <= SWEEP_MAX_TIMEOUT:
+        raise ValueError(f"timeout must be between 0 and {SWEEP_MAX_TIMEOUT} seconds")
+    if not 1 <= count <= SWEEP_MAX_COUNT:
+        raise ValueError(f"count must be between 1 and {SWEEP_MAX_COUNT}")
+    targets = {c.Name: [(p, h) for p in c.Snapshot.Peers for h in _peerHosts(p)] for c in configurations}
+    return targets, concurrency, timeout, count
+
+async def sweepPeers(targets: dict[str, list[tuple[Peer, str]]], concurrency: int, timeout: float, count: int):
+    """
+    Ping every host in targets with async_multiping, concurrency hosts at a time, yielding one line per host as each
+    batch completes and a summary line after each configuration
+    """
+    for name, hosts in targets.items():
+        alive = 0
+        for i in range(0, len(hosts), concurrency):
+            batch = hosts[i:i + concurrency]
+            results = await async_multiping([h for _, h in batch], count=count, interval=SWEEP_INTERVAL,
+                                            timeout=timeout, concurrent_tasks=concurrency)
+            for (peer, _), result in zip(batch, results):
+                alive += result.is_alive
+                line = {"configuration": name, "id": peer.id, "name": peer.name, **_pingResult(result)}
+                del line["geo"]
+                yield line
+        yield {"configuration": name, "hosts": len(hosts), "alive": alive, "done": True}
+
+def _sweepLines(sweep) -> str:
+    """
+    Drive a sweepPeers generator on an event loop of its own, for the WSGI workers
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                line = loop.run_until_complete(anext(sweep))
+            except StopAsyncIteration:
+                return
+            except Exception as exp:
+                yield json.dumps({"error": str(exp)}) + "\n"
+                return
+            yield json.dumps(line) + "\n"
+    finally:
+        loop.run_until_complete(sweep.aclose())
+        loop.close()
+
+@app.get(f'{APP_PREFIX}/api/ping/sweep')
+def API_ping_sweep():
+    """
+    Ping every peer's /32 and /128 allowed IPs, streamed back as newline delimited JSON
+    """
+    try:
+        targets, concurrency, timeout, count = _sweepRequest(request.args)
+    except ValueError as e:
+        return ResponseObject(False, str(e))
+    caller = _diagnosticCaller()
+    if not Diagnostics.acquire(caller):
+        return _diagnosticBusy()
+    response = app.response_class(_sweepLines(sweepPeers(targets, concurrency, timeout, count)),
+                                  mimetype="application/x-ndjson")
+    response.call_on_close(lambda: Diagnostics.release(caller))
+    return response
+
 @app.get(f'{APP_PREFIX}/api/getDashboardUpdate')
 def API_getDashboardUpdate():
     import urllib.request as req
@@ -2190,6 +4968,7 @@ Sign Up
 '''
 
 @app.get(f'{APP_PREFIX}/api/isTotpEnabled')
+@publicRoute
 def API_isTotpEnabled():
     return (
         ResponseObject(data=DashboardConfig.GetConfig("Account", "enable_totp")[1] and DashboardConfig.GetConfig("Account", "totp_verified")[1]))
@@ -2210,8 +4989,9 @@ def API_Welcome_VerifyTotpLink():
     data = request.get_json()
     totp = pyotp.TOTP(DashboardConfig.GetConfig("Account", "totp_key")[1]).now()
     if totp == data['totp']:
-        DashboardConfig.SetConfig("Account", "totp_verified", "true")
-        DashboardConfig.SetConfig("Account", "enable_totp", "true")
+        with DashboardConfig.batch():
+            DashboardConfig.SetConfig("Account", "totp_verified", "true")
+            DashboardConfig.SetConfig("Account", "enable_totp", "true")
     return ResponseObject(totp == data['totp'])
 
 
@@ -2225,17 +5005,18 @@ def API_Welcome_Finish():
         if data["newPassword"] == "" or len(data["newPassword"]) < 8:
             return ResponseObject(False, "Password must be at least 8 characters")
 
-        updateUsername, updateUsernameErr = DashboardConfig.SetConfig("Account", "username", data["username"])
-        updatePassword, updatePasswordErr = DashboardConfig.SetConfig("Account", "password",
-                                                                      {
-                                                                          "newPassword": data["newPassword"],
-                                                                          "repeatNewPassword": data["repeatNewPassword"],
-                                                                          "currentPassword": "admin"
-                                                                      })
-        if not updateUsername or not updatePassword:
-            return ResponseObject(False, f"{updateUsernameErr},{updatePasswordErr}".strip(","))
-
-        DashboardConfig.SetConfig("Other", "welcome_session", False)
+        with DashboardConfig.batch():
+            updateUsername, updateUsernameErr = DashboardConfig.SetConfig("Account", "username", data["username"])
+            updatePassword, updatePasswordErr = DashboardConfig.SetConfig("Account", "password",
+                                                                          {
+                                                                              "newPassword": data["newPassword"],
+                                                                              "repeatNewPassword": data["repeatNewPassword"],
+                                                                              "currentPassword": "admin"
+                                                                          })
+            if not updateUsername or not updatePassword:
+                return ResponseObject(False, f"{updateUsernameErr},{updatePasswordErr}".strip(","))
+
+            DashboardConfig.SetConfig("Other", "welcome_session", False)
     return ResponseObject()
 
 class Locale:
@@ -2266,10 +5047,12 @@ class Locale:
 Locale = Locale()
 
 @app.get(f'{APP_PREFIX}/api/locale')
+@publicRoute
 def API_Locale_CurrentLang():    
     return ResponseObject(data=Locale.getLanguage())
 
 @app.get(f'{APP_PREFIX}/api/locale/available')
+@publicRoute
 def API_Locale_Available():
     return ResponseObject(data=Locale.activeLanguages)
         
@@ -2283,6 +5066,7 @@ def API_Locale_Update():
     
 
 @app.get(f'{APP_PREFIX}/')
+@publicRoute
 def index():
     """
     Index page related
@@ -2296,35 +5080,161 @@ def backGroundThread():
     time.sleep(10)
     while True:
         with app.app_context():
-            for c in WireguardConfigurations.values():
+            try:
+                _syncConfigurationList()
+            except Exception as e:
+                print(f"[WGDashboard] Background Thread #1 Error: {str(e)}", flush=True)
+            for c in list(WireguardConfigurations.values()):
                 if c.getStatus():
                     try:
-                        c.getPeersTransfer()
-                        c.getPeersLatestHandshake()
-                        c.getPeersEndpoint()
-                        c.getPeersList()
-                        c.getRestrictedPeersList()
+                        # The job runner changes the same peers, allocator and trie under this lock
+                        with AllOperations.lock(c.Name):
+                            c.getPeersTransfer()
+                            c.getPeersLatestHandshake()
+                            c.getPeersEndpoint()
+                            c.getPeersList()
+                            c.getRestrictedPeersList()
+                            c.publishPeerState()
                     except Exception as e:
                         print(f"[WGDashboard] Background Thread #1 Error: {str(e)}", flush=True)
         time.sleep(10)
 
+def snapshotBackgroundThread():
+    """
+    Keeps the peer snapshots of a web worker up to date with the collector and the other workers
+    """
+    while True:
+        with app.app_context():
+            for c in list(WireguardConfigurations.values()):
+                try:
+                    c.refreshSnapshot()
+                except Exception as e:
+                    print(f"[WGDashboard] Snapshot Thread Error: {str(e)}", flush=True)
+        time.sleep(1)
+
 def peerJobScheduleBackgroundThread():
     with app.app_context():
         print(f"[WGDashboard] Background Thread #2 Started", flush=True)
         time.sleep(10)
-        while True:
-            AllPeerJobs.runJob()
-            time.sleep(180)
+        AllPeerJobs.schedule()
 
 def gunicornConfig():
     _, app_ip = DashboardConfig.GetConfig("Server", "app_ip")
     _, app_port = DashboardConfig.GetConfig("Server", "app_port")
-    return app_ip, app_port
+    _, app_workers = DashboardConfig.GetConfig("Server", "app_workers")
+    _, app_threads = DashboardConfig.GetConfig("Server", "app_threads")
+    _, app_server = DashboardConfig.GetConfig("Server", "app_server")
+    return app_ip, app_port, max(1, int(app_workers)), max(1, int(app_threads)), app_server
+
+class CollectorProcess:
+    """
+    Runs the transfer poller, the peer job scheduler, log retention and queued operations left over from a restart
+    in one process next to the gunicorn workers, so they run once no matter how many workers serve requests.
+    It is forked from the gunicorn master and started again if it exits
+    """
+    RestartDelay = 5
+    StopTimeout = 10
+
+    def __init__(self):
+        self.__pid: int | None = None
+        self.__stopping = threading.Event()
+        self.__inheritedFds: list[int] = []
+
+    def start(self, inheritedFds: list[int] = None):
+        """
+        @param inheritedFds: Descriptors of the forking process the collector must not keep open, e.g. the
+                             gunicorn listeners
+        """
+        self.__inheritedFds = list(inheritedFds or [])
+        threading.Thread(target=self.__supervise, daemon=True).start()
+
+    def stop(self):
+        self.__stopping.set()
+        if self.__pid is None:
+            return
+        try:
+            os.kill(self.__pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.time() + CollectorProcess.StopTimeout
+        while time.time() < deadline and self.__alive():
+            time.sleep(0.1)
+
+    def __alive(self) -> bool:
+        try:
+            os.kill(self.__pid, 0)
+            return os.waitpid(self.__pid, os.WNOHANG) == (0, 0)
+        except (ProcessLookupError, ChildProcessError):
+            return False
+
+    def __supervise(self):
+        while not self.__stopping.is_set():
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    CollectorProcess.__detach(self.__inheritedFds)
+                    CollectorProcess.run()
+                except SystemExit as e:
+                    code = e.code or 0
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+                os._exit(code)
+            self.__pid = pid
+            print(f"[WGDashboard] Collector started with PID {pid}", flush=True)
+            try:
+                _, status = os.waitpid(pid, 0)
+                code = os.waitstatus_to_exitcode(status)
+            except ChildProcessError:
+                # The gunicorn master reaps every child it gets SIGCHLD for
+                code = None
+            if not self.__stopping.is_set():
+                print(f"[WGDashboard] Collector exited with code {code}, restarting in "
+                      f"{CollectorProcess.RestartDelay} seconds", flush=True)
+                self.__stopping.wait(CollectorProcess.RestartDelay)
+
+    @staticmethod
+    def __detach(inheritedFds: list[int]):
+        """
+        Drop what the child inherited from the gunicorn master: its signal handlers, which would queue every
+        SIGCHLD of the collector's own `wg` calls on the master's copied signal queue that nothing drains, and its
+        listening sockets
+        """
+        for signum in signal.valid_signals():
+            try:
+                if callable(signal.getsignal(signum)):
+                    signal.signal(signum, signal.SIG_DFL)
+            except (OSError, ValueError):
+                pass
+        for fd in inheritedFds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    @staticmethod
+    def run():
+        def terminate(signum, frame):
+            raise SystemExit(0)
+        signal.signal(signal.SIGTERM, terminate)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        master = os.getppid()
+        DashboardLogger.start()
+        startCollector()
+        try:
+            # Do not outlive the master if it is killed without running on_exit
+            while os.getppid() == master:
+                time.sleep(CollectorProcess.RestartDelay)
+        finally:
+            DashboardLogger.flush()
 
 AllPeerShareLinks: PeerShareLinks = PeerShareLinks()
+AllOperations: DashboardOperations = DashboardOperations()
 AllPeerJobs: PeerJobs = PeerJobs()
 JobLogger: PeerJobLogger = PeerJobLogger()
 DashboardLogger: DashboardLogger = DashboardLogger()
+AllLogRetention: LogRetention = LogRetention()
 _, app_ip = DashboardConfig.GetConfig("Server", "app_ip")
 _, app_port = DashboardConfig.GetConfig("Server", "app_port")
 _, WG_CONF_PATH = DashboardConfig.GetConfig("Server", "wg_conf_path")
@@ -2333,6 +5243,22 @@ WireguardConfigurations: dict[str, WireguardConfiguration] = {}
 _getConfigurationList()
 
 def startThreads():
+    """
+    Threads every process serving requests needs
+    """
+    DashboardLogger.start()
+    atexit.register(DashboardLogger.flush)
+    atexit.register(LoginAttempts.shutdown)
+    snapshotThread = threading.Thread(target=snapshotBackgroundThread)
+    snapshotThread.daemon = True
+    snapshotThread.start()
+
+def startCollector():
+    """
+    Threads that must run once per install, in the collector process under gunicorn
+    """
+    AllLogRetention.start()
+    AllOperations.resume()
     bgThread = threading.Thread(target=backGroundThread)
     bgThread.daemon = True
     bgThread.start()
@@ -2342,6 +5268,9 @@ def startThreads():
     scheduleJobThread.start()
 
 
+Collector: CollectorProcess = CollectorProcess()
+
 if __name__ == "__main__":
     startThreads()
+    startCollector()
     app.run(host=app_ip, debug=False, port=app_port)
\ No newline at end of file
@@ -2,25 +2,38 @@ import dashboard
 from datetime import datetime
 
 global sqldb, cursor, DashboardConfig, WireguardConfigurations, AllPeerJobs, JobLogger
-app_host, app_port = dashboard.gunicornConfig()
+app_host, app_port, app_workers, app_threads, app_server = dashboard.gunicornConfig()
 date = datetime.today().strftime('%Y_%m_%d_%H_%M_%S')
 
 
+def when_ready(server):
+    dashboard.Collector.start([listener.fileno() for listener in server.LISTENERS])
+
+
 def post_worker_init(worker):
     dashboard.startThreads()
 
 
-worker_class = 'gthread'
-workers = 1
-threads = 1
+def on_exit(server):
+    dashboard.Collector.stop()
+
+
+if app_server == "asgi":
+    # Diagnostics run on the event loop, the other routes in a pool of app_threads threads
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    wsgi_app = "asgi:application"
+else:
+    worker_class = 'gthread'
+    wsgi_app = "dashboard:app"
+workers = app_workers
+threads = app_threads
 bind = f"{app_host}:{app_port}"
 daemon = True
 pidfile = './gunicorn.pid'
-wsgi_app = "dashboard:app"
 accesslog = f"./log/access_{date}.log"
 log_level = "debug"
 capture_output = True
 errorlog = f"./log/error_{date}.log"
-print(f"[WGDashboard] WGDashboard w/ Gunicorn will be running on {bind}", flush=True)
+print(f"[WGDashboard] WGDashboard w/ Gunicorn will be running on {bind} with {workers} {app_server} workers x {threads} threads", flush=True)
 print(f"[WGDashboard] Access log file is at {accesslog}", flush=True)
 print(f"[WGDashboard] Error log file is at {errorlog}", flush=True)
\ No newline at end of file
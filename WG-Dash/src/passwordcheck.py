@@ -0,0 +1,108 @@
+"""
+bcrypt password checks in worker processes.
+
+Each worker runs this file as a script and imports nothing but bcrypt, so a login never loads dashboard, or
+whatever script started it, in another process. A multiprocessing pool cannot promise that, its children import
+the launching __main__ again as __mp_main__. Workers read one JSON request per line on stdin and answer 1 or 0 on
+stdout, and exit when their parent closes stdin.
+"""
+import json
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+
+
+class PasswordCheckWorker:
+    def __init__(self):
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, close_fds=True)
+
+    def check(self, password: str, hashedPassword: str, timeout: float) -> bool:
+        """
+        Raises OSError if the worker is gone and TimeoutError if it does not answer within timeout seconds
+        """
+        self.process.stdin.write(json.dumps({"password": password, "hash": hashedPassword}).encode() + b"\n")
+        self.process.stdin.flush()
+        ready, _, _ = select.select([self.process.stdout], [], [], max(0, timeout))
+        if not ready:
+            raise TimeoutError("Password check timed out")
+        answer = self.process.stdout.readline()
+        if answer not in (b"1\n", b"0\n"):
+            raise BrokenPipeError("Password check worker exited")
+        return answer == b"1\n"
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+
+
+class PasswordCheckPool:
+    """
+    Up to Workers worker processes, started on first use and kept for the next check. A worker that times out or
+    dies is dropped and replaced by the next check that needs one
+    """
+    def __init__(self, workers: int):
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(workers)
+        self.__idle: list[PasswordCheckWorker] = []
+
+    def check(self, password: str, hashedPassword: str, timeout: float) -> bool | None:
+        """
+        None if no worker is free or none answers within timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        if not self.__slots.acquire(timeout=timeout):
+            return None
+        try:
+            # An idle worker may have been killed since its last check, e.g. by the OOM killer, so retry once on a
+            # fresh one
+            for attempt in range(2):
+                worker = self.__take()
+                try:
+                    result = worker.check(password, hashedPassword, deadline - time.monotonic())
+                except TimeoutError:
+                    worker.kill()
+                    return None
+                except OSError:
+                    worker.kill()
+                    continue
+                with self.__lock:
+                    self.__idle.append(worker)
+                return result
+            return None
+        finally:
+            self.__slots.release()
+
+    def __take(self) -> PasswordCheckWorker:
+        with self.__lock:
+            if self.__idle:
+                return self.__idle.pop()
+        return PasswordCheckWorker()
+
+    def close(self):
+        with self.__lock:
+            workers, self.__idle = self.__idle, []
+        for worker in workers:
+            worker.kill()
+
+
+def serve():
+    import bcrypt
+    for line in sys.stdin.buffer:
+        request = json.loads(line)
+        try:
+            valid = bcrypt.checkpw(request["password"].encode("utf-8"), request["hash"].encode("utf-8"))
+        except ValueError:
+            valid = False
+        sys.stdout.buffer.write(b"1\n" if valid else b"0\n")
+        sys.stdout.buffer.flush()
+
+
+if __name__ == "__main__":
+    serve()
@@ -29,6 +29,33 @@ export const WireguardConfigurationsStore = defineStore('WireguardConfigurations
 						unit: "GB",
 						type: 'number'
 					},
+					{
+						display: GetLocale("Receive Rate"),
+						value: "rate_receive",
+						unit: "Mbit/s:min",
+						placeholder: "50:10",
+						type: 'rate'
+					},
+					{
+						display: GetLocale("Send Rate"),
+						value: "rate_sent",
+						unit: "Mbit/s:min",
+						placeholder: "50:10",
+						type: 'rate'
+					},
+					{
+						display: GetLocale("Total Rate"),
+						value: "rate_data",
+						unit: "Mbit/s:min",
+						placeholder: "50:10",
+						type: 'rate'
+					},
+					{
+						display: GetLocale("Idle"),
+						value: "idle",
+						unit: "Days",
+						type: 'number'
+					},
 					{
 						display: GetLocale("Date"),
 						value: "date",
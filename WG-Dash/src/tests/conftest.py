@@ -0,0 +1,30 @@
+"""
+Points dashboard at a throwaway configuration directory before any test imports it. dashboard loads its locale
+files relative to the working directory, so the tests run from WG-Dash/src.
+"""
+import os
+import sys
+import tempfile
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIGURATION_PATH = tempfile.mkdtemp(prefix="wgdashboard-test-")
+
+os.makedirs(os.path.join(CONFIGURATION_PATH, "dashboard_config"))
+os.makedirs(os.path.join(CONFIGURATION_PATH, "wireguard"))
+with open(os.path.join(CONFIGURATION_PATH, "dashboard_config", "wg-dashboard.ini"), "w") as f:
+    f.write(f"[Server]\nwg_conf_path = {os.path.join(CONFIGURATION_PATH, 'wireguard')}\n")
+
+os.environ.update({
+    "CONFIGURATION_PATH": CONFIGURATION_PATH,
+    "WGD_USER": "admin",
+    "WGD_PASS": "admin",
+    "WGD_REMOTE_ENDPOINT": "127.0.0.1",
+    "WGD_REMOTE_ENDPOINT_PORT": "10086",
+    "WGD_DNS": "1.1.1.1",
+    "WGD_PEER_ENDPOINT_ALLOWED_IP": "0.0.0.0/0",
+    "WGD_KEEP_ALIVE": "21",
+    "WGD_MTU": "1420",
+    "WGD_WELCOME_SESSION": "false"
+})
+os.chdir(SRC)
+sys.path.insert(0, SRC)
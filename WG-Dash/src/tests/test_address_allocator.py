@@ -0,0 +1,79 @@
+import ipaddress
+
+import pytest
+
+import dashboard
+
+
+@pytest.mark.parametrize("pool", [dashboard.BitmapAddressPool, dashboard.IntervalAddressPool])
+def test_pool_skips_network_and_broadcast(pool):
+    p = pool(ipaddress.ip_network("10.0.0.0/29"))
+    assert p.freeCount() == 6
+    assert p.nextFree(0) == 1
+    for offset in range(1, 7):
+        assert p.markUsed(offset)
+    assert p.nextFree(0) is None
+    assert p.freeCount() == 0
+
+
+@pytest.mark.parametrize("pool", [dashboard.BitmapAddressPool, dashboard.IntervalAddressPool])
+def test_pool_mark_release_next_free(pool):
+    p = pool(ipaddress.ip_network("10.0.0.0/22"))
+    assert p.markUsed(5)
+    assert not p.markUsed(5)
+    assert p.isUsed(5)
+    for offset in range(1, 200):
+        p.markUsed(offset)
+    assert p.nextFree(0) == 200
+    assert p.nextFree(150) == 200
+    assert p.release(64)
+    assert not p.release(64)
+    assert p.nextFree(0) == 64
+    assert p.nextFree(65) == 200
+    assert p.freeCount() == 1022 - 199 + 1
+    # Network and broadcast addresses can never be released
+    assert not p.release(0)
+    assert not p.release(1023)
+
+
+def test_bitmap_pool_finds_free_word_across_the_tree():
+    p = dashboard.BitmapAddressPool(ipaddress.ip_network("10.0.0.0/16"))
+    for offset in range(1, 40000):
+        p.markUsed(offset)
+    assert p.nextFree(0) == 40000
+    p.release(12345)
+    assert p.nextFree(0) == 12345
+    assert p.nextFree(12346) == 40000
+
+
+def test_interval_pool_merges_and_splits_ranges():
+    p = dashboard.IntervalAddressPool(ipaddress.ip_network("fd00::/64"))
+    for offset in [3, 1, 2, 5, 4]:
+        assert p.markUsed(offset)
+    assert p.nextFree(1) == 6
+    assert p.release(3)
+    assert p.nextFree(1) == 3
+    assert p.nextFree(4) == 6
+    assert p.freeCount() == 2 ** 64 - 1 - 4
+
+
+def test_allocator_allocates_and_releases():
+    allocator = dashboard.AddressAllocator("10.0.0.1/29, fd00::1/120")
+    # 10.0.0.1 is the interface itself
+    assert not allocator.isAvailable("10.0.0.1")
+    assert allocator.allocate(3) == ["10.0.0.2/32", "10.0.0.3/32", "10.0.0.4/32"]
+    assert allocator.allocate(4) == ["10.0.0.5/32", "10.0.0.6/32", "fd00::2/128", "fd00::3/128"]
+    allocator.release("10.0.0.3/32")
+    assert allocator.isAvailable("10.0.0.3")
+    assert allocator.allocate(1) == ["10.0.0.3/32"]
+    assert allocator.allocate(1000) == []
+
+
+def test_allocator_keeps_shared_addresses_until_every_owner_released():
+    allocator = dashboard.AddressAllocator("10.0.0.1/24")
+    allocator.markUsed("10.0.0.9/32")
+    allocator.markUsed("10.0.0.9/32")
+    allocator.release("10.0.0.9/32")
+    assert not allocator.isAvailable("10.0.0.9")
+    allocator.release("10.0.0.9/32")
+    assert allocator.isAvailable("10.0.0.9")
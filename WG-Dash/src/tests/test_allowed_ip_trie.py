@@ -0,0 +1,35 @@
+import dashboard
+
+
+def test_overlaps_finds_supernets_subnets_and_equal_networks():
+    trie = dashboard.AllowedIPTrie()
+    trie.insert("10.0.0.0/8", "a")
+    trie.insert("10.1.2.3/32, fd00::/64", "b")
+    trie.insert("192.168.1.0/24", "c")
+    assert sorted(trie.overlaps("10.1.0.0/16")) == [("10.0.0.0/8", "a"), ("10.1.2.3/32", "b")]
+    assert trie.overlaps("192.168.1.128/25") == [("192.168.1.0/24", "c")]
+    assert trie.overlaps("192.168.2.0/24") == []
+    assert trie.overlaps("fd00::1/128") == [("fd00::/64", "b")]
+    assert len(trie.overlaps("0.0.0.0/0", limit=2)) == 2
+
+
+def test_overlaps_skips_excluded_owner_and_removed_entries():
+    trie = dashboard.AllowedIPTrie()
+    trie.insert("10.0.0.2/32", "a")
+    trie.insert("10.0.0.2/32", "b")
+    assert trie.overlaps("10.0.0.2/32", exclude="a") == [("10.0.0.2/32", "b")]
+    trie.remove("10.0.0.2/32", "b")
+    assert not trie.hasOverlap("10.0.0.2/32", exclude="a")
+    trie.remove("10.0.0.2/32", "a")
+    assert not trie.hasOverlap("10.0.0.0/24")
+    # Removing what is not there leaves the trie alone
+    trie.remove("10.0.0.3/32", "a")
+    trie.insert("10.0.0.3/32", "c")
+    assert trie.hasOverlap("10.0.0.0/24")
+
+
+def test_invalid_entries_are_ignored():
+    trie = dashboard.AllowedIPTrie()
+    trie.insert("not an ip, 10.0.0.1/32", "a")
+    assert trie.overlaps("garbage") == []
+    assert trie.overlaps("10.0.0.1") == [("10.0.0.1/32", "a")]
@@ -0,0 +1,42 @@
+import types
+
+import pytest
+
+import dashboard
+
+
+@pytest.fixture
+def configuration(monkeypatch):
+    allocator = dashboard.AddressAllocator("10.0.0.1/28, fd00::1/64")
+    allocator.markUsed("10.0.0.3/32")
+    monkeypatch.setitem(dashboard.WireguardConfigurations, "page", types.SimpleNamespace(AddressAllocator=allocator))
+    return allocator
+
+
+def test_cursor_walks_every_free_address_once(configuration):
+    seen, cursor = [], None
+    while True:
+        status, _, page = dashboard._getWireguardConfigurationAvailableIPPage("page", cursor, 4)
+        assert status
+        seen += page["IPs"]
+        cursor = page["NextCursor"]
+        if len(seen) >= 20 or cursor is None:
+            break
+    assert seen[:13] == [f"10.0.0.{i}/32" for i in [2] + list(range(4, 15))] + ["fd00::2/128"]
+    assert len(seen) == len(set(seen))
+
+
+def test_start_address_and_invalid_cursor(configuration):
+    _, _, page = dashboard._getWireguardConfigurationAvailableIPPage("page", limit=2, start="10.0.0.13")
+    assert page["IPs"] == ["10.0.0.13/32", "10.0.0.14/32"]
+    assert page["NextCursor"] == "1:2"
+    assert not dashboard._getWireguardConfigurationAvailableIPPage("page", "x:1")[0]
+    assert not dashboard._getWireguardConfigurationAvailableIPPage("page", start="192.168.0.1")[0]
+
+
+def test_random_mode_samples_ipv6(configuration):
+    _, _, page = dashboard._getWireguardConfigurationAvailableIPPage("page", limit=20, mode="random")
+    assert len(page["IPs"]) == 20
+    assert page["IPs"][:12] == [f"10.0.0.{i}/32" for i in [2] + list(range(4, 15))]
+    assert all(ip.startswith("fd00::") for ip in page["IPs"][12:])
+    assert page["NextCursor"] is None
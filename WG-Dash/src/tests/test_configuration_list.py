@@ -0,0 +1,34 @@
+import os
+
+import dashboard
+
+
+class FakeConfiguration:
+    class InvalidConfigurationFileException(Exception):
+        pass
+
+    def __init__(self, name: str):
+        if name == "broken":
+            raise FakeConfiguration.InvalidConfigurationFileException()
+        self.Name = name
+
+
+def test_sync_adds_new_and_drops_deleted_configurations(monkeypatch):
+    path = dashboard.DashboardConfig.GetConfig("Server", "wg_conf_path")[1]
+    monkeypatch.setattr(dashboard, "WireguardConfiguration", FakeConfiguration)
+    monkeypatch.setattr(dashboard, "WireguardConfigurations", {})
+    for name in ["wg0", "wg1", "broken"]:
+        open(os.path.join(path, f"{name}.conf"), "w").close()
+    try:
+        dashboard._syncConfigurationList()
+        assert sorted(dashboard.WireguardConfigurations) == ["wg0", "wg1"]
+        wg0 = dashboard.WireguardConfigurations["wg0"]
+        os.remove(os.path.join(path, "wg1.conf"))
+        dashboard._syncConfigurationList()
+        assert list(dashboard.WireguardConfigurations) == ["wg0"]
+        # Known configurations are kept, not rebuilt
+        assert dashboard.WireguardConfigurations["wg0"] is wg0
+    finally:
+        for name in ["wg0", "wg1", "broken"]:
+            if os.path.exists(os.path.join(path, f"{name}.conf")):
+                os.remove(os.path.join(path, f"{name}.conf"))
@@ -0,0 +1,49 @@
+import dashboard
+
+
+def test_migrate_is_idempotent_and_resumes(tmp_path):
+    database = dashboard.SQLiteConnectionManager(str(tmp_path / "test.db"))
+    applied = []
+
+    def create(conn):
+        applied.append(1)
+        conn.execute("CREATE TABLE Things (id INTEGER PRIMARY KEY, name VARCHAR)")
+
+    def index(conn):
+        applied.append(2)
+        conn.execute("CREATE INDEX Things_name ON Things (name)")
+
+    assert database.migrate("Things", [create]) == 1
+    assert database.migrate("Things", [create]) == 1
+    assert database.migrate("Things", [create, index]) == 2
+    assert database.migrate("Things", [create, index]) == 2
+    assert applied == [1, 2]
+    assert database.execute("SELECT Version FROM schema_version WHERE Scope = 'Things'").fetchone()["Version"] == 2
+
+
+def test_failed_migration_is_rolled_back_and_retried(tmp_path):
+    database = dashboard.SQLiteConnectionManager(str(tmp_path / "test.db"))
+    attempts = []
+
+    def create(conn):
+        conn.execute("CREATE TABLE Things (id INTEGER PRIMARY KEY)")
+
+    def broken(conn):
+        attempts.append(1)
+        conn.execute("ALTER TABLE Things ADD COLUMN name VARCHAR")
+        if len(attempts) == 1:
+            raise RuntimeError("interrupted")
+
+    try:
+        database.migrate("Things", [create, broken])
+    except RuntimeError:
+        pass
+    columns = [row["name"] for row in database.execute("PRAGMA table_info(Things)").fetchall()]
+    assert columns == ["id"]
+    assert database.migrate("Things", [create, broken]) == 2
+    assert len(attempts) == 2
+
+
+def test_connections_run_in_wal_mode(tmp_path):
+    database = dashboard.SQLiteConnectionManager(str(tmp_path / "test.db"))
+    assert database.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+
+import bcrypt
+
+import passwordcheck
+from conftest import SRC
+
+
+def test_password_check_pool():
+    pool = passwordcheck.PasswordCheckPool(1)
+    try:
+        hashedPassword = bcrypt.hashpw(b"secret", bcrypt.gensalt(4)).decode()
+        assert pool.check("secret", hashedPassword, 15) is True
+        assert pool.check("wrong", hashedPassword, 15) is False
+        assert pool.check("secret", "not a hash", 15) is False
+    finally:
+        pool.close()
+
+
+def test_password_check_pool_replaces_dead_worker():
+    pool = passwordcheck.PasswordCheckPool(1)
+    try:
+        hashedPassword = bcrypt.hashpw(b"secret", bcrypt.gensalt(4)).decode()
+        assert pool.check("secret", hashedPassword, 15) is True
+        pool.close()
+        assert pool.check("secret", hashedPassword, 15) is True
+    finally:
+        pool.close()
+
+
+def test_login_does_not_rerun_direct_run_script(tmp_path):
+    # `python3 dashboard.py` and `python3 asgi.py` run the dashboard as __main__, checking a password must not
+    # import that script again in another process
+    marker = tmp_path / "started"
+    script = tmp_path / "run.py"
+    script.write_text(
+        "import sys\n"
+        f"sys.path.insert(0, {SRC!r})\n"
+        f"open({str(marker)!r}, 'a').write('started\\n')\n"
+        "import dashboard\n"
+        "hashedPassword = dashboard.DashboardConfig.GetConfig('Account', 'password')[1]\n"
+        "print(dashboard.LoginAttempts.verify('admin', hashedPassword), "
+        "dashboard.LoginAttempts.verify('wrong', hashedPassword))\n"
+        "dashboard.LoginAttempts.shutdown()\n")
+    result = subprocess.run([sys.executable, str(script)], cwd=SRC, env=os.environ, capture_output=True,
+                            timeout=120)
+    assert result.returncode == 0, result.stderr.decode()
+    assert result.stdout.decode().strip().splitlines()[-1] == "True False"
+    assert marker.read_text() == "started\n"
@@ -0,0 +1,41 @@
+import heapq
+import uuid
+from datetime import datetime, timedelta
+
+import dashboard
+
+
+def dateJob(configuration: str, operator: str, value: datetime) -> dashboard.PeerJob:
+    return dashboard.PeerJob(str(uuid.uuid4()), configuration, "peer", "date", operator,
+                             value.strftime("%Y-%m-%d %H:%M:%S"), "", None, "restrict")
+
+
+def test_date_jobs_are_due_in_date_order():
+    jobs = dashboard.PeerJobs()
+    now = datetime.now()
+    saved = [dateJob("heap", "lgt", now + timedelta(minutes=m)) for m in [30, 10, 20]]
+    for job in saved:
+        assert jobs.saveJob(job)[0]
+    ids = {job.JobID for job in saved}
+    dueJobs = list(jobs._PeerJobs__dueJobs)
+    order = [heapq.heappop(dueJobs)[2] for _ in range(len(dueJobs))]
+    assert [i for i in order if i in ids] == [saved[1].JobID, saved[2].JobID, saved[0].JobID]
+
+
+def test_eq_date_job_fires_when_the_scheduler_wakes_late():
+    jobs = dashboard.PeerJobs()
+    late = dateJob("late", "eq", datetime.now() - timedelta(seconds=5))
+    future = dateJob("late", "eq", datetime.now() + timedelta(hours=1))
+    assert jobs.saveJob(late)[0] and jobs.saveJob(future)[0]
+    jobs._PeerJobs__collectDueJobs()
+    triggered = jobs._PeerJobs__triggered
+    assert late.JobID in triggered
+    assert future.JobID not in triggered
+    assert future.JobID in [jobID for _, _, jobID in jobs._PeerJobs__dueJobs]
+
+
+def test_job_logs_only_cover_jobs_of_the_configuration():
+    job = dateJob("logs", "lgt", datetime.now() + timedelta(days=1))
+    assert dashboard.AllPeerJobs.saveJob(job)[0]
+    dashboard.JobLogger.log(str(uuid.uuid4()), Message="No such job", Configuration="logs", Peer="peer")
+    assert [log.JobID for log in dashboard.JobLogger.getLogs(False, "logs")] == [job.JobID]
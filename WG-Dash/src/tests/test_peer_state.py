@@ -0,0 +1,40 @@
+import time
+
+import dashboard
+
+
+def peerState(key: str, window: dashboard.PeerTransferWindow | None) -> tuple:
+    return key, "", 0, 0, 0, 0, 0, 0, 0, True, False, window.Minutes if window is not None else None
+
+
+def test_published_minutes_give_short_window_usage(tmp_path):
+    path = str(tmp_path / "wg0.peers")
+    writer, reader = dashboard.PeerStateSegment(path), dashboard.PeerStateSegment(path)
+    now = time.time()
+    busy, quiet = dashboard.PeerTransferWindow(), dashboard.PeerTransferWindow()
+    # One sample every 10 seconds for the last 30 minutes, busy receives 1 GB a minute
+    for step in range(180, -1, -1):
+        timestamp = now - step * 10
+        busy.append(timestamp, (180 - step) / 6, 0)
+        quiet.append(timestamp, 5, 1)
+    writer.publish([peerState("busy", busy), peerState("quiet", quiet), peerState("restricted", None)])
+
+    usage = {key: (receive, sent) for key, receive, sent in reader.usage(now - 10 * 60)}
+    assert 10 <= usage["busy"][0] <= 11
+    assert usage["quiet"] == (0, 0)
+    assert usage["restricted"] == (0, 0)
+    # Longer than the history kept so far, usage since the oldest checkpoint
+    assert 29 <= dict((k, r) for k, r, _ in reader.usage(now - 59 * 60))["busy"] <= 30
+
+
+def test_minutes_follow_peers_to_new_slots(tmp_path):
+    path = str(tmp_path / "wg0.peers")
+    writer, reader = dashboard.PeerStateSegment(path), dashboard.PeerStateSegment(path)
+    now = time.time()
+    window = dashboard.PeerTransferWindow()
+    window.append(now - 300, 0, 0)
+    window.append(now, 2, 0)
+    writer.publish([peerState("a", window)])
+    writer.publish([peerState("b", None), peerState("a", window)])
+    usage = {key: receive for key, receive, _ in reader.usage(now - 240)}
+    assert usage == {"a": 2, "b": 0}
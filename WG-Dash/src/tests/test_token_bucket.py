@@ -0,0 +1,23 @@
+import dashboard
+
+
+def test_refill_is_capped_at_capacity():
+    bucket = dashboard.TokenBucket(5, now=100)
+    bucket.Tokens = 0
+    assert bucket.refill(5, 1, 102) == 2
+    assert bucket.refill(5, 1, 1000) == 5
+    assert bucket.Updated == 1000
+
+
+def test_refill_at_a_fractional_rate():
+    bucket = dashboard.TokenBucket(10, now=0)
+    bucket.Tokens = 0.5
+    assert bucket.refill(10, 10 / 60, 3) == 1.0
+
+
+def test_login_guard_throttles_per_username_and_ip():
+    guard = dashboard.LoginAttempts
+    assert all(guard.allow(f"192.0.2.{i}", "throttled") for i in range(5))
+    assert not guard.allow("192.0.2.100", "throttled")
+    assert all(guard.allow("198.51.100.1", f"user{i}") for i in range(10))
+    assert not guard.allow("198.51.100.1", "another")
@@ -0,0 +1,43 @@
+import pytest
+
+import dashboard
+
+GB = 1024 ** 3
+
+
+def test_rates_in_mbit_per_second():
+    window = dashboard.PeerTransferWindow()
+    for step in range(7):
+        # 10 MB received and 5 MB sent every 10 seconds
+        window.append(step * 10, step * 10 * 1024 ** 2 / GB, step * 5 * 1024 ** 2 / GB)
+    receive = window.rates("rate_receive", 30)
+    assert len(receive) == 3
+    assert receive == pytest.approx([10 * 1024 ** 2 * 8 / 10 ** 6 / 10] * 3)
+    assert window.rates("rate_data", 60) == pytest.approx([15 * 1024 ** 2 * 8 / 10 ** 6 / 10] * 6)
+
+
+def test_rates_need_a_covered_window():
+    window = dashboard.PeerTransferWindow()
+    assert window.rates("rate_receive", 10) is None
+    window.append(0, 0, 0)
+    window.append(10, 1, 0)
+    assert window.rates("rate_receive", 30) is None
+
+
+def test_data_reset_counts_as_no_traffic():
+    window = dashboard.PeerTransferWindow()
+    window.append(0, 5, 5)
+    window.append(10, 0, 0)
+    assert window.rates("rate_data", 10) == [0]
+    assert window.ReceiveRate == 0 and window.SentRate == 0
+
+
+def test_activity_and_minutes():
+    window = dashboard.PeerTransferWindow(LastActivity=5)
+    assert window.append(0, 1, 1)
+    assert not window.append(30, 1, 1)
+    assert window.LastActivity == 5
+    assert window.append(70, 2, 1)
+    assert window.LastActivity == 70
+    assert list(window.Minutes) == [(0, 1, 1), (1, 2, 1)]
+    assert window.idleDays(70 + 86400) == 1
@@ -93,9 +93,8 @@ def deletePeers(config_name, delete_keys, cur, db):
         wg_command.append("remove")
     try:
         print("deleting...")
-        remove_wg = subprocess.check_output(" ".join(wg_command),
-                                            shell=True, stderr=subprocess.STDOUT)
-        save_wg = subprocess.check_output(f"wg-quick save {config_name}", shell=True, stderr=subprocess.STDOUT)
+        remove_wg = dashboard.SystemCommands.run(wg_command)
+        save_wg = dashboard.SystemCommands.run(["wg-quick", "save", config_name])
         cur.executescript(' '.join(sql_command))
         db.commit()
     except subprocess.CalledProcessError as exc: